@@ -84,7 +84,7 @@ def main(args=None):
         LOGGER.info('Starting web server')
         web.app.run(host=args.host, port=args.port)
     except:
-        core.STOP.set()
+        core.stop()
         core.cleanup()
         raise
 
@@ -18,12 +18,16 @@ import json
 
 from flask import (
     Flask,
+    Response,
     request,
 )
 
 from domcontrol_common import (
     core,
     conf,
+    store as mod_store,
+    timing,
+    wire,
 )
 
 
@@ -31,6 +35,26 @@ app = Flask(__name__)
 app_get = functools.partial(app.route, methods=['GET'])
 app_post = functools.partial(app.route, methods=['POST'])
 json_dumps = functools.partial(json.dumps, sort_keys=True, indent=4)
+#: records returned by /store when no limit is passed, a day at 10s
+STORE_LIMIT = 8640
+#: the most records /store returns at once, a week at 10s
+STORE_MAX_LIMIT = 7 * 8640
+
+
+def negotiated_response(document, pack):
+    """
+    Returns the document in the format asked for in the Accept header, plain
+    json if none, the compact formats get it packed with pack first (see
+    wire).
+    """
+    content_type = wire.negotiate(request.accept_mimetypes)
+    if content_type == wire.JSON:
+        return json_dumps(document)
+
+    return Response(
+        wire.dumps(pack(document), content_type),
+        mimetype=content_type,
+    )
 
 
 @app_get('/')
@@ -43,7 +67,268 @@ def get():
     for zone in core.ZONES.values():
         status['zones'].append(zone.to_dict())
 
-    return json_dumps(status)
+    return negotiated_response(status, wire.pack_status)
+
+
+@app_get('/timings')
+def get_timings():
+    if not timing.ENABLED:
+        return 'Timings are disabled, set timings = true to enable', 404
+
+    return json_dumps(timing.get_timings())
+
+
+def query_history(measure_history, metric):
+    try:
+        start = request.args.get('start', None, type=int)
+        end = request.args.get('end', None, type=int)
+        step = request.args.get('step', None, type=int)
+        if request.args.get('stats', False, type=int):
+            return json_dumps(measure_history.stats(
+                metric=metric,
+                start=start,
+                end=end,
+                step=step or 60,
+            ))
+
+        return json_dumps(measure_history.query(
+            metric=metric,
+            start=start,
+            end=end,
+            step=step,
+        ))
+    except KeyError:
+        return (
+            'No history for metric %s, available: %s'
+            % (metric, measure_history.metrics()),
+            404
+        )
+
+
+@app_get('/history/<zone>/<metric>')
+def get_zone_history(zone, metric):
+    try:
+        zone = core.ZONES[zone]
+    except KeyError:
+        return (
+            'Zone %s not found, available: %s' % (zone, core.ZONES.keys()),
+            404
+        )
+
+    return query_history(zone.history, metric)
+
+
+@app_get('/history/<zone>/sensor/<sensor>/<metric>')
+def get_sensor_history(zone, sensor, metric):
+    try:
+        zone = core.ZONES[zone]
+    except KeyError:
+        return (
+            'Zone %s not found, available: %s' % (zone, core.ZONES.keys()),
+            404
+        )
+
+    try:
+        sensor = zone.sensors[sensor]
+    except KeyError:
+        return (
+            'Zone %s has no sensor named %s, available: %s'
+            % (zone.name, sensor, zone.sensors.keys()),
+            404
+        )
+
+    return query_history(sensor.history, metric)
+
+
+def get_series(zone_name, metric):
+    """
+    Returns:
+        tuple: the timestamps and values arrays for the metric of the zone
+            in the start/end range of the request, or the error response
+    """
+    # imported here, numpy is only needed for the stats, not to run the agent
+    try:
+        from domcontrol_common import analytics
+    except ImportError as err:
+        return None, ('Stats not available, numpy is needed: %s' % err, 501)
+
+    try:
+        zone = core.ZONES[zone_name]
+    except KeyError:
+        return None, (
+            'Zone %s not found, available: %s'
+            % (zone_name, core.ZONES.keys()),
+            404
+        )
+
+    try:
+        return analytics.get_series(
+            zone,
+            metric,
+            start=request.args.get('start', None, type=int),
+            end=request.args.get('end', None, type=int),
+        ), None
+    except KeyError:
+        return None, (
+            'No history for metric %s, available: %s'
+            % (metric, zone.history.metrics()),
+            404
+        )
+
+
+def get_percentiles():
+    from domcontrol_common import analytics
+
+    percentiles = request.args.get('percentiles', None)
+    if not percentiles:
+        return analytics.DEFAULT_PERCENTILES
+
+    return [float(percent) for percent in percentiles.split(',')]
+
+
+@app_get('/stats/<zone>/<metric>')
+def get_stats(zone, metric):
+    """
+    Summary (count, min, max, mean, std and percentiles) of the metric, with
+    the rate of change per hour and, if threshold is passed, the seconds it
+    was above it.
+    """
+    series, error = get_series(zone, metric)
+    if error:
+        return error
+
+    from domcontrol_common import analytics
+
+    timestamps, values = series
+    stats = analytics.summary(timestamps, values, get_percentiles())
+    stats['rate'] = analytics.summary(
+        *analytics.rate_of_change(timestamps, values),
+        percentiles=()
+    )
+    threshold = request.args.get('threshold', None, type=float)
+    if threshold is not None:
+        stats['time_above'] = analytics.time_above(
+            timestamps,
+            values,
+            threshold,
+        )
+
+    return json_dumps(stats)
+
+
+@app_get('/stats/<zone>/<metric>/rolling')
+def get_rolling_mean(zone, metric):
+    series, error = get_series(zone, metric)
+    if error:
+        return error
+
+    from domcontrol_common import analytics
+
+    timestamps, values = series
+    means = analytics.rolling_mean(
+        timestamps,
+        values,
+        window=request.args.get('window', 3600, type=int),
+    )
+    timestamps, means = analytics.resample_last(
+        timestamps,
+        means,
+        step=request.args.get('step', None, type=int),
+    )
+    return json_dumps(zip(timestamps.astype(int).tolist(), means.tolist()))
+
+
+@app_get('/stats/<zone>/<metric>/rate')
+def get_rate(zone, metric):
+    series, error = get_series(zone, metric)
+    if error:
+        return error
+
+    from domcontrol_common import analytics
+
+    timestamps, rates = analytics.rate_of_change(
+        *series,
+        per=request.args.get('per', 3600, type=int)
+    )
+    timestamps, rates = analytics.resample_last(
+        timestamps,
+        rates,
+        step=request.args.get('step', None, type=int),
+    )
+    return json_dumps(zip(timestamps.astype(int).tolist(), rates.tolist()))
+
+
+@app_get('/stats/<zone>/<metric>/daily')
+def get_daily_stats(zone, metric):
+    """
+    Summary of each day (or period seconds), so the master can show them
+    without pulling the whole series.
+    """
+    series, error = get_series(zone, metric)
+    if error:
+        return error
+
+    from domcontrol_common import analytics
+
+    return json_dumps(analytics.period_summaries(
+        *series,
+        period=request.args.get('period', 86400, type=int),
+        percentiles=get_percentiles(),
+        threshold=request.args.get('threshold', None, type=float)
+    ))
+
+
+@app_get('/store/<zone>')
+def get_store(zone):
+    """
+    Returns the stored records of the zone, as json by default, or the raw
+    records with format=raw, straight from the store files, see
+    store.record_struct for their format, that is sent in the
+    X-Record-Format header, the metrics are sent in X-Metrics.
+
+    Only the newest limit records in the range are returned, STORE_LIMIT by
+    default and at most STORE_MAX_LIMIT, page back with end to get older
+    ones.
+    """
+    try:
+        zone = core.ZONES[zone]
+    except KeyError:
+        return (
+            'Zone %s not found, available: %s' % (zone, core.ZONES.keys()),
+            404
+        )
+
+    if zone.store is None:
+        return 'No store configured, set store_dir to enable', 404
+
+    start = request.args.get('start', None, type=int)
+    end = request.args.get('end', None, type=int)
+    limit = min(
+        request.args.get('limit', STORE_LIMIT, type=int),
+        STORE_MAX_LIMIT,
+    )
+    if request.args.get('format', 'json') != 'raw':
+        return json_dumps(zone.store.query(start=start, end=end, limit=limit))
+
+    views = [
+        view
+        for metrics, view in zone.store.views(
+            start=start,
+            end=end,
+            limit=limit,
+        )
+        if metrics == zone.store.metrics
+    ]
+    return Response(
+        (str(view) for view in views),
+        mimetype='application/octet-stream',
+        headers={
+            'X-Record-Format': mod_store.record_struct(
+                zone.store.metrics
+            ).format,
+            'X-Metrics': ','.join(zone.store.metrics),
+        },
+    )
 
 
 @app_get('/<zone>')
@@ -66,7 +351,7 @@ def get_elem(zone, elem_type=None, elem_name=None, attr_name=None):
         return json_dumps(zone.to_dict())
 
     if elem_type == 'last_measure':
-        return json_dumps(zone.last_measure)
+        return json_dumps(zone.last_measure and zone.last_measure.to_dict())
 
     try:
         elems = getattr(zone, elem_type + 's').values()
@@ -122,9 +407,11 @@ def get_elem(zone, elem_type=None, elem_name=None, attr_name=None):
 def get_measures():
     measures = {}
     for zone_name, zone in core.ZONES.items():
-        measures[zone_name] = zone.last_measure
+        measures[zone_name] = (
+            zone.last_measure and zone.last_measure.to_dict()
+        )
 
-    return json_dumps(measures)
+    return negotiated_response(measures, wire.pack_measures)
 
 
 @app_post('/<zone>/actor/<elem_name>/<attr_name>')
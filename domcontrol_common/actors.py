@@ -20,6 +20,7 @@ import sys
 from functools import partial
 
 from . import (
+    schedule as mod_schedule,
     utils,
 )
 
@@ -42,9 +43,17 @@ class MetaActor(type):
 
 
 class Actor(object):
+    """
+    The limits for each metric can come from a limit profile (a [limit.name]
+    section, see schedule.get_limits) for when the schedule is active and
+    for when it's not, the metrics not in the profile use the
+    active_time_limit/inactive_time_limit.
+    """
     __metaclass__ = MetaActor
     AFFECTED_METRICS = []
     WATCHED_METRICS = []
+    #: Metrics checked against the limits, WATCHED_METRICS if None
+    LIMITED_METRICS = None
 
     def __init__(
         self,
@@ -56,16 +65,87 @@ class Actor(object):
         zone='default',
         auto_mode=True,
         config=None,
+        active_limits=None,
+        inactive_limits=None,
     ):
         self.name = name
         self.zone = zone
         self.auto = auto_mode
         self.schedule = schedule
         self.action = action
-        self.active_time_limit = active_time_limit
-        self.inactive_time_limit = inactive_time_limit
+        self._limits = None
+        self._active_time_limit = active_time_limit
+        self._inactive_time_limit = inactive_time_limit
+        self.active_limits = active_limits or {}
+        self.inactive_limits = inactive_limits or {}
         self.log_debug('Loaded actor %s', vars(self))
 
+    def get_active_time_limit(self):
+        return self._active_time_limit
+
+    def set_active_time_limit(self, value):
+        self._active_time_limit = value
+        self._limits = None
+
+    active_time_limit = property(
+        get_active_time_limit,
+        set_active_time_limit,
+    )
+
+    def get_inactive_time_limit(self):
+        return self._inactive_time_limit
+
+    def set_inactive_time_limit(self, value):
+        self._inactive_time_limit = value
+        self._limits = None
+
+    inactive_time_limit = property(
+        get_inactive_time_limit,
+        set_inactive_time_limit,
+    )
+
+    def default_limit(self, limit):
+        """
+        Returns:
+            LimitRange: for the metrics that have no limit in the profile
+        """
+        return mod_schedule.LimitRange.for_action(self.action, limit)
+
+    @classmethod
+    def limited_metrics(cls):
+        return cls.LIMITED_METRICS or cls.WATCHED_METRICS
+
+    def resolve_limits(self, profile, limit):
+        return dict(
+            (
+                metric,
+                profile[metric] if metric in profile
+                else self.default_limit(limit),
+            )
+            for metric in self.limited_metrics()
+        )
+
+    def get_limits(self):
+        """
+        Returns:
+            dict: schedule active (True or False) -> metric -> LimitRange,
+                resolved once and kept until the time limits change
+        """
+        limits = self._limits
+        if limits is None:
+            limits = self._limits = {
+                True: self.resolve_limits(
+                    self.active_limits,
+                    self.active_time_limit,
+                ),
+                False: self.resolve_limits(
+                    self.inactive_limits,
+                    self.inactive_time_limit,
+                ),
+            }
+
+        return limits
+
     @property
     def active(self):
         raise NotImplementedError()
@@ -92,7 +172,14 @@ class Actor(object):
     def deactivate(self):
         raise NotImplementedError()
 
-    def parse_measure(self, measure, schedule):
+    def parse_measure(self, measure, schedule, when=None):
+        """
+        Args:
+            measure(Measure): measure to act on
+            schedule(WeekSchedule): schedule of the actor
+            when(float): unix timestamp to evaluate the schedule at, now if
+                not passed
+        """
         self.log_debug('Parsing measure %s', measure)
         if not self.auto:
             return
@@ -101,8 +188,8 @@ class Actor(object):
             measure=measure,
             metrics=self.WATCHED_METRICS,
             action=self.action,
-            active_limit=self.active_time_limit,
-            inactive_limit=self.inactive_time_limit,
+            when=when,
+            limits=self.get_limits(),
         )
 
         if should_trigger is None:
@@ -124,6 +211,16 @@ class Actor(object):
             'active': self.active,
             'active_time_limit': self.active_time_limit,
             'inactive_time_limit': self.inactive_time_limit,
+            'limits': dict(
+                (
+                    'active' if active else 'inactive',
+                    dict(
+                        (metric, limit.to_dict())
+                        for metric, limit in limits.items()
+                    ),
+                )
+                for active, limits in self.get_limits().items()
+            ),
         }
 
     def __repr__(self):
@@ -204,18 +301,26 @@ class TemperatureActor(RaspberryActorMixin):
 class PresenceLightActor(RaspberryActorMixin):
     WATCHED_METRICS = ['luminosity', 'presence']
     AFFECTED_METRICS = ['luminosity']
+    LIMITED_METRICS = AFFECTED_METRICS
+
+    def default_limit(self, limit):
+        # any limit set means always on, when there's presence
+        return super(PresenceLightActor, self).default_limit(
+            limit and sys.maxint
+        )
 
-    def parse_measure(self, measure, schedule):
+    def parse_measure(self, measure, schedule, when=None):
         self.log_debug('Parsing measure %s', measure)
         if not self.auto:
             return
 
+        now = int(when if when is not None else time.time())
         should_trigger = schedule.should_trigger(
             measure=measure,
             metrics=self.AFFECTED_METRICS,
             action=self.action,
-            active_limit=self.active_time_limit and sys.maxint,
-            inactive_limit=self.inactive_time_limit and sys.maxint,
+            when=now,
+            limits=self.get_limits(),
         )
 
         if (
@@ -229,7 +334,7 @@ class PresenceLightActor(RaspberryActorMixin):
             should_trigger
             and (
                 measure.luminosity.value is None
-                or int(time.time()) - measure.presence.value < 150
+                or now - measure.presence.value < 150
             )
         ):
             if measure.luminosity.value:
@@ -239,7 +344,7 @@ class PresenceLightActor(RaspberryActorMixin):
                     should_trigger,
                     measure.luminosity.value,
                     measure.presence.value,
-                    int(time.time())
+                    now,
                 )
             else:
                 self.log_debug(
@@ -248,7 +353,7 @@ class PresenceLightActor(RaspberryActorMixin):
                     should_trigger,
                     measure.luminosity.value,
                     measure.presence.value,
-                    int(time.time())
+                    now,
                 )
                 self.activate()
         else:
@@ -258,12 +363,20 @@ class PresenceLightActor(RaspberryActorMixin):
                 should_trigger,
                 measure.luminosity.value,
                 measure.presence.value,
-                int(time.time())
+                now,
             )
             self.deactivate()
 
 
-def get_actors(config):
+def get_actors(config, classes=None):
+    """
+    Args:
+        config(ConfigParser): config with the actor sections
+        classes(dict): actor type -> class to build them with, ACTORS by
+            default
+    """
+    classes = classes if classes is not None else ACTORS
+    profiles = dict(mod_schedule.get_limits(config))
     for section in config.sections():
         if section.split('.', 1)[0] == 'actor':
             actor_class = config.get(section, 'type')
@@ -281,8 +394,43 @@ def get_actors(config):
                 section,
                 'inactive_time_limit'
             )
-            if actor_class in ACTORS:
-                yield ACTORS[actor_class](
+            actor_profiles = {}
+            for option in ('active_limits', 'inactive_limits'):
+                if not config.has_option(section, option):
+                    continue
+
+                profile_name = config.get(section, option)
+                try:
+                    actor_profiles[option] = profiles[profile_name]
+                except KeyError:
+                    raise KeyError(
+                        'Limit profile %s not found, available ones: %s'
+                        % (profile_name, profiles.keys())
+                    )
+
+                if actor_class not in classes:
+                    continue
+
+                # they would be silently ignored otherwise
+                limited_metrics = classes[actor_class].limited_metrics()
+                unknown = sorted(
+                    set(actor_profiles[option]) - set(limited_metrics)
+                )
+                if unknown:
+                    raise KeyError(
+                        'Limit profile %s of %s has limits for %s, but %s '
+                        'only limits %s'
+                        % (
+                            profile_name,
+                            section,
+                            ', '.join(unknown),
+                            actor_class,
+                            ', '.join(limited_metrics),
+                        )
+                    )
+
+            if actor_class in classes:
+                yield classes[actor_class](
                     config=partial(config.get, section),
                     name=actor_name,
                     action=actor_action,
@@ -290,4 +438,5 @@ def get_actors(config):
                     schedule=actor_schedule,
                     active_time_limit=actor_active_time_limit,
                     inactive_time_limit=actor_inactive_time_limit,
+                    **actor_profiles
                 )
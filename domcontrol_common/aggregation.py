@@ -0,0 +1,295 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections
+import logging
+import threading
+import time
+
+from . import (
+    metrics as mod_metrics,
+    timing,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+#: Registry for aggregation policies
+AGGREGATORS = {}
+
+
+class MetaAggregator(type):
+    def __init__(cls, name, bases, dct):
+        if name != 'Aggregator':
+            AGGREGATORS[cls.POLICY] = cls
+
+
+class Aggregator(object):
+    """
+    Aggregates the values of a single metric as they come, each add and
+    value call is O(1) (amortized for the windowed ones).
+
+    The window keeps the samples newer than window_time seconds, and at most
+    window_size of them, None or 0 to not limit by that.
+    """
+    __metaclass__ = MetaAggregator
+    POLICY = None
+
+    def __init__(self, window_time=None, window_size=None, alpha=None):
+        self.window_time = window_time
+        self.window_size = window_size
+
+    def add(self, value, timestamp):
+        raise NotImplementedError()
+
+    def value(self, now=None):
+        raise NotImplementedError()
+
+    def expired(self, timestamp, now=None):
+        """
+        Returns:
+            bool: if a sample taken at timestamp is out of the window_time
+        """
+        return bool(
+            self.window_time
+            and timestamp < (now or int(time.time())) - self.window_time
+        )
+
+
+class LastAggregator(Aggregator):
+    """
+    Newest sample, as long as it's in the window.
+    """
+    POLICY = 'last'
+
+    def __init__(self, *args, **kwargs):
+        super(LastAggregator, self).__init__(*args, **kwargs)
+        self.last = None
+        self.last_timestamp = None
+
+    def add(self, value, timestamp):
+        if self.last_timestamp is None or timestamp >= self.last_timestamp:
+            self.last = value
+            self.last_timestamp = timestamp
+
+    def value(self, now=None):
+        if self.last_timestamp is None or self.expired(
+            self.last_timestamp,
+            now,
+        ):
+            return None
+
+        return self.last
+
+
+class EWMAAggregator(Aggregator):
+    """
+    Exponentially weighted moving average, the window is given by alpha,
+    the weight of each new sample. It starts over once the newest sample is
+    out of the window_time.
+    """
+    POLICY = 'ewma'
+
+    def __init__(self, window_time=None, window_size=None, alpha=0.3):
+        super(EWMAAggregator, self).__init__(window_time, window_size)
+        self.alpha = alpha
+        self.current = None
+        self.last_timestamp = None
+
+    def add(self, value, timestamp):
+        if self.current is None or self.expired(
+            self.last_timestamp,
+            timestamp,
+        ):
+            self.current = float(value)
+        else:
+            self.current += self.alpha * (value - self.current)
+
+        self.last_timestamp = max(timestamp, self.last_timestamp)
+
+    def value(self, now=None):
+        if self.current is None or self.expired(self.last_timestamp, now):
+            return None
+
+        return self.current
+
+
+class MeanAggregator(Aggregator):
+    POLICY = 'mean'
+
+    def __init__(self, *args, **kwargs):
+        super(MeanAggregator, self).__init__(*args, **kwargs)
+        self.samples = collections.deque()
+        self.total = 0.0
+
+    def add(self, value, timestamp):
+        self.samples.append((timestamp, value))
+        self.total += value
+        self.expire(timestamp)
+
+    def expire(self, now):
+        samples = self.samples
+        while samples and (
+            self.window_size and len(samples) > self.window_size
+            or self.window_time and samples[0][0] < now - self.window_time
+        ):
+            self.total -= samples.popleft()[1]
+
+        if not samples:
+            # avoid accumulating rounding errors
+            self.total = 0.0
+
+    def value(self, now=None):
+        self.expire(now or int(time.time()))
+        if not self.samples:
+            return None
+
+        return self.total / len(self.samples)
+
+
+class MaxAggregator(Aggregator):
+    """
+    Windowed max, keeps only the samples that can still become the max (a
+    decreasing deque), so both operations are amortized O(1).
+    """
+    POLICY = 'max'
+
+    def __init__(self, *args, **kwargs):
+        super(MaxAggregator, self).__init__(*args, **kwargs)
+        #: (sample number, timestamp, value)
+        self.samples = collections.deque()
+        self.count = 0
+
+    def add(self, value, timestamp):
+        samples = self.samples
+        while samples and samples[-1][2] <= value:
+            samples.pop()
+
+        samples.append((self.count, timestamp, value))
+        self.count += 1
+        self.expire(timestamp)
+
+    def expire(self, now):
+        samples = self.samples
+        while samples and (
+            self.window_size and samples[0][0] <= self.count - 1 - (
+                self.window_size
+            )
+            or self.window_time and samples[0][1] < now - self.window_time
+        ):
+            samples.popleft()
+
+    def value(self, now=None):
+        self.expire(now or int(time.time()))
+        if not self.samples:
+            return None
+
+        return self.samples[0][2]
+
+
+class MeasureAggregator(object):
+    """
+    Keeps an aggregator for each metric, with the policy given by the
+    metric class (Metric.aggregation) unless overridden in policies.
+
+    Metrics with Metric.aggregation_windowed set to False ignore the window
+    and aggregate all the samples they ever got.
+    """
+    def __init__(
+        self,
+        window_time=None,
+        window_size=None,
+        alpha=0.3,
+        policies=None,
+    ):
+        policies = policies or {}
+        self.lock = threading.Lock()
+        #: number of measures added, to tell if there's anything new
+        self.added = 0
+        self.aggregators = []
+        for metric, metric_cls in zip(
+            mod_metrics.METRIC_NAMES,
+            mod_metrics.METRIC_CLASSES,
+        ):
+            if metric == 'timestamp':
+                self.aggregators.append(None)
+                continue
+
+            policy = policies.get(metric, metric_cls.aggregation)
+            try:
+                aggregator_cls = AGGREGATORS[policy]
+            except KeyError:
+                raise TypeError(
+                    'Unknown aggregation %s for %s, available: %s'
+                    % (policy, metric, AGGREGATORS.keys())
+                )
+
+            if metric_cls.aggregation_windowed:
+                aggregator = aggregator_cls(
+                    window_time=window_time,
+                    window_size=window_size,
+                    alpha=alpha,
+                )
+            else:
+                aggregator = aggregator_cls(alpha=alpha)
+
+            self.aggregators.append(aggregator)
+
+    def add(self, measure):
+        if measure is None:
+            return
+
+        values = measure.values
+        timestamp = values[mod_metrics.TIMESTAMP_INDEX]
+        with self.lock:
+            self.added += 1
+            for aggregator, value in zip(self.aggregators, values):
+                if aggregator is not None and value is not None:
+                    aggregator.add(value, timestamp)
+
+    @timing.timed_func('aggregation.current')
+    def current(self):
+        """
+        Returns:
+            Measure: the aggregated values at this moment, or None if there
+                are none
+        """
+        now = int(time.time())
+        values = [None] * len(mod_metrics.METRIC_NAMES)
+        with self.lock:
+            for index, aggregator in enumerate(self.aggregators):
+                if aggregator is None:
+                    continue
+
+                value = aggregator.value(now)
+                if value is not None:
+                    values[index] = mod_metrics.METRIC_CLASSES[index].val_type(
+                        value
+                    )
+
+        if values.count(None) == len(values):
+            return None
+
+        values[mod_metrics.TIMESTAMP_INDEX] = now
+        return mod_metrics.Measure.from_values(values)
+
+
+def get_policies(config, section='general'):
+    policies = {}
+    for metric in mod_metrics.METRIC_NAMES:
+        option = metric + '_aggregation'
+        if config.has_option(section, option):
+            policies[metric] = config.get(section, option)
+
+    return policies
@@ -0,0 +1,192 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Statistics over the history of a metric, computed with numpy on the whole
+series at once.
+
+The series are loaded from the zone store if there's one (straight from the
+mapped files, see store.Store.batch), or from the in memory history
+otherwise, as a pair of arrays, timestamps and values, without the missing
+values.
+"""
+import logging
+
+import numpy as np
+
+from . import timing
+
+
+LOGGER = logging.getLogger(__name__)
+DEFAULT_PERCENTILES = (5, 50, 95)
+
+
+def series_from_store(store, metric, start=None, end=None):
+    """
+    Raises:
+        KeyError: if the metric does not exist
+    """
+    batch = store.batch(start, end)
+    values = batch.column(metric)
+    valid = ~np.isnan(values)
+    return batch.timestamps[valid].astype(np.float64), values[valid]
+
+
+def series_from_history(history, metric, start=None, end=None):
+    """
+    Raises:
+        KeyError: if there's no history for the metric
+    """
+    timestamps, values = history.columns(metric, start, end)
+    return (
+        np.frombuffer(timestamps, dtype=timestamps.typecode).astype(
+            np.float64
+        ),
+        np.frombuffer(values, dtype=np.float32).astype(np.float64),
+    )
+
+
+@timing.timed_func('analytics.get_series')
+def get_series(zone, metric, start=None, end=None):
+    """
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): the timestamps and values of
+            the metric for the zone, sorted by timestamp
+    """
+    if zone.store is not None:
+        return series_from_store(zone.store, metric, start, end)
+
+    return series_from_history(zone.history, metric, start, end)
+
+
+def rolling_mean(timestamps, values, window):
+    """
+    Mean of the samples in the last window seconds, at each sample.
+    """
+    if not len(values):
+        return values
+
+    totals = np.concatenate(([0.0], np.cumsum(values)))
+    ends = np.arange(1, len(values) + 1)
+    starts = np.searchsorted(timestamps, timestamps - window, side='right')
+    return (totals[ends] - totals[starts]) / (ends - starts)
+
+
+def rate_of_change(timestamps, values, per=3600):
+    """
+    Change of the value per `per` seconds between each pair of consecutive
+    samples, with the timestamp of the second one.
+    """
+    elapsed = np.diff(timestamps)
+    changes = np.diff(values)
+    valid = elapsed > 0
+    return timestamps[1:][valid], changes[valid] / elapsed[valid] * per
+
+
+def time_above(timestamps, values, threshold):
+    """
+    Seconds the metric was over the threshold, taking each sample as the
+    value until the next one.
+    """
+    if len(values) < 2:
+        return 0.0
+
+    return float(np.diff(timestamps)[values[:-1] > threshold].sum())
+
+
+def summary(timestamps, values, percentiles=DEFAULT_PERCENTILES):
+    if not len(values):
+        return {'count': 0}
+
+    result = {
+        'count': len(values),
+        'start': int(timestamps[0]),
+        'end': int(timestamps[-1]),
+        'min': float(values.min()),
+        'max': float(values.max()),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+    }
+    for percent, value in zip(
+        percentiles,
+        np.percentile(values, percentiles),
+    ):
+        result['p%g' % percent] = float(value)
+
+    return result
+
+
+def period_summaries(
+    timestamps,
+    values,
+    period=86400,
+    percentiles=DEFAULT_PERCENTILES,
+    threshold=None,
+):
+    """
+    Returns:
+        list(dict): the summary of each period seconds bucket (days by
+            default, in UTC) with samples, with the time above the
+            threshold if passed
+    """
+    if not len(values):
+        return []
+
+    buckets = (timestamps // period).astype(np.int64)
+    starts = np.flatnonzero(np.diff(buckets)) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.concatenate((starts[1:], [len(values)]))
+    mins = np.minimum.reduceat(values, starts)
+    maxs = np.maximum.reduceat(values, starts)
+    means = np.add.reduceat(values, starts) / (ends - starts)
+    results = []
+    for index, (first, last) in enumerate(zip(starts, ends)):
+        result = {
+            'timestamp': int(buckets[first] * period),
+            'count': int(last - first),
+            'min': float(mins[index]),
+            'max': float(maxs[index]),
+            'mean': float(means[index]),
+        }
+        for percent, value in zip(
+            percentiles,
+            np.percentile(values[first:last], percentiles),
+        ):
+            result['p%g' % percent] = float(value)
+
+        if threshold is not None:
+            result['time_above'] = time_above(
+                timestamps[first:last],
+                values[first:last],
+                threshold,
+            )
+
+        results.append(result)
+
+    return results
+
+
+def resample_last(timestamps, values, step):
+    """
+    Keeps only the last sample of each step seconds bucket, to return long
+    derived series (like the rolling mean) at a sensible size.
+    """
+    if not step or not len(values):
+        return timestamps, values
+
+    buckets = timestamps // step
+    last = np.flatnonzero(np.diff(buckets))
+    last = np.concatenate((last, [len(values) - 1]))
+    return timestamps[last], values[last]
@@ -0,0 +1,230 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Columnar batches of measures, for the bulk operations over many of them
+(the store and the analytics), with numpy.
+"""
+import time
+
+import numpy as np
+
+from .metrics import (
+    METRIC_CLASSES,
+    METRIC_INDEX,
+    METRIC_NAMES,
+    TIMESTAMP_INDEX,
+    Measure,
+)
+
+
+class MeasureBatch(object):
+    """
+    Columnar set of measures, a timestamps array and a float array for each
+    metric (in METRIC_NAMES order, None for the timestamp one), with NaN for
+    the missing values, so the bulk operations run on whole columns instead
+    of on each measure.
+
+    The measures are expected sorted by timestamp.
+    """
+    __slots__ = ('timestamps', 'columns')
+
+    def __init__(self, timestamps, columns):
+        self.timestamps = timestamps
+        self.columns = columns
+
+    @classmethod
+    def from_measures(cls, measures):
+        """
+        Args:
+            measures(iterable of Measure): the None ones are skipped
+        """
+        rows = [measure.values for measure in measures if measure is not None]
+        values = np.array(rows, dtype=np.float64).reshape(
+            len(rows),
+            len(METRIC_NAMES),
+        )
+        return cls(
+            values[:, TIMESTAMP_INDEX].astype(np.int64),
+            [
+                None if index == TIMESTAMP_INDEX else values[:, index]
+                for index in range(len(METRIC_NAMES))
+            ],
+        )
+
+    @classmethod
+    def from_columns(cls, timestamps, columns):
+        """
+        Args:
+            timestamps(numpy.ndarray): timestamps of the measures
+            columns(dict): metric -> array of values, NaN for the missing
+                ones, the metrics not passed are all missing
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        return cls(
+            timestamps,
+            [
+                None if metric == 'timestamp' else (
+                    np.asarray(columns[metric], dtype=np.float64)
+                    if metric in columns
+                    else np.full(len(timestamps), np.nan)
+                )
+                for metric in METRIC_NAMES
+            ],
+        )
+
+    @classmethod
+    def concatenate(cls, batches):
+        batches = list(batches)
+        if not batches:
+            return cls.from_measures([])
+
+        return cls(
+            np.concatenate([batch.timestamps for batch in batches]),
+            [
+                None if index == TIMESTAMP_INDEX else np.concatenate(
+                    [batch.columns[index] for batch in batches]
+                )
+                for index in range(len(METRIC_NAMES))
+            ],
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        """
+        An integer returns that Measure, a slice (or index array) returns a
+        MeasureBatch with those measures.
+        """
+        if isinstance(index, (int, long, np.integer)):
+            return self.measure(index)
+
+        return MeasureBatch(
+            self.timestamps[index],
+            [
+                column if column is None else column[index]
+                for column in self.columns
+            ],
+        )
+
+    def __iter__(self):
+        return self.to_measures()
+
+    def column(self, metric):
+        if metric == 'timestamp':
+            return self.timestamps
+
+        return self.columns[METRIC_INDEX[metric]]
+
+    def between(self, start=None, end=None):
+        """
+        Returns:
+            MeasureBatch: the measures with start <= timestamp <= end
+        """
+        first = 0 if start is None else np.searchsorted(
+            self.timestamps,
+            start,
+            side='left',
+        )
+        last = len(self) if end is None else np.searchsorted(
+            self.timestamps,
+            end,
+            side='right',
+        )
+        return self[first:last]
+
+    @staticmethod
+    def _to_value(index, value):
+        if value != value:
+            return None
+
+        return METRIC_CLASSES[index].val_type(value)
+
+    def _rows(self):
+        """
+        Generator over the values list of each measure, the columns are
+        converted to lists once, instead of taking each numpy value.
+        """
+        lists = [
+            self.timestamps.tolist() if column is None else column.tolist()
+            for column in self.columns
+        ]
+        to_value = self._to_value
+        for row in zip(*lists):
+            yield [
+                to_value(index, value) for index, value in enumerate(row)
+            ]
+
+    def measure(self, index):
+        return Measure.from_values([
+            int(self.timestamps[index]) if column is None
+            else self._to_value(col_index, column[index])
+            for col_index, column in enumerate(self.columns)
+        ])
+
+    def to_measures(self):
+        for values in self._rows():
+            yield Measure.from_values(values)
+
+    def to_dicts(self):
+        return [dict(zip(METRIC_NAMES, values)) for values in self._rows()]
+
+    def _reduce(self, reducers):
+        """
+        Args:
+            reducers(list): function for each metric to reduce its non
+                missing values to one
+
+        Returns:
+            Measure: with the reduced values, and the last timestamp (now
+                if empty)
+        """
+        values = [None] * len(METRIC_NAMES)
+        for index, (column, reducer) in enumerate(zip(self.columns, reducers)):
+            if column is None:
+                continue
+
+            valid = column[~np.isnan(column)]
+            if len(valid):
+                values[index] = METRIC_CLASSES[index].val_type(reducer(valid))
+
+        values[TIMESTAMP_INDEX] = (
+            int(self.timestamps[-1]) if len(self) else int(time.time())
+        )
+        return Measure.from_values(values)
+
+    def mean(self):
+        return self._reduce([np.mean] * len(METRIC_NAMES))
+
+    def max(self):
+        return self._reduce([np.max] * len(METRIC_NAMES))
+
+    def last(self):
+        return self._reduce([lambda valid: valid[-1]] * len(METRIC_NAMES))
+
+    def aggregate(self):
+        """
+        Reduces each metric as given by its Metric.aggregation, max and last
+        as they are, the rest with the mean.
+        """
+        reducers = {
+            'max': np.max,
+            'last': lambda valid: valid[-1],
+        }
+        return self._reduce([
+            reducers.get(metric_cls.aggregation, np.mean)
+            for metric_cls in METRIC_CLASSES
+        ])
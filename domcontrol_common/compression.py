@@ -0,0 +1,225 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Gorilla style compression for time series columns.
+
+Timestamps are stored as delta of deltas, so a fixed cadence takes a
+single bit per sample, and values (float32) are XORed with the previous
+one, storing only the bits that changed, so slow changing series take a
+few bits per sample.
+"""
+import struct
+
+
+FLOAT = struct.Struct('<f')
+UINT = struct.Struct('<I')
+#: (prefix bits, prefix length, value bits) for each delta of delta range,
+#: the last one is used for anything that does not fit the others
+DOD_BUCKETS = [
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+    (0b1111, 4, 64),
+]
+
+
+class BitWriter(object):
+    def __init__(self):
+        self.data = bytearray()
+        self.current = 0
+        self.used = 0
+
+    def write(self, value, bits):
+        """
+        Appends the lower bits of value, most significant first.
+        """
+        self.current = (self.current << bits) | (value & ((1 << bits) - 1))
+        self.used += bits
+        while self.used >= 8:
+            self.used -= 8
+            self.data.append((self.current >> self.used) & 0xff)
+
+        self.current &= (1 << self.used) - 1
+
+    def getvalue(self):
+        data = bytearray(self.data)
+        if self.used:
+            data.append((self.current << (8 - self.used)) & 0xff)
+
+        return str(data)
+
+
+class BitReader(object):
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.pos = 0
+        self.current = 0
+        self.available = 0
+
+    def read(self, bits):
+        while self.available < bits:
+            self.current = (self.current << 8) | self.data[self.pos]
+            self.pos += 1
+            self.available += 8
+
+        self.available -= bits
+        value = self.current >> self.available
+        self.current &= (1 << self.available) - 1
+        return value
+
+    def read_bit(self):
+        return self.read(1)
+
+
+def to_signed(value, bits):
+    if value & (1 << (bits - 1)):
+        return value - (1 << bits)
+
+    return value
+
+
+def encode_timestamps(timestamps):
+    writer = BitWriter()
+    prev = 0
+    prev_delta = 0
+    for timestamp in timestamps:
+        delta = timestamp - prev
+        dod = delta - prev_delta
+        prev = timestamp
+        prev_delta = delta
+        if dod == 0:
+            writer.write(0, 1)
+            continue
+
+        for prefix, prefix_bits, bits in DOD_BUCKETS:
+            if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)) or bits == 64:
+                writer.write(prefix, prefix_bits)
+                writer.write(dod, bits)
+                break
+
+    return writer.getvalue()
+
+
+def decode_timestamps(data, count):
+    """
+    Generator over the count timestamps encoded in data.
+    """
+    reader = BitReader(data)
+    prev = 0
+    prev_delta = 0
+    for _ in xrange(count):
+        if not reader.read_bit():
+            dod = 0
+        else:
+            for _, prefix_bits, bits in DOD_BUCKETS[:-1]:
+                if not reader.read_bit():
+                    break
+            else:
+                bits = DOD_BUCKETS[-1][2]
+
+            dod = to_signed(reader.read(bits), bits)
+
+        prev_delta += dod
+        prev += prev_delta
+        yield prev
+
+
+def float_to_bits(value):
+    return UINT.unpack(FLOAT.pack(value))[0]
+
+
+def bits_to_float(bits):
+    return FLOAT.unpack(UINT.pack(bits))[0]
+
+
+def leading_zeros(value):
+    return 32 - value.bit_length()
+
+
+def trailing_zeros(value):
+    return (value & -value).bit_length() - 1
+
+
+def encode_values(values):
+    """
+    Encodes a column of float32 values (NaN for the missing ones).
+
+    After the first one (stored as is), each value is XORed with the
+    previous one, a 0 bit means no change, otherwise it stores the
+    meaningful bits of the XOR, reusing the previous leading/trailing zeros
+    window when they fit in it.
+    """
+    writer = BitWriter()
+    prev = None
+    prev_leading = prev_trailing = None
+    for value in values:
+        bits = float_to_bits(value)
+        if prev is None:
+            writer.write(bits, 32)
+            prev = bits
+            continue
+
+        xor = bits ^ prev
+        prev = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+
+        writer.write(1, 1)
+        leading = min(leading_zeros(xor), 31)
+        trailing = trailing_zeros(xor)
+        if (
+            prev_leading is not None
+            and leading >= prev_leading
+            and trailing >= prev_trailing
+        ):
+            writer.write(0, 1)
+            writer.write(
+                xor >> prev_trailing,
+                32 - prev_leading - prev_trailing,
+            )
+        else:
+            meaningful = 32 - leading - trailing
+            writer.write(1, 1)
+            writer.write(leading, 5)
+            writer.write(meaningful - 1, 5)
+            writer.write(xor >> trailing, meaningful)
+            prev_leading, prev_trailing = leading, trailing
+
+    return writer.getvalue()
+
+
+def decode_values(data, count):
+    """
+    Generator over the count float32 values encoded in data.
+    """
+    if not count:
+        return
+
+    reader = BitReader(data)
+    prev = reader.read(32)
+    yield bits_to_float(prev)
+    leading = trailing = 0
+    for _ in xrange(count - 1):
+        if reader.read_bit():
+            if reader.read_bit():
+                leading = reader.read(5)
+                meaningful = reader.read(5) + 1
+                trailing = 32 - leading - meaningful
+
+            prev ^= reader.read(32 - leading - trailing) << trailing
+
+        yield bits_to_float(prev)
@@ -28,8 +28,26 @@ CONF_DEFAULTS = {
     'pin_numbering': 'BCM',
     'loop_sleep_time': '10',
     'graphite_url': '',
+    'graphite_queue_size': '100',
+    'graphite_spool': '',
+    'graphite_protocol': 'plaintext',
+    'graphite_prefix': 'lab.rp1',
     'zone': 'default',
     'schedule': 'default',
+    'sensor_read_workers': '4',
+    'sensor_read_timeout': '30',
+    'timings': 'false',
+    'aggregation_window': '60',
+    'aggregation_window_size': '0',
+    'aggregation_alpha': '0.3',
+    'history_size': '8640',
+    'store_dir': '',
+    'store_segment_size': '8640',
+    'store_segments': '30',
+    'store_compress': 'true',
+    'store_flush_interval': '60',
+    'filters': 'hampel:5:3',
+    'dht_read_timeout': '10',
 }
 DEFAULT_SCHEDULE = {
     'monday': '08:00-13:00, 15:00-20:00',
@@ -17,12 +17,17 @@ import time
 import logging
 import os
 import threading
+from functools import partial
 
 from . import (
+    aggregation,
+    history as mod_history,
+    store as mod_store,
+    timers,
+    timing,
     utils,
     actors as mod_actors,
     sensors as mod_sensors,
-    metrics as mod_metrics,
     schedule as mod_schedule,
     conf as mod_conf,
 )
@@ -38,19 +43,88 @@ else:
 LOGGER = logging.getLogger(__name__)
 ZONES = {}
 STOP = threading.Event()
+SCHEDULER = None
+#: Seconds to wait for the zone workers to finish on exit
+WORKERS_JOIN_TIMEOUT = 10
 
 
 class Zone(object):
-    def __init__(self, name):
+    def __init__(
+        self,
+        name,
+        read_workers=4,
+        read_timeout=None,
+        loop_sleep_time=10,
+        aggregator=None,
+        history_size=8640,
+        store=None,
+    ):
         self.name = name
+        self.read_workers = read_workers
+        self.read_timeout = read_timeout
+        self.loop_sleep_time = loop_sleep_time
         self.actors = {}
         self.sensors = {}
         self.last_measure = None
         self.schedules = {}
         self.measures = {}
+        self.tasks = []
+        self.workers = []
+        #: worker that runs the zone cycle, None while unscheduled
+        self.zone_worker = None
+        self.edge_task = None
+        #: set by unschedule, so a running edge task does not add another
+        self.unscheduled = False
+        self.edge_lock = threading.Lock()
+        #: sensors with a read still running, see utils.parallel_map
+        self.reads_in_flight = set()
+        #: metric name -> actors that watch it
+        self.metric_actors = {}
+        self.aggregator = aggregator or aggregation.MeasureAggregator(
+            window_time=loop_sleep_time,
+        )
+        self.history = mod_history.MeasureHistory(history_size, rollups=True)
+        #: aggregator.added when the history was last updated
+        self.history_added = None
+        self.store = store
+        #: aggregator.added when the last measure was stored
+        self.store_added = None
 
     def add_actor(self, actor):
         self.actors[actor.name] = actor
+        self.index_actors()
+
+    def remove_actor(self, actor_name):
+        del self.actors[actor_name]
+        self.index_actors()
+
+    def index_actors(self):
+        metric_actors = {}
+        for actor in self.actors.values():
+            for metric in actor.WATCHED_METRICS:
+                metric_actors.setdefault(metric, []).append(actor)
+
+        self.metric_actors = metric_actors
+
+    def get_actors(self, metrics=None):
+        """
+        Returns:
+            list(Actor): actors that watch any of the given metrics, all of
+                them if no metrics passed
+        """
+        if not metrics:
+            return self.actors.values()
+
+        if len(metrics) == 1:
+            return self.metric_actors.get(metrics[0], [])
+
+        actors = []
+        for metric in metrics:
+            for actor in self.metric_actors.get(metric, []):
+                if actor not in actors:
+                    actors.append(actor)
+
+        return actors
 
     def add_sensor(self, sensor):
         self.sensors[sensor.name] = sensor
@@ -58,6 +132,166 @@ class Zone(object):
     def add_schedule(self, schedule):
         self.schedules[schedule.name] = schedule
 
+    def schedule(self, scheduler, graphite_url=None):
+        """
+        Adds the zone cycle to the scheduler, with the zone loop_sleep_time
+        as interval, and a task for each sensor that has its own
+        poll_interval, each of them running on their own worker thread, and
+        the task for the next schedule change (see schedule_edge).
+        """
+        self.unscheduled = False
+        worker = ZoneWorker(zone=self, graphite_url=graphite_url)
+        self.workers.append(worker)
+        self.tasks.append(scheduler.add(
+            name='zone.%s' % self.name,
+            func=worker.run_cycle,
+            interval=self.loop_sleep_time,
+            worker=worker,
+        ))
+        self.zone_worker = worker
+
+        for sensor in self.sensors.values():
+            if not sensor.poll_interval:
+                continue
+
+            worker = timers.Worker(
+                name='zone.%s.sensor.%s' % (self.name, sensor.name),
+            )
+            self.workers.append(worker)
+            self.tasks.append(scheduler.add(
+                name=worker.name,
+                func=partial(self.poll_sensor, sensor.name),
+                interval=sensor.poll_interval,
+                worker=worker,
+            ))
+
+        for worker in self.workers:
+            worker.start()
+
+        # on the same worker, so it does not race with the cycle
+        self.schedule_edge(scheduler, self.zone_worker)
+
+    def unschedule(self, scheduler):
+        """
+        Cancels the zone tasks and stops its workers and the sensors event
+        threads, without waiting for them.
+
+        Returns:
+            list(threading.Thread): the stopped workers and threads
+        """
+        for task in self.tasks:
+            scheduler.cancel(task)
+
+        self.zone_worker = None
+        for worker in self.workers:
+            worker.stop()
+
+        workers = self.workers
+        for sensor in self.sensors.values():
+            workers.extend(sensor.stop())
+
+        self.tasks = []
+        self.workers = []
+        with self.edge_lock:
+            self.unscheduled = True
+            if self.edge_task is not None:
+                scheduler.cancel(self.edge_task)
+                self.edge_task = None
+
+        return workers
+
+    def schedule_edge(self, scheduler, worker):
+        """
+        Adds a one shot task for the next time any of the schedules of the
+        zone actors switches between active and inactive, so the actors act
+        right then instead of at the next cycle.
+
+        Does nothing once the zone is unscheduled, as the edge task that
+        was running then calls it on its way out.
+        """
+        now = time.time()
+        transitions = [
+            transition
+            for transition in (
+                self.schedules[schedule_name].next_transition(now)
+                for schedule_name in set(
+                    actor.schedule for actor in self.actors.values()
+                )
+            )
+            if transition is not None
+        ]
+        if not transitions:
+            return
+
+        with self.edge_lock:
+            if self.unscheduled:
+                return
+
+            self.edge_task = scheduler.add(
+                name='zone.%s.schedule_edge' % self.name,
+                func=partial(self.on_schedule_edge, scheduler, worker),
+                delay=max(min(transitions) - now, 0),
+                worker=worker,
+            )
+
+    def on_schedule_edge(self, scheduler, worker):
+        logging.info('zone.%s::Schedule changed, rechecking', self.name)
+        try:
+            self.check_measure()
+        finally:
+            self.schedule_edge(scheduler, worker)
+
+    def add_read(self, sensor_name, measure):
+        """
+        Aggregates the read of a sensor, unless it's stale or the same one
+        it already got (cached by the sensor).
+        """
+        previous = self.measures.get(sensor_name)
+        self.measures[sensor_name] = measure
+        if measure is None or measure is previous:
+            return
+
+        if measure.stale:
+            logging.warning(
+                'zone.%s::Ignoring stale measure from %s: %s',
+                self.name,
+                sensor_name,
+                measure,
+            )
+            return
+
+        self.aggregator.add(measure)
+
+    def on_sensor_event(self, measure=None, sensor=None, metrics=None):
+        """
+        Sensor callback, hands the measure over to the zone worker so it's
+        checked in between the cycles and not concurrently with them.
+        """
+        worker = self.zone_worker
+        if worker is None:
+            LOGGER.debug(
+                'zone.%s::Not scheduled, dropping event from %s',
+                self.name,
+                sensor,
+            )
+            return
+
+        worker.submit(timers.Task(
+            name='zone.%s.event.%s' % (self.name, sensor),
+            func=partial(
+                self.check_measure,
+                measure=measure,
+                sensor=sensor,
+                metrics=metrics,
+            ),
+        ))
+
+    def poll_sensor(self, sensor_name):
+        sensor = self.sensors[sensor_name]
+        self.add_read(sensor_name, sensor.read())
+        if sensor.graphite_url:
+            utils.get_graphite_sender(sensor.graphite_url).flush()
+
     def do_measure(self):
         logging.info('zone.%s::Doing next measure', self.name)
         self.last_measure = self.get_measure()
@@ -65,26 +299,24 @@ class Zone(object):
         logging.info('zone.%s::Got measure %s', self.name, self.last_measure)
         self.check_measure()
 
+    @timing.timed_func('core.check_measure')
     def check_measure(self, measure=None, sensor=None, metrics=None):
         LOGGER.debug('check_measure:: starting')
-        if not self.last_measure and not measure:
-            return
-
-        elif not measure:
-            measure = self.last_measure
+        if measure:
+            if sensor:
+                self.measures[sensor] = measure
 
-        elif not self.last_measure:
-            measure = measure
+            self.aggregator.add(measure)
+            self.last_measure = self.aggregator.current()
 
-        else:
-            measure = mod_metrics.get_mean_measure([
-                self.last_measure,
-                measure,
-            ])
-            self.last_measure = measure
+        measure = self.last_measure
+        if not measure:
+            return
 
-        if sensor:
-            self.measures[sensor] = measure
+        # only when there are new reads, not on every recheck
+        if self.aggregator.added != self.history_added:
+            self.history_added = self.aggregator.added
+            self.history.add(measure)
 
         logging.debug('zone.%s::Checking measure %s', self.name, measure)
 
@@ -98,30 +330,34 @@ class Zone(object):
                 self.name,
                 metrics
             )
-        for actor in self.actors.values():
+        for actor in self.get_actors(metrics):
             logging.debug('  Checking %s', actor.name)
-            if not metrics or actor.watches_metrics(metrics):
-                actor.parse_measure(
-                    measure=measure,
-                    schedule=self.schedules[actor.schedule]
-                )
+            actor.parse_measure(
+                measure=measure,
+                schedule=self.schedules[actor.schedule]
+            )
 
     def get_measure(self):
-        for sensor_name, sensor in self.sensors.items():
-            if STOP.is_set():
-                raise RuntimeError('Stopping')
-
-            self.measures[sensor_name] = sensor.read()
-            if (
-                'luminosity' in sensor.METRICS
-                or 'presence' in sensor.METRICS
-            ):
-                self.last_measure = mod_metrics.get_mean_measure([
-                    self.last_measure,
-                    self.measures[sensor_name],
-                ])
-
-        return mod_metrics.get_mean_measure(self.measures.values())
+        if STOP.is_set():
+            raise RuntimeError('Stopping')
+
+        # the sensors with their own poll_interval are read by their own task
+        reads = utils.parallel_map(
+            func=lambda sensor_name: self.sensors[sensor_name].read(),
+            items=[
+                sensor.name
+                for sensor in self.sensors.values()
+                if not sensor.poll_interval
+            ],
+            max_workers=self.read_workers,
+            timeout=self.read_timeout,
+            in_flight=self.reads_in_flight,
+        )
+
+        for sensor_name, measure in reads.items():
+            self.add_read(sensor_name, measure)
+
+        return self.aggregator.current()
 
     def to_dict(self):
         zone = {
@@ -144,23 +380,163 @@ class Zone(object):
         return zone
 
 
-def load_zones(config):
+class ZoneWorker(timers.Worker):
+    """
+    Thread that runs the measure/decision cycle of a single zone, so a slow
+    or hung zone does not delay the others, along with the other tasks of
+    the zone that must not race with it.
+    """
+    def __init__(self, zone, graphite_url=None):
+        super(ZoneWorker, self).__init__(name='zone.%s' % zone.name)
+        self.zone = zone
+        self.graphite_url = graphite_url
+
+    @timing.timed_func('core.zone_cycle')
+    def run_cycle(self):
+        zone = self.zone
+        zone.do_measure()
+
+        # only when there are new reads, the same as the history
+        if (
+            zone.store is not None
+            and zone.last_measure
+            and zone.aggregator.added != zone.store_added
+        ):
+            zone.store_added = zone.aggregator.added
+            zone.store.append(zone.last_measure)
+
+        if self.graphite_url:
+            sender = utils.get_graphite_sender(self.graphite_url)
+            if zone.last_measure:
+                sender.add(measure=zone.last_measure)
+
+            sender.flush()
+
+
+def get_loop_sleep_time(config, zone_name):
+    section = 'zone.' + zone_name
+    if not config.has_section(section):
+        section = 'general'
+
+    return config.getint(section, 'loop_sleep_time')
+
+
+def get_store(config, zone_name, old_stores):
+    """
+    Returns the store for the zone, reusing the one it had before the
+    config reload if it's on the same directory, so there's only ever one
+    writer for it.
+
+    Args:
+        old_stores(dict): zone name -> store of the zones being replaced,
+            the reused one is popped out
+    """
+    store_dir = config.get('general', 'store_dir')
+    old_store = old_stores.pop(zone_name, None)
+    if not store_dir:
+        if old_store is not None:
+            old_store.close()
+
+        return None
+
+    path = os.path.join(store_dir, zone_name)
+    segment_size = config.getint('general', 'store_segment_size')
+    max_segments = config.getint('general', 'store_segments')
+    compress = config.getboolean('general', 'store_compress')
+    flush_interval = config.getint('general', 'store_flush_interval')
+    if old_store is not None:
+        if old_store.path == path:
+            # the new values apply from the next segment on
+            old_store.segment_size = segment_size
+            old_store.max_segments = max_segments
+            old_store.compress = compress
+            old_store.flush_interval = flush_interval
+            return old_store
+
+        old_store.close()
+
+    return mod_store.Store(
+        path=path,
+        segment_size=segment_size,
+        max_segments=max_segments,
+        compress=compress,
+        flush_interval=flush_interval,
+    )
+
+
+def close_stores(zones):
+    for zone in zones.values():
+        if zone.store is not None:
+            zone.store.close()
+
+
+def load_zones(config, old_zones=None):
+    """
+    Args:
+        old_zones(dict): zone name -> zone, the ones being replaced on a
+            config reload, if any, so their stores can be reused or closed
+    """
     zones = {}
+    old_stores = dict(
+        (zone.name, zone.store)
+        for zone in (old_zones or {}).values()
+        if zone.store is not None
+    )
+
+    def new_zone(zone_name):
+        window_time = config.getint('general', 'aggregation_window')
+        store = get_store(config, zone_name, old_stores)
+
+        return Zone(
+            zone_name,
+            aggregator=aggregation.MeasureAggregator(
+                window_time=(
+                    window_time or get_loop_sleep_time(config, zone_name)
+                ),
+                window_size=config.getint(
+                    'general',
+                    'aggregation_window_size',
+                ),
+                alpha=config.getfloat('general', 'aggregation_alpha'),
+                policies=aggregation.get_policies(config),
+            ),
+            read_workers=config.getint('general', 'sensor_read_workers'),
+            read_timeout=utils.getfloat(
+                config,
+                'general',
+                'sensor_read_timeout',
+            ),
+            loop_sleep_time=get_loop_sleep_time(config, zone_name),
+            history_size=config.getint('general', 'history_size'),
+            store=store,
+        )
+
     sensors = list(mod_sensors.get_sensors(config))
     actors = list(mod_actors.get_actors(config))
     schedules = list(mod_schedule.get_schedules(config))
 
     for sensor in sensors:
         if sensor.zone not in zones:
-            zones[sensor.zone] = Zone(sensor.zone)
+            zones[sensor.zone] = new_zone(sensor.zone)
 
         zones[sensor.zone].add_sensor(sensor)
 
-        sensor.add_callback(zones[sensor.zone].check_measure)
+        sensor.add_callback(zones[sensor.zone].on_sensor_event)
 
+    schedule_names = set(schedule.name for schedule in schedules)
     for actor in actors:
+        if actor.schedule not in schedule_names:
+            LOGGER.error(
+                'Actor %s uses the unknown schedule %s, skipping it, '
+                'available: %s',
+                actor.name,
+                actor.schedule,
+                sorted(schedule_names),
+            )
+            continue
+
         if actor.zone not in zones:
-            zones[actor.zone] = Zone(actor.zone)
+            zones[actor.zone] = new_zone(actor.zone)
 
         zones[actor.zone].add_actor(actor)
 
@@ -168,49 +544,123 @@ def load_zones(config):
         for zone in zones.values():
             zone.add_schedule(schedule)
 
+    # zones that are gone
+    for store in old_stores.values():
+        store.close()
+
     return zones
 
 
-def main_loop(config):
+def schedule_zones(scheduler, zones, graphite_url):
+    for zone in zones.values():
+        # one broken zone must not leave the rest unscheduled
+        try:
+            zone.schedule(scheduler=scheduler, graphite_url=graphite_url)
+        except Exception as err:
+            LOGGER.exception('Failed to schedule zone %s: %s', zone.name, err)
+
+
+def unschedule_zones(scheduler, zones):
+    """
+    Returns:
+        list(threading.Thread): the stopped workers of the zones
+    """
+    workers = []
+    for zone in zones.values():
+        workers.extend(zone.unschedule(scheduler))
+
+    return workers
+
+
+def join_workers(workers, timeout=WORKERS_JOIN_TIMEOUT):
+    """
+    Waits for the workers to finish their current task, up to timeout
+    seconds in total, a worker stuck on a read is left behind (it's a
+    daemon thread).
+    """
+    deadline = time.time() + timeout
+    for worker in workers:
+        if worker.is_alive():
+            worker.join(max(deadline - time.time(), 0))
+
+        if worker.is_alive():
+            LOGGER.warning('Worker %s did not stop in time', worker.name)
+
+
+def check_config(scheduler):
     global ZONES
-    global LAST_MEASURES
 
+    changed_config = mod_conf.reload_config()
+    if not changed_config:
+        return
+
+    mod_conf.CONFIG = changed_config
+    # the old workers must be done with the stores before reusing them
+    join_workers(unschedule_zones(scheduler, ZONES))
+    graphite_url = setup_graphite(changed_config)
+    ZONES = load_zones(mod_conf.CONFIG, old_zones=ZONES)
+    schedule_zones(scheduler, ZONES, graphite_url)
+
+
+def setup_graphite(config):
+    """
+    Creates the graphite sender with the config options, or updates it if
+    they changed, before anybody else asks for it.
+
+    Returns:
+        str: the graphite url, empty if none is configured
+    """
     graphite_url = config.get('general', 'graphite_url')
+    if graphite_url:
+        utils.get_graphite_sender(
+            graphite_url,
+            queue_size=config.getint('general', 'graphite_queue_size'),
+            spool_path=config.get('general', 'graphite_spool'),
+            protocol=config.get('general', 'graphite_protocol'),
+            prefix=config.get('general', 'graphite_prefix'),
+        )
+
+    return graphite_url
+
+
+def main_loop(config):
+    global ZONES
+    global LAST_MEASURES
+    global SCHEDULER
 
+    graphite_url = setup_graphite(config)
     ZONES = load_zones(config)
     LOGGER.debug('Loaded zones:')
     for zone in ZONES.keys():
         LOGGER.debug('    %s', zone)
 
-    while not STOP.is_set():
-        changed_config = mod_conf.reload_config()
-        if changed_config:
-            mod_conf.CONFIG = changed_config
-            ZONES = load_zones(mod_conf.CONFIG)
-
-        for zone in ZONES.values():
-            zone.do_measure()
+    SCHEDULER = timers.Scheduler()
+    try:
+        schedule_zones(SCHEDULER, ZONES, graphite_url)
+        SCHEDULER.add(
+            name='check_config',
+            func=partial(check_config, SCHEDULER),
+            interval=config.getint('general', 'loop_sleep_time'),
+            delay=config.getint('general', 'loop_sleep_time'),
+        )
 
-            if zone.last_measure:
-                if graphite_url:
-                    utils.send_to_graphite(
-                        measure=zone.last_measure,
-                        graphite_url=graphite_url,
-                    )
+        # checked here so a stop during the setup cleans up the workers too
+        if not STOP.is_set():
+            SCHEDULER.run()
+    finally:
+        join_workers(unschedule_zones(SCHEDULER, ZONES))
+        close_stores(ZONES)
 
-        if STOP.is_set():
-            return
 
-        # busy sleep
-        for _ in range(100):
-            time.sleep(
-                float(config.getint('general', 'loop_sleep_time'))/100
-            )
-            if STOP.is_set():
-                return
+def stop():
+    STOP.set()
+    if SCHEDULER is not None:
+        SCHEDULER.stop()
 
 
 def setup(config):
+    timing.setup(config)
+
     pin_numbering = config.get('general', 'pin_numbering')
     try:
         pin_numbering = getattr(GPIO, pin_numbering)
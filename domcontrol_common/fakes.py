@@ -115,6 +115,12 @@ class DummyGPIO(object):
             )
         )
 
+    @staticmethod
+    def remove_event_detect(pin):
+        LOGGER.debug(
+            'DummyGPIO: remove_event_detect got called with pin %s' % pin
+        )
+
     @staticmethod
     def add_event_callback(pin, event_happened):
         LOGGER.debug(
@@ -163,3 +169,18 @@ class DummyAdafruit_DHT(object):
             )
         )
         return humidity, temperature
+
+    @staticmethod
+    def read(dht_type, pin):
+        humidity = randint(0, 100)
+        temperature = randint(-50, 50)
+        LOGGER.debug(
+            'DummyAdafruit_DHT: read got called with dht_type %s and '
+            'pin %s, will return humidity %s and temperature %s.' % (
+                dht_type,
+                pin,
+                humidity,
+                temperature,
+            )
+        )
+        return humidity, temperature
@@ -0,0 +1,175 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Filters for the raw sensor reads, each one keeps a small window of the
+previous reads and returns the filtered value for the new one.
+
+They are configured as a comma separated list of filter specs, applied in
+order, each one being the filter name followed by its colon separated
+arguments, for example::
+
+    filters = hampel:5:3,median:3,rate:2
+"""
+import collections
+import logging
+
+
+LOGGER = logging.getLogger(__name__)
+#: Registry for filter types
+FILTERS = {}
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class MetaFilter(type):
+    def __init__(cls, name, bases, dct):
+        if name != 'Filter':
+            FILTERS[cls.NAME] = cls
+
+
+class Filter(object):
+    __metaclass__ = MetaFilter
+    NAME = None
+
+    def apply(self, value, timestamp):
+        raise NotImplementedError()
+
+
+class MedianFilter(Filter):
+    """
+    Median of the last size reads.
+    """
+    NAME = 'median'
+
+    def __init__(self, size=3):
+        self.window = collections.deque(maxlen=int(size))
+
+    def apply(self, value, timestamp):
+        self.window.append(value)
+        return median(self.window)
+
+
+class HampelFilter(Filter):
+    """
+    Replaces the reads that are further than threshold standard deviations
+    (estimated from the median absolute deviation) from the median of the
+    last size reads with that median, the rest are left as they are.
+
+    The deviation is never taken as smaller than min_deviation, so a few
+    equal reads don't make it reject any change.
+    """
+    NAME = 'hampel'
+    #: Scale to estimate the standard deviation from the MAD
+    MAD_SCALE = 1.4826
+    #: Reads needed before it starts rejecting
+    MIN_READS = 3
+
+    def __init__(self, size=5, threshold=3, min_deviation=0.5):
+        self.window = collections.deque(maxlen=int(size))
+        self.threshold = float(threshold)
+        self.min_deviation = float(min_deviation)
+
+    def apply(self, value, timestamp):
+        self.window.append(value)
+        if len(self.window) < self.MIN_READS:
+            return value
+
+        window_median = median(self.window)
+        deviation = max(
+            self.MAD_SCALE * median(
+                abs(read - window_median) for read in self.window
+            ),
+            self.min_deviation,
+        )
+        if abs(value - window_median) > self.threshold * deviation:
+            LOGGER.debug(
+                'Rejecting outlier %s, median %s', value, window_median
+            )
+            return window_median
+
+        return value
+
+
+class RateFilter(Filter):
+    """
+    Limits the change between consecutive values to max_rate units per
+    minute.
+    """
+    NAME = 'rate'
+
+    def __init__(self, max_rate=1):
+        self.max_rate = float(max_rate)
+        self.last = None
+        self.last_timestamp = None
+
+    def apply(self, value, timestamp):
+        if self.last is not None:
+            max_change = self.max_rate * max(
+                timestamp - self.last_timestamp,
+                1,
+            ) / 60.0
+            value = min(
+                max(value, self.last - max_change),
+                self.last + max_change,
+            )
+
+        self.last = value
+        self.last_timestamp = timestamp
+        return value
+
+
+class FilterPipeline(object):
+    def __init__(self, filters=None):
+        self.filters = filters or []
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Args:
+            spec(str): comma separated filter specs, see the module docs
+
+        Raises:
+            TypeError: if any of the filters does not exist
+        """
+        filters = []
+        for filter_spec in spec.split(','):
+            filter_spec = filter_spec.strip()
+            if not filter_spec:
+                continue
+
+            name, args = filter_spec.split(':')[0], filter_spec.split(':')[1:]
+            try:
+                filters.append(FILTERS[name](*args))
+            except KeyError:
+                raise TypeError(
+                    'Unknown filter %s, available: %s'
+                    % (name, FILTERS.keys())
+                )
+
+        return cls(filters)
+
+    def apply(self, value, timestamp):
+        for read_filter in self.filters:
+            value = read_filter.apply(value, timestamp)
+
+        return value
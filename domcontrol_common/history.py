@@ -0,0 +1,374 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+import array
+import logging
+import threading
+
+
+LOGGER = logging.getLogger(__name__)
+#: (seconds per bucket, buckets kept) for each rollup tier, a week of
+#: minutes, 90 days of hours and two years of days
+ROLLUP_TIERS = (
+    (60, 10080),
+    (3600, 2160),
+    (86400, 730),
+)
+
+
+class RingBuffer(object):
+    """
+    Fixed capacity buffer of (timestamp, value) samples, kept in two arrays
+    (32 bit unsigned int timestamps and float32 values), once full the new
+    samples overwrite the oldest ones.
+
+    The samples are expected in time order, an older timestamp than the
+    last one is stored as the last one, so the buffer is always sorted.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array.array('I', [0]) * capacity
+        self.values = array.array('f', [0.0]) * capacity
+        #: position of the oldest sample
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        if self.count:
+            timestamp = max(timestamp, self.timestamps[self._pos(-1)])
+
+        if self.count < self.capacity:
+            pos = self._pos(self.count)
+            self.count += 1
+        else:
+            pos = self.start
+            self.start = (self.start + 1) % self.capacity
+
+        self.timestamps[pos] = timestamp
+        self.values[pos] = value
+
+    def _pos(self, index):
+        """
+        Position in the arrays of the index-th oldest sample, negative
+        indexes count from the newest.
+        """
+        if index < 0:
+            index += self.count
+
+        return (self.start + index) % self.capacity
+
+    def _bisect(self, timestamp):
+        """
+        Returns:
+            int: index of the first sample with a timestamp >= the given one
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[self._pos(middle)] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def range(self, start=None, end=None):
+        """
+        Returns:
+            list(tuple): (timestamp, value) samples with start <= timestamp
+                <= end, oldest first
+        """
+        first = 0 if start is None else self._bisect(start)
+        last = self.count if end is None else self._bisect(end + 1)
+        samples = []
+        for index in xrange(first, last):
+            pos = self._pos(index)
+            samples.append((self.timestamps[pos], self.values[pos]))
+
+        return samples
+
+    def columns(self, start=None, end=None):
+        """
+        Same as range, but returns copies of the timestamps and values arrays
+        instead, without building a tuple per sample.
+        """
+        first = 0 if start is None else self._bisect(start)
+        last = self.count if end is None else self._bisect(end + 1)
+        first, last = self._pos(first), self._pos(first) + last - first
+        if last <= self.capacity:
+            return self.timestamps[first:last], self.values[first:last]
+
+        last -= self.capacity
+        return (
+            self.timestamps[first:] + self.timestamps[:last],
+            self.values[first:] + self.values[:last],
+        )
+
+    def query(self, start=None, end=None, step=None):
+        """
+        Same as range, but if step is passed, averages the samples in
+        buckets of step seconds, with the bucket start as timestamp.
+        """
+        samples = self.range(start, end)
+        if not step:
+            return samples
+
+        return downsample(samples, step)
+
+
+class RollupBuffer(RingBuffer):
+    """
+    RingBuffer of buckets of resolution seconds, with the min, max, mean and
+    count of the samples added to each of them.
+
+    The samples are added to the current bucket, that is stored once a
+    sample for a later one comes, queries include it too.
+    """
+    def __init__(self, resolution, capacity):
+        super(RollupBuffer, self).__init__(capacity)
+        self.resolution = resolution
+        self.mins = array.array('f', [0.0]) * capacity
+        self.maxs = array.array('f', [0.0]) * capacity
+        self.counts = array.array('I', [0]) * capacity
+        self.current = None
+
+    def add(self, timestamp, value):
+        bucket = timestamp - timestamp % self.resolution
+        current = self.current
+        if current is not None and bucket <= current[0]:
+            current[1] = min(current[1], value)
+            current[2] = max(current[2], value)
+            current[3] += value
+            current[4] += 1
+            return
+
+        if current is not None:
+            self._store(*current)
+
+        self.current = [bucket, value, value, value, 1]
+
+    def _store(self, bucket, min_value, max_value, total, count):
+        self.append(bucket, total / count)
+        pos = self._pos(-1)
+        self.mins[pos] = min_value
+        self.maxs[pos] = max_value
+        self.counts[pos] = count
+
+    def stats(self, start=None, end=None):
+        """
+        Returns:
+            list(tuple): (timestamp, min, max, mean, count) for each bucket
+                with start <= timestamp <= end
+        """
+        first = 0 if start is None else self._bisect(start)
+        last = self.count if end is None else self._bisect(end + 1)
+        buckets = []
+        for index in xrange(first, last):
+            pos = self._pos(index)
+            buckets.append((
+                self.timestamps[pos],
+                self.mins[pos],
+                self.maxs[pos],
+                self.values[pos],
+                self.counts[pos],
+            ))
+
+        current = self.current
+        if (
+            current is not None
+            and (start is None or current[0] >= start)
+            and (end is None or current[0] <= end)
+        ):
+            buckets.append((
+                current[0],
+                current[1],
+                current[2],
+                current[3] / current[4],
+                current[4],
+            ))
+
+        return buckets
+
+
+def merge_stats(buckets, step):
+    """
+    Merges the (timestamp, min, max, mean, count) buckets into buckets of
+    step seconds.
+    """
+    merged = []
+    for timestamp, min_value, max_value, mean, count in buckets:
+        bucket = timestamp - timestamp % step
+        if merged and merged[-1][0] == bucket:
+            _, prev_min, prev_max, prev_mean, prev_count = merged[-1]
+            total_count = prev_count + count
+            merged[-1] = (
+                bucket,
+                min(prev_min, min_value),
+                max(prev_max, max_value),
+                (prev_mean * prev_count + mean * count) / total_count,
+                total_count,
+            )
+        else:
+            merged.append((bucket, min_value, max_value, mean, count))
+
+    return merged
+
+
+def downsample(samples, step):
+    buckets = []
+    bucket = None
+    total = 0.0
+    count = 0
+    for timestamp, value in samples:
+        cur_bucket = timestamp - timestamp % step
+        if cur_bucket != bucket:
+            if count:
+                buckets.append((bucket, total / count))
+
+            bucket = cur_bucket
+            total = 0.0
+            count = 0
+
+        total += value
+        count += 1
+
+    if count:
+        buckets.append((bucket, total / count))
+
+    return buckets
+
+
+class MeasureHistory(object):
+    """
+    Keeps a RingBuffer for each of the metrics seen in the measures added,
+    and if rollups is set, a RollupBuffer for each of the ROLLUP_TIERS too.
+
+    The values stored are the same that get sent to graphite (see
+    Measure.to_graphite), that is, presence is stored as 1 or 0.
+
+    Measures that are not newer than the last one added are ignored, so
+    the same measure checked again is not stored twice.
+    """
+    def __init__(self, capacity, rollups=False):
+        self.capacity = capacity
+        self.rollups = rollups
+        self.last_timestamp = None
+        self.buffers = {}
+        #: metric -> list of RollupBuffer, finest first
+        self.tiers = {}
+        self.lock = threading.Lock()
+
+    def add(self, measure):
+        timestamp = measure.get('timestamp')
+        with self.lock:
+            if (
+                self.last_timestamp is not None
+                and timestamp <= self.last_timestamp
+            ):
+                return
+
+            self.last_timestamp = timestamp
+            for metric, value, timestamp in measure.to_graphite():
+                if metric == 'timestamp':
+                    continue
+
+                if metric not in self.buffers:
+                    self.buffers[metric] = RingBuffer(self.capacity)
+                    if self.rollups:
+                        self.tiers[metric] = [
+                            RollupBuffer(resolution, capacity)
+                            for resolution, capacity in ROLLUP_TIERS
+                        ]
+
+                self.buffers[metric].append(timestamp, value)
+                for tier in self.tiers.get(metric, []):
+                    tier.add(timestamp, value)
+
+    def metrics(self):
+        return self.buffers.keys()
+
+    def columns(self, metric, start=None, end=None):
+        """
+        Raises:
+            KeyError: if there's no history for the metric
+        """
+        with self.lock:
+            return self.buffers[metric].columns(start, end)
+
+    def _get_tier(self, metric, step):
+        """
+        Returns:
+            RollupBuffer: the coarsest tier with a resolution that is at
+                least as fine as step, None if there's none
+        """
+        tier = None
+        for candidate in self.tiers.get(metric, []):
+            if candidate.resolution <= step:
+                tier = candidate
+
+        return tier
+
+    def query(self, metric, start=None, end=None, step=None):
+        """
+        Returns the (timestamp, value) samples of the metric, averaged in
+        buckets of step seconds if passed, using the coarsest rollup tier
+        that can provide that resolution, if any.
+
+        Raises:
+            KeyError: if there's no history for the metric
+        """
+        with self.lock:
+            tier = step and self._get_tier(metric, step)
+            if not tier:
+                return self.buffers[metric].query(start, end, step)
+
+            return [
+                (timestamp, mean)
+                for timestamp, _, _, mean, _ in merge_stats(
+                    tier.stats(start, end),
+                    step,
+                )
+            ]
+
+    def stats(self, metric, start=None, end=None, step=60):
+        """
+        Returns:
+            list(tuple): (timestamp, min, max, mean, count) for each bucket
+                of step seconds, from the coarsest rollup tier that can
+                provide that resolution
+
+        Raises:
+            KeyError: if there's no history for the metric
+        """
+        with self.lock:
+            # raise KeyError for unknown metrics
+            self.buffers[metric]
+            tier = self._get_tier(metric, step)
+            if tier is None:
+                return merge_stats(
+                    [
+                        (timestamp, value, value, value, 1)
+                        for timestamp, value in self.buffers[metric].range(
+                            start,
+                            end,
+                        )
+                    ],
+                    step,
+                )
+
+            return merge_stats(tier.stats(start, end), step)
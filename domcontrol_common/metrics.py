@@ -18,248 +18,325 @@ import datetime
 import logging
 import time
 
+from . import timing
+
 
 LOGGER = logging.getLogger(__name__)
 METRICS = {}
+#: Metric names in registration order, the values of a measure are stored
+#: in the same order
+METRIC_NAMES = []
+#: Metric name -> position in METRIC_NAMES
+METRIC_INDEX = {}
 
 
 class MetaMetric(type):
     def __init__(cls, name, bases, dct):
         if name != 'Metric':
             METRICS[name.lower()] = cls
+            METRIC_INDEX[name.lower()] = len(METRIC_NAMES)
+            METRIC_NAMES.append(name.lower())
 
 
 class Metric(object):
     __metaclass__ = MetaMetric
+    __slots__ = ('value', )
     max_value = None
     min_value = None
     val_type = str
+    #: How to aggregate the values over time, see aggregation.AGGREGATORS
+    aggregation = 'mean'
+    #: If False, the aggregation ignores the time/size window
+    aggregation_windowed = True
 
     def __init__(self, value):
-        self.value = (
-            self.val_type(value)
-            if value is not None
-            else value
-        )
-        self.check_value()
-
-    def to_dict(self):
-        return self.value
-
-    def check_value(self):
-        if self.value is None:
-            return
-
-        if self.max_value is not None and self.value > self.max_value:
+        self.value = self.validate(value)
+
+    @classmethod
+    def from_value(cls, value):
+        """
+        Wraps an already validated value, skipping the checks.
+        """
+        metric = cls.__new__(cls)
+        metric.value = value
+        return metric
+
+    @classmethod
+    def validate(cls, value):
+        """
+        Returns:
+            object: the value converted to val_type
+
+        Raises:
+            TypeError: if the value is out of the metric limits
+        """
+        if value is None:
+            return value
+
+        value = cls.val_type(value)
+        if cls.max_value is not None and value > cls.max_value:
             raise TypeError(
                 '%s can\'t higher than max %s'
                 % (
-                    self,
-                    self.max_value
+                    cls.format(value),
+                    cls.max_value
                 )
             )
-        if self.min_value is not None and self.value < self.min_value:
+        if cls.min_value is not None and value < cls.min_value:
             raise TypeError(
                 '%s can\'t be lower than min %s'
                 % (
-                    self,
-                    self.min_value
+                    cls.format(value),
+                    cls.min_value
                 )
             )
 
+        return value
+
+    @classmethod
+    def format(cls, value):
+        return (
+            '%s' % value
+            if value is not None
+            else 'None'
+        )
+
+    def to_dict(self):
+        return self.value
+
+    def check_value(self):
+        self.validate(self.value)
+
     def __str__(self):
         return repr(self)
 
     def __repr__(self):
-        return (
-            '%s' % self.value
-            if self.value is not None
-            else u'None'
-        )
+        return self.format(self.value)
 
 
 class Temperature(Metric):
+    __slots__ = ()
     val_type = float
     min_value = -273.15
 
-    def __repr__(self):
+    @classmethod
+    def format(cls, value):
         return (
-            '%.2f°C' % self.value
-            if self.value is not None
-            else u'None'
+            '%.2f°C' % value
+            if value is not None
+            else 'None'
         )
 
 
 class Humidity(Metric):
+    __slots__ = ()
     val_type = float
     max_value = 100
     min_value = 0
 
-    def __repr__(self):
+    @classmethod
+    def format(cls, value):
         return (
-            '%.2f%%' % self.value
-            if self.value is not None
+            '%.2f%%' % value
+            if value is not None
             else 'None'
         )
 
 
 class Luminosity(Metric):
+    __slots__ = ()
     max_value = 1
     min_value = 0
     val_type = int
+    aggregation = 'last'
 
 
 class Presence(Metric):
+    __slots__ = ()
     min_value = 0
     val_type = int
+    # the value is the time of the last presence detected
+    aggregation = 'max'
+    aggregation_windowed = False
 
     def __init__(self, value=None):
-        LOGGER.debug('Presence %s' % value)
-        value = (
-            None
-            if value is None
-            else int(value)
-        )
         super(Presence, self).__init__(value)
 
-    def __repr__(self):
+    @classmethod
+    def format(cls, value):
         return (
             datetime.datetime.fromtimestamp(
-                int(self.value)
+                int(value)
             ).strftime('%H:%M:%S')
-            if self.value is not None
+            if value is not None
             else 'None'
         )
 
 
 class Timestamp(Metric):
+    __slots__ = ()
     val_type = int
     min_value = 0
 
     def __init__(self, value=None):
-        LOGGER.debug('Timestamp %s' % value)
-        value = value is None and int(time.time()) or int(value)
         super(Timestamp, self).__init__(value)
 
-    def __repr__(self):
+    @classmethod
+    def validate(cls, value):
+        if value is None:
+            return int(time.time())
+
+        return super(Timestamp, cls).validate(value)
+
+    @classmethod
+    def format(cls, value):
         return datetime.datetime.fromtimestamp(
-                int(self.value)
+                int(value)
             ).strftime('%H:%M:%S')
 
 
+TIMESTAMP_INDEX = METRIC_INDEX['timestamp']
+PRESENCE_INDEX = METRIC_INDEX['presence']
+METRIC_CLASSES = [METRICS[metric] for metric in METRIC_NAMES]
+
+
 class Measure(object):
-    def __init__(self, timestamp=None, **kwargs):
-        LOGGER.debug('::__init__::Measure, ts=%s, %s' % (timestamp, kwargs))
-        self.timestamp = Timestamp(timestamp)
-        self.metrics = METRICS.keys()
-        for metric, metric_cls in METRICS.items():
-            LOGGER.debug('::__init__:: adding metric %s::%s', metric, metric_cls)
-            if metric in kwargs:
-                value = kwargs.pop(metric)
-            elif metric == 'timestamp':
-                continue
-            else:
-                value = None
-            setattr(self, metric.lower(), metric_cls(value))
+    """
+    Set of values for each of the registered metrics at a given time.
+
+    The values are kept in a single list, in the same order as METRIC_NAMES,
+    the metric objects (measure.temperature...) are only built when accessed,
+    use get to get the plain value instead.
+
+    A stale measure is an old one served again as the sensor could not get a
+    new one in time.
+    """
+    __slots__ = ('values', 'stale')
+    metrics = METRIC_NAMES
+
+    def __init__(self, timestamp=None, stale=False, **kwargs):
+        values = [None] * len(METRIC_NAMES)
+        values[TIMESTAMP_INDEX] = Timestamp.validate(timestamp)
+        for metric, value in kwargs.items():
+            try:
+                index = METRIC_INDEX[metric]
+            except KeyError:
+                raise TypeError('Unknown metrics %s' % kwargs.keys())
+
+            values[index] = METRIC_CLASSES[index].validate(value)
+
+        self.values = values
+        self.stale = stale
+
+    @classmethod
+    def from_values(cls, values, stale=False):
+        """
+        Builds a measure from an already validated list of values, in the
+        METRIC_NAMES order.
+        """
+        measure = cls.__new__(cls)
+        measure.values = values
+        measure.stale = stale
+        return measure
+
+    def get(self, metric):
+        return self.values[METRIC_INDEX[metric]]
 
-        if kwargs:
-            raise TypeError('Unknown metrics %s' % kwargs.keys())
+    def __getattr__(self, metric):
+        try:
+            index = METRIC_INDEX[metric]
+        except KeyError:
+            raise AttributeError(metric)
+
+        return METRIC_CLASSES[index].from_value(self.values[index])
+
+    def __getitem__(self, metric):
+        return getattr(self, metric)
 
     def get_valued_metrics(self):
         return [
             metric
-            for metric in self.metrics
-            if getattr(self, metric) is not None
+            for metric, value in zip(METRIC_NAMES, self.values)
+            if value is not None
         ]
 
     def to_dict(self):
-        measure = {
-        }
-        for metric in self.metrics:
-            measure[metric] = getattr(self, metric).to_dict()
+        measure_dict = dict(zip(METRIC_NAMES, self.values))
+        if self.stale:
+            measure_dict['stale'] = True
 
-        return measure
+        return measure_dict
 
     def __repr__(self):
-        mystr = 'Measure(%s)' % (
+        mystr = 'Measure(%s%s)' % (
             ', '.join([
-                '%s=%s' % (metric, getattr(self, metric))
-                for metric in self.metrics
-            ])
+                '%s=%s' % (metric, metric_cls.format(value))
+                for metric, metric_cls, value in zip(
+                    METRIC_NAMES,
+                    METRIC_CLASSES,
+                    self.values,
+                )
+            ]),
+            self.stale and ', stale' or '',
         )
 
         return mystr
 
     def to_graphite(self):
-        LOGGER.debug('Measure::Sending to graphite %s', self)
-        for metric in self.metrics:
-            value = getattr(self, metric).value
+        values = self.values
+        timestamp = values[TIMESTAMP_INDEX]
+        for index, metric in enumerate(METRIC_NAMES):
+            value = values[index]
             if value is None:
-                LOGGER.debug('Skipping metric %s with value %s', metric, value)
                 continue
 
-            if metric == 'presence':
-                LOGGER.debug(
-                    'Got presence, with age %s', self.timestamp.value - value
-                )
-                if self.timestamp.value - value < 60:
+            if index == PRESENCE_INDEX:
+                if timestamp - value < 60:
                     value = 1
                 else:
                     value = 0
 
-            LOGGER.debug('Finally got %s, %s', metric, value)
-            yield (metric, value, self.timestamp.value)
+            yield (metric, value, timestamp)
 
 
-def get_mean_measure(measures):
-    LOGGER.debug('get_mean_measure::starting %s' % measures)
-    if not measures:
-        return None
+def mean(values):
+    return sum(values) / float(len(values))
 
-    metrics = {}
 
-    for measure in measures:
-        if measure is None:
-            continue
+#: Metric.aggregation -> function to reduce a list of values, the rest of
+#: the aggregations are reduced as a mean
+REDUCERS = {
+    'mean': mean,
+    'max': max,
+    'last': lambda values: values[-1],
+}
 
-        for metric in measure.metrics:
-            value = getattr(measure, metric).value
-            if (
-                metric.lower() == 'timestamp'
-                or value is None
-            ):
-                continue
 
-            if metric not in metrics:
-                metrics[metric] = []
-
-            metrics[metric].append(value)
+@timing.timed_func('metrics.get_mean_measure')
+def get_mean_measure(measures):
+    """
+    Aggregates the measures into a single one with the current time, each
+    metric as given by its Metric.aggregation (see REDUCERS).
+    """
+    if not measures:
+        return None
 
-    LOGGER.debug('get_mean_measure::    got metrics %s' % metrics)
-    final_metrics = {}
-    timestamp = str(int(time.time()))
-    for metric, values in metrics.items():
-        if metric == 'presence':
-            final_metrics[metric] = max(values)
-            LOGGER.debug(
-                'get_mean_measure::    presence %s->%s'
-                % (values, final_metrics[metric])
-            )
-            continue
-        if metric == 'luminosity':
-            LOGGER.debug('')
-            final_metrics[metric] = values[-1]
-            LOGGER.debug(
-                'get_mean_measure::    luminosity %s->%s'
-                % (values, final_metrics[metric])
-            )
+    measures = [measure for measure in measures if measure is not None]
+    final_values = [None] * len(METRIC_NAMES)
+    final_values[TIMESTAMP_INDEX] = int(time.time())
+    for index, metric_cls in enumerate(METRIC_CLASSES):
+        if index == TIMESTAMP_INDEX:
             continue
 
-        final_metrics[metric] = sum(values) / len(values)
-        LOGGER.debug(
-            'get_mean_measure::    %s %s->%s'
-            % (metric, values, final_metrics[metric])
-        )
-
-    return Measure(timestamp=timestamp, **final_metrics)
+        values = [
+            measure.values[index]
+            for measure in measures
+            if measure.values[index] is not None
+        ]
+        if values:
+            reducer = REDUCERS.get(metric_cls.aggregation, mean)
+            final_values[index] = metric_cls.val_type(reducer(values))
 
+    measure = Measure.from_values(final_values)
+    LOGGER.debug('get_mean_measure::    got measure %s', measure)
+    return measure
@@ -13,10 +13,15 @@
 # You should have received a copy of the GNU General Public License
 # along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
 #
+import bisect
 import datetime
 import logging
+import time
 
-from . import metrics as mod_metrics
+from . import (
+    metrics as mod_metrics,
+    timing,
+)
 
 
 LOGGER = logging.getLogger(__name__)
@@ -24,9 +29,31 @@ WEEKDAYS = [
     '%sday' % root
     for root in ('mon', 'tues', 'wednes', 'thurs', 'fri', 'satur', 'sun')
 ]
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+
+def minute_of_week(when):
+    """
+    Args:
+        when(datetime.datetime or float): local datetime or unix timestamp
+
+    Returns:
+        int: minutes since monday 00:00 (local time)
+    """
+    if isinstance(when, datetime.datetime):
+        return when.weekday() * DAY_MINUTES + when.hour * 60 + when.minute
+
+    when = time.localtime(when)
+    return when.tm_wday * DAY_MINUTES + when.tm_hour * 60 + when.tm_min
 
 
 class DayRange(object):
+    """
+    Range of minutes of the day, including the start minute, excluding the
+    end one, so 08:00-13:00 covers from 08:00 to 12:59 and 00:00-24:00 the
+    whole day.
+    """
     def __init__(self, start='00:00', end='00:00'):
         self.start = self.str_to_int(start)
         self.end = self.str_to_int(end)
@@ -49,6 +76,9 @@ class DayRange(object):
     def __eq__(self, what):
         return self.start == what.start and self.end == what.end
 
+    def __ne__(self, what):
+        return not self == what
+
     def __add__(self, what):
         if not isinstance(what, DayRange):
             raise TypeError("Can't sum %s to DayRange" % what.__class__)
@@ -65,12 +95,12 @@ class DayRange(object):
 
     def __sub__(self, what):
         if not isinstance(what, DayRange):
-            raise TypeError("Can't sum %s to DayRange" % what.__class__)
+            raise TypeError("Can't substract %s to DayRange" % what.__class__)
 
-        if what.start > self.end or self.start > what.end:
+        if what.start >= self.end or self.start >= what.end:
             return [DayRange(start=self.start, end=self.end)]
-        elif self.start > what.start and self.end < what.end:
-            return [DayRange(start=0, end=0)]
+        elif what.start <= self.start and self.end <= what.end:
+            return []
         elif self.start < what.start and self.end > what.end:
             return [
                 DayRange(start=self.start, end=what.start),
@@ -82,17 +112,14 @@ class DayRange(object):
             return [DayRange(start=what.end, end=self.end)]
 
     def __contains__(self, what):
-        if not isinstance(what, DayRange):
-            what = DayRange(start=what, end=what)
-
-        if (
-            what.start > self.start
-            and what.end < self.end
-            and self.end != self.start
-        ):
-            return True
+        if isinstance(what, DayRange):
+            return (
+                self.start <= what.start
+                and what.end <= self.end
+                and self.start != self.end
+            )
 
-        return False
+        return self.start <= self.str_to_int(what) < self.end
 
     def __repr__(self):
         return 'DayRange(start=%s, end=%s)' % (
@@ -112,21 +139,81 @@ class DayRange(object):
 
 
 class DaySchedule(list):
+    """
+    Sorted list of non overlapping, non empty, DayRanges, the ranges passed
+    are merged on creation and when added with add_range (don't modify the
+    list directly).
+    """
+    def __init__(self, ranges=None):
+        super(DaySchedule, self).__init__()
+        self._set_ranges(ranges or [])
+
+    def _set_ranges(self, ranges):
+        merged = []
+        for day_range in sorted(
+            ranges,
+            key=lambda day_range: (day_range.start, day_range.end),
+        ):
+            if day_range.start == day_range.end:
+                continue
+
+            if merged:
+                merged[-1:] = merged[-1] + day_range
+            else:
+                merged.append(DayRange(day_range.start, day_range.end))
+
+        self[:] = merged
+        self.starts = [day_range.start for day_range in merged]
+
     def add_range(self, day_range):
-        self.append(day_range)
+        self._set_ranges(list(self) + [day_range])
 
     @classmethod
     def from_str(cls, sched_str):
-        day_sched = cls()
-
+        ranges = []
         for time_range in sched_str.split(','):
-            if not time_range:
+            if not time_range.strip():
                 continue
 
             start, end = time_range.split('-', 1)
-            day_sched.add_range(DayRange(start=start, end=end))
+            ranges.append(DayRange(start=start.strip(), end=end.strip()))
+
+        return cls(ranges)
+
+    def union(self, other):
+        return DaySchedule(list(self) + list(other))
 
-        return day_sched
+    def intersection(self, other):
+        ranges = []
+        index = other_index = 0
+        while index < len(self) and other_index < len(other):
+            day_range, other_range = self[index], other[other_index]
+            start = max(day_range.start, other_range.start)
+            end = min(day_range.end, other_range.end)
+            if start < end:
+                ranges.append(DayRange(start, end))
+
+            if day_range.end < other_range.end:
+                index += 1
+            else:
+                other_index += 1
+
+        return DaySchedule(ranges)
+
+    def difference(self, other):
+        ranges = list(self)
+        for other_range in other:
+            ranges = [
+                remaining
+                for day_range in ranges
+                for remaining in day_range - other_range
+            ]
+
+        return DaySchedule(ranges)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
 
     def __repr__(self):
         return 'DaySchedule(%s)' % super(DaySchedule, self).__repr__()
@@ -135,15 +222,25 @@ class DaySchedule(list):
         return repr(self)
 
     def __contains__(self, what):
-        for day_range in self:
-            if what in day_range:
-                return True
+        if isinstance(what, DayRange):
+            start = what.start
+        else:
+            start = DayRange.str_to_int(what)
+
+        index = bisect.bisect_right(self.starts, start) - 1
+        return index >= 0 and what in self[index]
 
     def to_dict(self):
         return [day_range.to_dict() for day_range in self]
 
 
 class WeekSchedule(object):
+    """
+    Schedule for each day of the week, compiled into a bitmap with a byte
+    for each minute of the week, so checking if an instant is in schedule
+    is a single lookup, call compile again after changing any of the
+    DaySchedules.
+    """
     def __init__(self, name, **kwargs):
         self.name = name
 
@@ -156,42 +253,135 @@ class WeekSchedule(object):
             if not hasattr(self, day):
                 setattr(self, day, DaySchedule())
 
+        self.compile()
+
+    def compile(self):
+        bitmap = bytearray(WEEK_MINUTES)
+        for day_index, day in enumerate(WEEKDAYS):
+            offset = day_index * DAY_MINUTES
+            for day_range in getattr(self, day):
+                start = offset + min(day_range.start, DAY_MINUTES)
+                end = offset + min(day_range.end, DAY_MINUTES)
+                bitmap[start:end] = '\x01' * (end - start)
+
+        self.bitmap = bitmap
+        #: minutes of the week where it switches from active to inactive or
+        #: the other way around, wrapping around the end of the week
+        self.transitions = [
+            minute
+            for minute in xrange(WEEK_MINUTES)
+            if bitmap[minute] != bitmap[minute - 1]
+        ]
+
+    def _combine(self, other, operation, symbol, name=None):
+        return WeekSchedule(
+            name=name or '%s%s%s' % (self.name, symbol, other.name),
+            **dict(
+                (day, operation(getattr(self, day), getattr(other, day)))
+                for day in WEEKDAYS
+            )
+        )
+
+    def union(self, other, name=None):
+        return self._combine(other, DaySchedule.union, '|', name)
+
+    def intersection(self, other, name=None):
+        return self._combine(other, DaySchedule.intersection, '&', name)
+
+    def difference(self, other, name=None):
+        return self._combine(other, DaySchedule.difference, '-', name)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
     def schedule_at(self, when):
-        return getattr(self, when.strftime('%A').lower())
+        return getattr(self, WEEKDAYS[minute_of_week(when) // DAY_MINUTES])
+
+    def is_active(self, when=None):
+        """
+        Args:
+            when(datetime.datetime or float): local datetime or unix
+                timestamp, now if not passed
+        """
+        return bool(self.bitmap[minute_of_week(
+            when if when is not None else time.time()
+        )])
+
+    def next_transition(self, when=None):
+        """
+        Args:
+            when(datetime.datetime or float): local datetime or unix
+                timestamp, now if not passed
+
+        Returns:
+            datetime.datetime or float: the start of the next minute when
+                the schedule switches between active and inactive, of the
+                same type as when, None if it never does. Around DST changes
+                it's off by the change for the timestamps.
+        """
+        if not self.transitions:
+            return None
+
+        when = when if when is not None else time.time()
+        current = minute_of_week(when)
+        index = bisect.bisect_right(self.transitions, current)
+        if index < len(self.transitions):
+            minutes = self.transitions[index] - current
+        else:
+            minutes = self.transitions[0] + WEEK_MINUTES - current
 
+        if isinstance(when, datetime.datetime):
+            return (
+                when.replace(second=0, microsecond=0)
+                + datetime.timedelta(minutes=minutes)
+            )
+
+        return when - when % 60 + minutes * 60
+
+    @timing.timed_func('schedule.should_trigger')
     def should_trigger(
         self,
         measure,
         metrics,
         action,
-        active_limit,
-        inactive_limit,
+        active_limit=None,
+        inactive_limit=None,
         when=None,
+        limits=None,
     ):
-        when = (
-            when
-            if when is not None
-            else datetime.datetime.now()
-        )
-
-        if when.strftime('%H:%S') in self.schedule_at(when):
-            limit = active_limit
+        """
+        Args:
+            limits(dict): already resolved limits, schedule active (True or
+                False) -> metric -> LimitRange (see Actor.get_limits), if
+                passed active_limit and inactive_limit are ignored
+        """
+        active = self.is_active(when)
+        if limits is not None:
+            metric_limits = limits[active]
         else:
-            limit = inactive_limit
-
-        if action == 'rise':
-            limit = LimitRange(lower=limit)
-        elif action == 'lower':
-            limit = LimitRange(upper=limit)
+            metric_limits = None
+            limit = LimitRange.for_action(
+                action,
+                active_limit if active else inactive_limit,
+            )
 
         res = None
         for metric in metrics:
-            value = getattr(measure, metric).value
+            if metric_limits is not None:
+                limit = metric_limits[metric]
+
+            value = measure.get(metric)
+            if value is None:
+                # no data for it in the window, don't act on it
+                LOGGER.debug('No value for %s, skipping it', metric)
+                continue
+
             new_res = limit.triggers_at(
                 metric_value=value,
                 action=action,
             )
-            LOGGER.info(
+            LOGGER.debug(
                 'Checking %s against %s with action %s, with result %s',
                 value,
                 limit,
@@ -235,6 +425,13 @@ class WeekSchedule(object):
 
 
 class LimitRange(object):
+    """
+    The limits are not meant to change once created, so they can be shared,
+    see for_action.
+    """
+    #: (action, limit) -> LimitRange, see for_action
+    CACHE = {}
+
     def __init__(self, lower=None, upper=None):
         self.lower = lower
         self.upper = upper
@@ -249,6 +446,31 @@ class LimitRange(object):
             else lower
         )
 
+    @classmethod
+    def for_action(cls, action, limit):
+        """
+        Returns:
+            LimitRange: with limit as lower bound if the action is rise, or
+                as upper bound if it's lower, shared by all the callers
+
+        Raises:
+            TypeError: if the action is not rise or lower
+        """
+        try:
+            return cls.CACHE[(action, limit)]
+        except KeyError:
+            pass
+
+        if action == 'rise':
+            limit_range = cls(lower=limit)
+        elif action == 'lower':
+            limit_range = cls(upper=limit)
+        else:
+            raise TypeError('Action %s unknow, use "lower" or "rise"' % action)
+
+        cls.CACHE[(action, limit)] = limit_range
+        return limit_range
+
     def __repr__(self):
         return 'LimitRange(upper=%s, lower=%s)' % (
             self.upper,
@@ -320,8 +542,8 @@ def get_limits(config):
 
                 lower, upper = config.get(section, option).split(':', 1)
                 limits[option] = LimitRange(
-                    upper=upper and float(upper) or None,
-                    lower=lower and float(lower) or None,
+                    upper=float(upper) if upper.strip() else None,
+                    lower=float(lower) if lower.strip() else None,
                 )
 
             yield (sched_name, limits)
@@ -19,10 +19,14 @@ import logging
 import os
 import time
 import threading
+import Queue
 from functools import partial
 
 from . import (
+    filters as mod_filters,
+    history as mod_history,
     metrics as mod_metrics,
+    timing,
     utils,
 )
 
@@ -59,12 +63,16 @@ class Sensor(object):
         config=None,
         graphite_url=None,
         zone='default',
+        poll_interval=None,
+        history_size=8640,
     ):
         self.name = name
         self.pin = int(pin)
         self.graphite_url = graphite_url
         self.zone = zone
-        self.last_measure = None
+        self.poll_interval = poll_interval
+        self.history = mod_history.MeasureHistory(history_size)
+        self._last_measure = None
         self.log_debug('Initializing')
 
         for metric in self.METRICS:
@@ -79,9 +87,29 @@ class Sensor(object):
     def log_debug(self, msg, *args):
         LOGGER.debug('%s::%s::%s' % (self.zone, self.name, msg), *args)
 
+    def get_last_measure(self):
+        return self._last_measure
+
+    def set_last_measure(self, measure):
+        if measure is not None and measure is not self._last_measure:
+            self.history.add(measure)
+
+        self._last_measure = measure
+
+    last_measure = property(get_last_measure, set_last_measure)
+
     def add_callback(self, func):
         pass
 
+    def stop(self):
+        """
+        Stops any thread the sensor started, without waiting for it.
+
+        Returns:
+            list(threading.Thread): the threads to join
+        """
+        return []
+
     def read(self):
         raise NotImplementedError()
 
@@ -91,6 +119,7 @@ class Sensor(object):
             'pin': self.pin,
             'last_measure': self.last_measure and self.last_measure.to_dict(),
             'zone': self.zone,
+            'poll_interval': self.poll_interval,
         }
 
     def __repr__(self):
@@ -121,12 +150,31 @@ class RaspberrySensorMixin(Sensor):
 
 
 class EventRaspberrySensorMixin(RaspberrySensorMixin):
+    """
+    Sensor that reacts to the edges on its pin.
+
+    The GPIO callback only timestamps the edge and queues it, a worker
+    thread per sensor takes them from the queue, waits for the pin to settle,
+    merges any other edges that arrived meanwhile and runs the callbacks, so
+    the GPIO callback thread never blocks and no edge gets dropped.
+
+    The worker thread runs until stop is called, that also removes the edge
+    detection from the pin, so a reloaded sensor can add its own.
+    """
     EVENT = GPIO.RISING
-    LOCK = threading.Lock()
+    #: Seconds to wait for the pin to settle after an edge
+    DEBOUNCE_TIME = 0.1
 
     def __init__(self, *args, **kwargs):
         super(EventRaspberrySensorMixin, self).__init__(*args, **kwargs)
         self.callbacks = []
+        self.events = Queue.Queue()
+        self.event_worker = threading.Thread(
+            target=self.process_events,
+            name='sensor.%s.events' % self.name,
+        )
+        self.event_worker.daemon = True
+        self.event_worker.start()
         GPIO.add_event_detect(
             self.pin,
             self.EVENT,
@@ -143,11 +191,60 @@ class EventRaspberrySensorMixin(RaspberrySensorMixin):
         self.callbacks.append(func)
 
     def event_happened(self, pin):
-        if self.LOCK.locked():
-            self.log_debug('\n    EVENT-- ignoring, already parsing event')
-            return
+        self.events.put((pin, int(time.time())))
+
+    def stop(self):
+        GPIO.remove_event_detect(self.pin)
+        self.events.put(None)
+        return [self.event_worker]
+
+    def process_events(self):
+        stopping = False
+        while not stopping:
+            event = self.events.get()
+            if event is None:
+                return
 
-        time.sleep(0.1)
+            pin, timestamp = event
+            if pin != self.pin:
+                self.log_debug(
+                    '\n    EVENT-- ignoring, wrong channel %s' % pin
+                )
+                continue
+
+            time.sleep(self.DEBOUNCE_TIME)
+            merged = 0
+            while True:
+                try:
+                    event = self.events.get_nowait()
+                except Queue.Empty:
+                    break
+
+                if event is None:
+                    # handle the last one before leaving
+                    stopping = True
+                    break
+
+                pin, new_timestamp = event
+
+                if pin == self.pin:
+                    timestamp = max(timestamp, new_timestamp)
+                    merged += 1
+
+            if merged:
+                self.log_debug('\n    EVENT-- merged %d more events', merged)
+
+            try:
+                self.handle_event(timestamp)
+            except Exception as err:
+                LOGGER.exception(
+                    '%s::%s::Failed to handle event: %s',
+                    self.zone,
+                    self.name,
+                    err,
+                )
+
+    def handle_event(self, timestamp):
         cur_value = GPIO.input(self.pin) and 1 or 0
         if (
             (
@@ -158,34 +255,25 @@ class EventRaspberrySensorMixin(RaspberrySensorMixin):
             self.log_debug('\n    EVENT-- ignoring, false trigger')
             return
 
-        self.LOCK.acquire()
-        try:
-            if pin != self.pin:
-                self.log_debug(
-                    '\n    EVENT-- ignoring, wrong channel %s' % pin
-                )
-                return
-
-            self.log_debug('\n    EVENT-- Event detected on channel %s' % pin)
+        self.log_debug('\n    EVENT-- Event detected on channel %s' % self.pin)
 
-            # make sure that last_measure is updated
-            self.read()
+        # make sure that last_measure is updated
+        self.read(timestamp=timestamp)
 
-            for callback in self.callbacks:
-                callback(
-                    measure=self.last_measure,
-                    sensor=self.name,
-                    metrics=self.METRICS,
-                )
-        finally:
-            self.LOCK.release()
+        for callback in self.callbacks:
+            callback(
+                measure=self.last_measure,
+                sensor=self.name,
+                metrics=self.METRICS,
+            )
 
-    def read(self):
+    @timing.timed_func('sensors.read.event')
+    def read(self, timestamp=None):
         metrics = {}
         for metric in self.METRICS:
             metrics[metric] = GPIO.input(self.pin) and 1 or 0
 
-        self.last_measure = mod_metrics.Measure(**metrics)
+        self.last_measure = mod_metrics.Measure(timestamp=timestamp, **metrics)
         self.log_debug('read %s' % self.last_measure)
         return self.last_measure
 
@@ -203,11 +291,14 @@ class PresenceSensor(EventRaspberrySensorMixin):
     ]
     EVENT = GPIO.FALLING
 
-    def read(self):
+    @timing.timed_func('sensors.read.presence')
+    def read(self, timestamp=None):
         cur_value = GPIO.input(self.pin)
         if cur_value == 0:
+            timestamp = timestamp or int(time.time())
             self.last_measure = mod_metrics.Measure(
-                presence=int(time.time())
+                timestamp=timestamp,
+                presence=timestamp,
             )
         self.log_debug('read %s' % self.last_measure)
         return self.last_measure
@@ -220,6 +311,12 @@ class DHTSensor(RaspberrySensorMixin):
         '22': Adafruit_DHT.DHT22,
         '2302': Adafruit_DHT.AM2302,
     }
+    #: Minimum seconds between reads for each sensor type
+    MIN_READ_INTERVALS = {
+        '11': 1,
+        '22': 2,
+        '2302': 2,
+    }
     METRICS = [
         'temperature',
         'humidity'
@@ -230,6 +327,11 @@ class DHTSensor(RaspberrySensorMixin):
         super(DHTSensor, self).__init__(*args, **kwargs)
         dht_type = config(option='dht_type')
         self.dht_type = self.DHT_SENSOR_TYPES[dht_type]
+        self.min_read_interval = self.MIN_READ_INTERVALS[dht_type]
+        self.read_timeout = float(config(option='dht_read_timeout'))
+        self.last_read = None
+        self.last_read_failed = False
+        self.filters = {}
         for metric in self.METRICS:
             try:
                 offset = float(config(option=metric + '_offset'))
@@ -238,59 +340,105 @@ class DHTSensor(RaspberrySensorMixin):
 
             setattr(self, metric + '_offset', offset)
 
+            try:
+                filters = config(option=metric + '_filters')
+            except ConfigParser.NoOptionError:
+                filters = config(option='filters')
+
+            self.filters[metric] = mod_filters.FilterPipeline.from_spec(
+                filters
+            )
+
+    def cached_measure(self):
+        """
+        Returns:
+            Measure: the last good measure, marked as stale if the last read
+                failed, None if there's none
+        """
+        if self.last_measure is None or not self.last_read_failed:
+            return self.last_measure
+
+        return mod_metrics.Measure.from_values(
+            list(self.last_measure.values),
+            stale=True,
+        )
+
+    def hardware_read(self):
+        """
+        Tries to read from the sensor until it gets a value or runs out of
+        read_timeout seconds, never reading more often than the sensor
+        allows.
+
+        Returns:
+            tuple: humidity and temperature, both None if it failed
+        """
+        deadline = time.time() + self.read_timeout
+        while True:
+            self.last_read = time.time()
+            humidity, temperature = Adafruit_DHT.read(
+                self.dht_type,
+                self.pin,
+            )
+            if humidity is not None and temperature is not None:
+                return humidity, temperature
+
+            if time.time() + self.min_read_interval > deadline:
+                return None, None
+
+            time.sleep(self.min_read_interval)
+
+    @timing.timed_func('sensors.read.dht')
     def read(self):
         """
-        Gets a valid read measure (right now it has to retry a few times, read
-        a couple values and returns the max as there are low value outliers)
+        Does a hardware read, and passes each value through the configured
+        filters (see the filters module), that take care of the outliers
+        using the previous reads.
+
+        If called before the sensor allows a new read, returns the cached
+        measure, and if it can't read in dht_read_timeout seconds, the cached
+        one marked as stale.
 
         Very dependent on the hardware
 
         Returns:
-            Measure: timestamp, temperature and humidity reads
+            Measure: timestamp, temperature and humidity reads, or None if
+                the read failed and there's no previous one
         """
+        if (
+            self.last_read is not None
+            and time.time() - self.last_read < self.min_read_interval
+        ):
+            self.log_debug('Read too soon, using the cached measure')
+            return self.cached_measure()
+
         self.log_debug('Reading metrics')
-        humidity = None
-        prev_hum = None
-        temperature = None
-        prev_temp = None
-
-        while humidity is None:
-            self.log_debug(
-                'Doing a read loop, prev_hum=%s, humidity=%s'
-                % (prev_hum, humidity)
+        humidity, temperature = self.hardware_read()
+        self.last_read_failed = humidity is None
+        if self.last_read_failed:
+            self.log_info(
+                'Failed to read from the sensor in %ss', self.read_timeout
             )
-            if prev_hum is None:
-                prev_hum, prev_temp = Adafruit_DHT.read_retry(
-                    self.dht_type,
-                    self.pin,
-                )
-            else:
-                humidity, temperature = Adafruit_DHT.read_retry(
-                    self.dht_type,
-                    self.pin,
-                )
-            time.sleep(1)
+            return self.cached_measure()
 
-        norm_temp = (
-            self.temperature_offset + max((temperature, prev_temp))
-            if self.temperature_offset is not None
-            else max((temperature, prev_temp))
-        )
-        norm_hum = (
-            self.humidity_offset + max((humidity, prev_hum))
-            if self.humidity_offset is not None
-            else max((humidity, prev_hum))
-        )
+        timestamp = int(time.time())
+        norm_temp = self.filters['temperature'].apply(temperature, timestamp)
+        if self.temperature_offset is not None:
+            norm_temp += self.temperature_offset
+
+        norm_hum = self.filters['humidity'].apply(humidity, timestamp)
+        if self.humidity_offset is not None:
+            norm_hum += self.humidity_offset
 
         self.last_measure = mod_metrics.Measure(
+            timestamp=timestamp,
             temperature=norm_temp,
             humidity=norm_hum,
         )
 
         if self.graphite_url:
-            utils.send_to_graphite(
+            # sent along with the rest of the cycle
+            utils.get_graphite_sender(self.graphite_url).add(
                 measure=self.last_measure,
-                graphite_url=self.graphite_url,
                 prefix=self.name,
             )
 
@@ -299,12 +447,18 @@ class DHTSensor(RaspberrySensorMixin):
 
 def get_sensors(config):
     graphite_url = config.get('general', 'graphite_url')
+    history_size = config.getint('general', 'history_size')
     for section in config.sections():
         if section.split('.', 1)[0] == 'sensor':
             sensor_type = config.get(section, 'type')
             sensor_pin = config.get(section, 'pin')
             sensor_name = section.split('.', 1)[-1]
             sensor_zone = config.get(section, 'zone')
+            sensor_poll_interval = utils.getfloat(
+                config,
+                section,
+                'poll_interval',
+            )
 
             try:
                 yield SENSORS[sensor_type](
@@ -313,6 +467,8 @@ def get_sensors(config):
                     pin=sensor_pin,
                     graphite_url=graphite_url,
                     zone=sensor_zone,
+                    poll_interval=sensor_poll_interval,
+                    history_size=history_size,
                 )
             except KeyError:
                 raise KeyError(
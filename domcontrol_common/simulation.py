@@ -0,0 +1,307 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Offline simulation of the actors of a zone.
+
+Replays recorded zone measures (a store directory, or a json list of
+measures like the /store endpoint returns) through the actors and
+schedules of a config, with the measure timestamps as the current time,
+and reports how many times each actor switched, the time it was active
+and how many times it flip-flopped, so the limits and schedules can be
+tuned before deploying them.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from . import (
+    batch as mod_batch,
+    conf,
+    metrics as mod_metrics,
+    schedule as mod_schedule,
+    store as mod_store,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+#: Seconds under which a switch that undoes the previous one is a flip-flop
+FLIP_FLOP_TIME = 300
+
+
+class SimulatedActorMixin(object):
+    """
+    Keeps the actor state in memory instead of on its pin, and records when
+    it changes, set sim_now to the time of the measure before parsing it.
+    """
+    def setup(self):
+        self.sim_active = False
+        self.sim_now = None
+        self.changes = []
+
+    def get_active(self):
+        return self.sim_active
+
+    def set_active(self, value):
+        if value:
+            self.activate()
+        else:
+            self.deactivate()
+
+    active = property(get_active, set_active)
+
+    def activate(self):
+        if not self.sim_active:
+            self.sim_active = True
+            self.changes.append((self.sim_now, True))
+
+    def deactivate(self):
+        if self.sim_active:
+            self.sim_active = False
+            self.changes.append((self.sim_now, False))
+
+
+def get_simulated_classes():
+    """
+    Returns:
+        dict: actor type -> simulated version of that actor class
+    """
+    # imported here, as it loads the GPIO lib, see main
+    from . import actors as mod_actors
+
+    return dict(
+        (
+            name,
+            # ending in Mixin so it does not get registered as an actor
+            type(
+                'Simulated%sMixin' % name,
+                (SimulatedActorMixin, actor_cls),
+                {},
+            ),
+        )
+        for name, actor_cls in mod_actors.ACTORS.items()
+    )
+
+
+def get_actors(config, zone):
+    from . import actors as mod_actors
+
+    return [
+        actor
+        for actor in mod_actors.get_actors(
+            config,
+            classes=get_simulated_classes(),
+        )
+        if actor.zone == zone
+    ]
+
+
+def presence_to_timestamps(batch):
+    """
+    The store keeps presence as 1 or 0 (see Measure.to_graphite), while the
+    actors expect the time of the last presence, this converts it back, in
+    place, if the presence values are flags.
+    """
+    presence = batch.column('presence')
+    valid = ~np.isnan(presence)
+    if not valid.any() or presence[valid].max() > 1:
+        return batch
+
+    indexes = np.where(presence == 1, np.arange(len(batch)), -1)
+    last_presence = np.maximum.accumulate(indexes)
+    batch.columns[mod_metrics.PRESENCE_INDEX] = np.where(
+        last_presence >= 0,
+        batch.timestamps[last_presence].astype(np.float64),
+        np.nan,
+    )
+    return batch
+
+
+def load_measures(path, start=None, end=None):
+    """
+    Args:
+        path(str): store directory, or json file with a list of measure
+            dictionaries
+
+    Returns:
+        batch.MeasureBatch: the measures sorted by time
+    """
+    if os.path.isdir(path):
+        # read only, it might be the store of a running agent
+        batch = mod_store.Store(path, read_only=True).batch(start, end)
+    else:
+        with open(path) as measures_fd:
+            measures = json.load(measures_fd)
+
+        batch = mod_batch.MeasureBatch.from_columns(
+            [measure['timestamp'] for measure in measures],
+            dict(
+                (
+                    metric,
+                    np.array(
+                        [measure.get(metric) for measure in measures],
+                        dtype=np.float64,
+                    ),
+                )
+                for metric in mod_metrics.METRIC_NAMES
+                if metric != 'timestamp'
+            ),
+        )
+        batch = batch[np.argsort(batch.timestamps, kind='mergesort')]
+        batch = batch.between(start, end)
+
+    return presence_to_timestamps(batch)
+
+
+def report(actor, start, end, flip_flop_time=FLIP_FLOP_TIME):
+    active_time = 0
+    active_since = None
+    for timestamp, active in actor.changes:
+        if active:
+            active_since = timestamp
+        elif active_since is not None:
+            active_time += timestamp - active_since
+            active_since = None
+
+    if active_since is not None:
+        active_time += end - active_since
+
+    return {
+        'activations': len([
+            change for change in actor.changes if change[1]
+        ]),
+        'deactivations': len([
+            change for change in actor.changes if not change[1]
+        ]),
+        'active_time': active_time,
+        'active_ratio': (
+            float(active_time) / (end - start) if end > start else 0.0
+        ),
+        'flip_flops': len([
+            None
+            for prev_change, change in zip(
+                actor.changes,
+                actor.changes[1:],
+            )
+            if change[0] - prev_change[0] < flip_flop_time
+        ]),
+    }
+
+
+def simulate(batch, actors, schedules, flip_flop_time=FLIP_FLOP_TIME):
+    """
+    Runs each measure of the batch through the actors, in order.
+
+    Args:
+        batch(batch.MeasureBatch): measures to replay
+        actors(list): simulated actors, see get_actors
+        schedules(dict): name -> WeekSchedule
+        flip_flop_time(int): see FLIP_FLOP_TIME
+
+    Returns:
+        dict: actor name -> report dict
+    """
+    if not len(batch):
+        raise RuntimeError('No measures to simulate')
+
+    actor_schedules = [
+        (actor, schedules[actor.schedule])
+        for actor in actors
+    ]
+    for measure in batch.to_measures():
+        when = measure.values[mod_metrics.TIMESTAMP_INDEX]
+        for actor, schedule in actor_schedules:
+            actor.sim_now = when
+            actor.parse_measure(
+                measure=measure,
+                schedule=schedule,
+                when=when,
+            )
+
+    start, end = int(batch.timestamps[0]), int(batch.timestamps[-1])
+    reports = {}
+    for actor in actors:
+        reports[actor.name] = report(actor, start, end, flip_flop_time)
+        reports[actor.name]['measures'] = len(batch)
+        reports[actor.name]['start'] = start
+        reports[actor.name]['end'] = end
+
+    return reports
+
+
+def main(args=None):
+    logging.basicConfig(level=logging.WARNING)
+    # the actors only keep their state in memory here, so there's no need
+    # for the GPIO lib
+    os.environ.setdefault('DEBUG_MODE', 'true')
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--config', default=None)
+    parser.add_argument(
+        'measures',
+        help='Store directory or json file with the measures to replay',
+    )
+    parser.add_argument('-z', '--zone', default='default')
+    parser.add_argument('--start', type=int, default=None)
+    parser.add_argument('--end', type=int, default=None)
+    parser.add_argument(
+        '-o', '--option',
+        action='append',
+        default=[],
+        help=(
+            'Override a config option, as section:option=value, for example '
+            'actor.hum-extractor:active_time_limit=70'
+        ),
+    )
+    parser.add_argument(
+        '--flip-flop-time',
+        type=int,
+        default=FLIP_FLOP_TIME,
+    )
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(args)
+
+    config = conf.load_config(args.config, defaults=conf.CONF_DEFAULTS)
+    for override in args.option:
+        section, option = override.split(':', 1)
+        option, value = option.split('=', 1)
+        config.set(section, option, value)
+
+    schedules = dict(
+        (schedule.name, schedule)
+        for schedule in mod_schedule.get_schedules(config)
+    )
+    actors = get_actors(config, args.zone)
+    if not actors:
+        sys.exit('No actors found for zone %s' % args.zone)
+
+    batch = load_measures(args.measures, args.start, args.end)
+    reports = simulate(batch, actors, schedules, args.flip_flop_time)
+    if args.json:
+        print json.dumps(reports, sort_keys=True, indent=4)
+        return
+
+    for name, actor_report in sorted(reports.items()):
+        print '%s:' % name
+        for key, value in sorted(actor_report.items()):
+            print '    %s: %s' % (key, value)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
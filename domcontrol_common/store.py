@@ -0,0 +1,559 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+import glob
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from . import (
+    compression,
+    metrics as mod_metrics,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+MAGIC = 'DCTS'
+VERSION = 1
+#: magic, version, header size, record count capacity, record count,
+#: followed by the comma separated metric names
+HEADER = struct.Struct('<4sHHII')
+HEADER_SIZE = 256
+COUNT_OFFSET = struct.calcsize('<4sHHI')
+COMPRESSED_MAGIC = 'DCTZ'
+#: magic, version, record count, first and last timestamps and metric names
+#: length, followed by the comma separated metric names and the columns
+COMPRESSED_HEADER = struct.Struct('<4sHIIIH')
+COLUMN_LENGTH = struct.Struct('<I')
+TIMESTAMP = struct.Struct('<I')
+NAN = float('nan')
+
+
+def record_struct(metrics):
+    """
+    Each record is the timestamp as an unsigned int, followed by a float32
+    for each of the metrics, NaN for the missing ones.
+    """
+    return struct.Struct('<I' + 'f' * len(metrics))
+
+
+def record_dtype(metrics):
+    """
+    Numpy dtype for the records, see record_struct.
+    """
+    import numpy as np
+
+    return np.dtype(
+        [('timestamp', '<u4')] + [(metric, '<f4') for metric in metrics]
+    )
+
+
+class Segment(object):
+    """
+    Memory mapped file with a fixed number of fixed size records, preallocated
+    when created, records are only appended.
+
+    If read_only is set, the file must exist, and it's mapped read only.
+    """
+    def __init__(self, path, metrics=None, capacity=None, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        if read_only or os.path.exists(path):
+            self._open()
+        else:
+            self._create(metrics, capacity)
+
+        self.record = record_struct(self.metrics)
+
+    def _create(self, metrics, capacity):
+        self.metrics = list(metrics)
+        self.capacity = capacity
+        self.count = 0
+        names = ','.join(self.metrics)
+        if HEADER.size + len(names) > HEADER_SIZE:
+            raise TypeError('Too many metrics to fit in the header: %s' % names)
+
+        size = HEADER_SIZE + capacity * record_struct(self.metrics).size
+        with open(self.path, 'wb') as seg_fd:
+            seg_fd.write(
+                HEADER.pack(MAGIC, VERSION, HEADER_SIZE, capacity, 0)
+                + names
+            )
+            seg_fd.truncate(size)
+
+        self._map()
+
+    def _open(self):
+        with open(self.path, 'rb') as seg_fd:
+            header = seg_fd.read(HEADER_SIZE)
+
+        magic, version, _, capacity, count = HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION:
+            raise TypeError('%s is not a valid segment file' % self.path)
+
+        self.metrics = header[HEADER.size:].rstrip('\0').split(',')
+        self.capacity = capacity
+        self.count = count
+        self._map()
+
+    def _map(self):
+        if self.read_only:
+            with open(self.path, 'rb') as seg_fd:
+                self.mm = mmap.mmap(
+                    seg_fd.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ,
+                )
+            return
+
+        with open(self.path, 'r+b') as seg_fd:
+            self.mm = mmap.mmap(seg_fd.fileno(), 0)
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, timestamp, values):
+        offset = HEADER_SIZE + self.count * self.record.size
+        self.record.pack_into(self.mm, offset, timestamp, *values)
+        # the count goes last, so readers never see a half written record
+        self.count += 1
+        struct.pack_into('<I', self.mm, COUNT_OFFSET, self.count)
+
+    def timestamp_at(self, index):
+        return TIMESTAMP.unpack_from(
+            self.mm,
+            HEADER_SIZE + index * self.record.size,
+        )[0]
+
+    def _bisect(self, timestamp):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp_at(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def first_timestamp(self):
+        return self.count and self.timestamp_at(0) or None
+
+    def last_timestamp(self):
+        return self.count and self.timestamp_at(self.count - 1) or None
+
+    def view(self, start=None, end=None):
+        """
+        Returns:
+            buffer: read only view (no copy) of the records with start <=
+                timestamp <= end
+        """
+        first = 0 if start is None else self._bisect(start)
+        last = self.count if end is None else self._bisect(end + 1)
+        return buffer(
+            self.mm,
+            HEADER_SIZE + first * self.record.size,
+            (last - first) * self.record.size,
+        )
+
+    def records(self, start=None, end=None):
+        view = self.view(start, end)
+        for offset in xrange(0, len(view), self.record.size):
+            yield self.record.unpack_from(view, offset)
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+
+
+class CompressedSegment(object):
+    """
+    Sealed segment, with each column (timestamps and each metric) compressed
+    with the gorilla style encoding in compression, and decoded on the fly
+    when read.
+
+    Reads return the same records that the Segment they were created from,
+    view is not a view here, but the packed records.
+    """
+    full = True
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as seg_fd:
+            header = seg_fd.read(COMPRESSED_HEADER.size)
+            (
+                magic,
+                version,
+                self.count,
+                self._first_timestamp,
+                self._last_timestamp,
+                names_length,
+            ) = COMPRESSED_HEADER.unpack(header)
+            if magic != COMPRESSED_MAGIC or version != VERSION:
+                raise TypeError('%s is not a valid segment file' % path)
+
+            self.metrics = seg_fd.read(names_length).split(',')
+
+        self.record = record_struct(self.metrics)
+
+    @classmethod
+    def seal(cls, segment):
+        """
+        Creates a compressed segment with the records of the given one, next
+        to it, with the same name and .gor extension.
+        """
+        columns = zip(*segment.records()) or [[]] * (len(segment.metrics) + 1)
+        path = os.path.splitext(segment.path)[0] + '.gor'
+        names = ','.join(segment.metrics)
+        with open(path + '.tmp', 'wb') as seg_fd:
+            seg_fd.write(COMPRESSED_HEADER.pack(
+                COMPRESSED_MAGIC,
+                VERSION,
+                segment.count,
+                segment.first_timestamp() or 0,
+                segment.last_timestamp() or 0,
+                len(names),
+            ))
+            seg_fd.write(names)
+            encoded = [compression.encode_timestamps(columns[0])] + [
+                compression.encode_values(column)
+                for column in columns[1:]
+            ]
+            for data in encoded:
+                seg_fd.write(COLUMN_LENGTH.pack(len(data)))
+                seg_fd.write(data)
+
+        os.rename(path + '.tmp', path)
+        return cls(path)
+
+    def first_timestamp(self):
+        return self.count and self._first_timestamp or None
+
+    def last_timestamp(self):
+        return self.count and self._last_timestamp or None
+
+    def columns(self):
+        with open(self.path, 'rb') as seg_fd:
+            seg_fd.seek(COMPRESSED_HEADER.size + len(','.join(self.metrics)))
+            data = seg_fd.read()
+
+        columns = []
+        offset = 0
+        while offset < len(data):
+            length = COLUMN_LENGTH.unpack_from(data, offset)[0]
+            offset += COLUMN_LENGTH.size
+            columns.append(data[offset:offset + length])
+            offset += length
+
+        return columns
+
+    def records(self, start=None, end=None):
+        columns = self.columns()
+        decoders = [compression.decode_timestamps(columns[0], self.count)] + [
+            compression.decode_values(column, self.count)
+            for column in columns[1:]
+        ]
+        for record in zip(*decoders):
+            if start is not None and record[0] < start:
+                continue
+
+            if end is not None and record[0] > end:
+                break
+
+            yield record
+
+    def view(self, start=None, end=None):
+        return ''.join(
+            self.record.pack(*record)
+            for record in self.records(start, end)
+        )
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Store(object):
+    """
+    Append only time series store, made of memory mapped segment files of
+    segment_size records each, in a directory. When a segment is full a new
+    one is started, and only the newest max_segments are kept.
+
+    The values stored are the same that get sent to graphite (see
+    Measure.to_graphite), so presence is stored as 1 or 0.
+
+    If compress is set, the full segments are replaced with compressed
+    ones (see CompressedSegment) in the background.
+
+    The segment being written is flushed to disk at most every
+    flush_interval seconds, and when it gets full, the records appended
+    since are left to the page cache until then.
+
+    If read_only is set, the store is only read, as it was when opened,
+    without changing anything in the directory, so it can be used on the
+    store of a running agent.
+    """
+    def __init__(
+        self,
+        path,
+        segment_size=8640,
+        max_segments=30,
+        compress=False,
+        read_only=False,
+        flush_interval=60,
+    ):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self.compress = compress
+        self.read_only = read_only
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.metrics = [
+            metric
+            for metric in mod_metrics.METRIC_NAMES
+            if metric != 'timestamp'
+        ]
+        self.lock = threading.Lock()
+        if read_only:
+            if not os.path.isdir(path):
+                raise IOError('No store found at %s' % path)
+        elif not os.path.exists(path):
+            os.makedirs(path)
+
+        self.segments = []
+        compressed = dict(
+            (os.path.splitext(seg_path)[0], seg_path)
+            for seg_path in glob.glob(os.path.join(path, '*.gor'))
+        )
+        for seg_path in sorted(glob.glob(os.path.join(path, '*.seg'))):
+            name = os.path.splitext(seg_path)[0]
+            if name in compressed:
+                # if it got interrupted while compressing (or it's being
+                # compressed right now), use the compressed one
+                if not read_only:
+                    os.remove(seg_path)
+
+                continue
+
+            try:
+                segment = Segment(seg_path, read_only=read_only)
+            except (IOError, OSError):
+                if not read_only or not os.path.exists(name + '.gor'):
+                    raise
+
+                # compressed by the agent meanwhile
+                compressed[name] = name + '.gor'
+                continue
+
+            if segment.count:
+                self.segments.append(segment)
+            else:
+                # started right before a stop, nothing in it
+                segment.close()
+                if not read_only:
+                    os.remove(seg_path)
+
+        for seg_path in compressed.values():
+            self.segments.append(CompressedSegment(seg_path))
+
+        self.segments.sort(key=lambda segment: segment.path)
+        if self.segments and self.segments[-1].metrics != self.metrics:
+            # metrics changed, start a new one with the current ones
+            self.segments[-1].capacity = self.segments[-1].count
+
+        if self.compress and not read_only:
+            for segment in self.segments[:-1]:
+                if isinstance(segment, Segment):
+                    self._seal(segment)
+
+    def _new_segment(self, timestamp):
+        name = os.path.join(self.path, '%010d' % timestamp)
+        # the previous one got full within the same second, the names only
+        # have to keep the order
+        while os.path.exists(name + '.seg') or os.path.exists(name + '.gor'):
+            timestamp += 1
+            name = os.path.join(self.path, '%010d' % timestamp)
+
+        segment = Segment(
+            name + '.seg',
+            metrics=self.metrics,
+            capacity=self.segment_size,
+        )
+        if self.segments:
+            self._flush()
+            if self.compress:
+                self._start_seal(self.segments[-1])
+
+        self.segments.append(segment)
+        while len(self.segments) > self.max_segments:
+            old_segment = self.segments.pop(0)
+            LOGGER.info('Removing old segment %s', old_segment.path)
+            # not closing the map, as there might be views of it still in
+            # use, it will be unmapped when they are gone
+            os.remove(old_segment.path)
+
+        return segment
+
+    def _start_seal(self, segment):
+        sealer = threading.Thread(
+            target=self._seal,
+            args=[segment],
+            name='store.seal.%s' % segment.path,
+        )
+        sealer.daemon = True
+        sealer.start()
+
+    def _seal(self, segment):
+        try:
+            compressed = CompressedSegment.seal(segment)
+        except Exception as err:
+            LOGGER.exception('Failed to compress %s: %s', segment.path, err)
+            return
+
+        with self.lock:
+            if segment not in self.segments:
+                # removed by the retention meanwhile
+                os.remove(compressed.path)
+                return
+
+            self.segments[self.segments.index(segment)] = compressed
+
+        # not closing the map, as there might be views of it still in use
+        os.remove(segment.path)
+
+    def append(self, measure):
+        if self.read_only:
+            raise IOError('The store at %s is read only' % self.path)
+
+        values = [NAN] * len(self.metrics)
+        timestamp = measure.get('timestamp')
+        for metric, value, _ in measure.to_graphite():
+            if metric != 'timestamp':
+                values[self.metrics.index(metric)] = value
+
+        with self.lock:
+            if self.segments:
+                timestamp = max(timestamp, self.segments[-1].last_timestamp())
+
+            if not self.segments or self.segments[-1].full:
+                self._new_segment(timestamp)
+
+            self.segments[-1].append(timestamp, values)
+            if time.time() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def views(self, start=None, end=None, limit=None):
+        """
+        Args:
+            limit(int): if set, only the newest limit records in the range
+
+        Returns:
+            list(tuple): (metrics, buffer) for each segment with records in
+                the range, the buffers are views of the mapped files, see
+                record_struct for their format
+        """
+        with self.lock:
+            segments = [
+                segment
+                for segment in self.segments
+                if not (
+                    end is not None and segment.first_timestamp() > end
+                    or start is not None and segment.last_timestamp() < start
+                )
+            ]
+
+        if limit is None:
+            return [
+                (segment.metrics, segment.view(start, end))
+                for segment in segments
+            ]
+
+        # from the newest back, so the older segments are not even read
+        views = []
+        for segment in reversed(segments):
+            if limit <= 0:
+                break
+
+            view = segment.view(start, end)
+            count = len(view) // segment.record.size
+            if count > limit:
+                view = buffer(view, (count - limit) * segment.record.size)
+                count = limit
+
+            views.append((segment.metrics, view))
+            limit -= count
+
+        views.reverse()
+        return views
+
+    def batch(self, start=None, end=None, limit=None):
+        """
+        Returns:
+            batch.MeasureBatch: the records with start <= timestamp <= end,
+                only the newest limit of them if set
+        """
+        # imported here, numpy is only needed for the bulk reads, not to
+        # store the measures
+        import numpy as np
+        from . import batch as mod_batch
+
+        batches = []
+        for metrics, view in self.views(start, end, limit):
+            records = np.frombuffer(view, dtype=record_dtype(metrics))
+            batches.append(mod_batch.MeasureBatch.from_columns(
+                records['timestamp'],
+                dict(
+                    (metric, records[metric])
+                    for metric in metrics
+                    if metric in mod_metrics.METRIC_INDEX
+                ),
+            ))
+
+        return mod_batch.MeasureBatch.concatenate(batches)
+
+    def query(self, start=None, end=None, limit=None):
+        """
+        Returns:
+            list(dict): the records with start <= timestamp <= end, only the
+                newest limit of them if set, as dictionaries with a key for
+                each metric, None if missing
+        """
+        return self.batch(start, end, limit).to_dicts()
+
+    def _flush(self):
+        if self.segments and not self.read_only:
+            self.segments[-1].flush()
+
+        self.last_flush = time.time()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+
+            for segment in self.segments:
+                segment.close()
@@ -0,0 +1,187 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+import heapq
+import itertools
+import logging
+import os
+import select
+import threading
+import time
+import Queue
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Task(object):
+    def __init__(self, name, func, interval=None, worker=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.worker = worker
+        self.cancelled = False
+        #: set while the task is waiting on or running in its worker
+        self.pending = False
+
+    def run(self):
+        try:
+            self.func()
+        except Exception as err:
+            LOGGER.exception('Task %s failed: %s', self.name, err)
+        finally:
+            self.pending = False
+
+    def __repr__(self):
+        return 'Task(%s, interval=%s)' % (self.name, self.interval)
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class Worker(threading.Thread):
+    """
+    Thread that runs the tasks submitted to it one after the other.
+    """
+    def __init__(self, name):
+        super(Worker, self).__init__(name=name)
+        self.daemon = True
+        self.tasks = Queue.Queue()
+
+    def submit(self, task):
+        self.tasks.put(task)
+
+    def stop(self):
+        self.tasks.put(None)
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+
+            task.run()
+
+
+class Scheduler(object):
+    """
+    Keeps a heap of tasks ordered by the next time they are due, and sleeps
+    until the first of them is.
+
+    The sleep is done with select on a pipe instead of a timed
+    Event/Condition wait, as those poll every few milliseconds on python 2,
+    that way the thread only wakes up when something is due, a task is added
+    or it is stopped.
+
+    Tasks with a worker are handed over to it, so slow tasks don't delay the
+    rest, if the previous run of a task is still pending the new one is
+    skipped. Tasks without worker run inline on the scheduler thread.
+    """
+    def __init__(self):
+        self._heap = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self.stopped = False
+
+    def add(self, name, func, interval=None, delay=0, worker=None):
+        """
+        Args:
+            name (str): name of the task, for logging
+            func (callable): what to run, without parameters
+            interval (float): seconds between runs, None to run only once
+            delay (float): seconds to wait before the first run
+            worker (Worker): worker to run the task on, None to run on the
+                scheduler thread
+
+        Returns:
+            Task: the new task, can be passed to cancel
+        """
+        task = Task(name=name, func=func, interval=interval, worker=worker)
+        self._push(time.time() + delay, task)
+        self.wakeup()
+        return task
+
+    def cancel(self, task):
+        # it will be dropped when it gets to the top of the heap
+        task.cancelled = True
+
+    def wakeup(self):
+        os.write(self._wakeup_write, 'x')
+
+    def stop(self):
+        self.stopped = True
+        self.wakeup()
+
+    def _push(self, due, task):
+        with self._lock:
+            heapq.heappush(self._heap, (due, next(self._counter), task))
+
+    def _pop_due(self):
+        due_tasks = []
+        now = time.time()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, _, task = heapq.heappop(self._heap)
+                if task.cancelled:
+                    continue
+
+                due_tasks.append(task)
+                if task.interval:
+                    # don't try to catch up if we are late, just skip
+                    heapq.heappush(
+                        self._heap,
+                        (
+                            max(due + task.interval, now),
+                            next(self._counter),
+                            task,
+                        ),
+                    )
+
+            next_due = (
+                max(self._heap[0][0] - now, 0)
+                if self._heap
+                else None
+            )
+
+        return due_tasks, next_due
+
+    def _dispatch(self, task):
+        if task.worker is None:
+            task.run()
+        elif task.pending:
+            LOGGER.warning('Task %s still running, skipping', task.name)
+        else:
+            task.pending = True
+            task.worker.submit(task)
+
+    def run(self):
+        while not self.stopped:
+            due_tasks, next_due = self._pop_due()
+            for task in due_tasks:
+                if self.stopped:
+                    return
+
+                self._dispatch(task)
+
+            if due_tasks:
+                # running them might have taken a while, recheck
+                continue
+
+            readable, _, _ = select.select(
+                [self._wakeup_read], [], [], next_due,
+            )
+            if readable:
+                os.read(self._wakeup_read, 512)
@@ -0,0 +1,176 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+import collections
+import functools
+import logging
+import threading
+import time
+
+
+LOGGER = logging.getLogger(__name__)
+#: Set to True to start collecting timings, see setup
+ENABLED = False
+#: Number of samples kept for each timer
+HISTORY_SIZE = 1024
+#: Timer name -> Histogram
+TIMERS = {}
+TIMERS_LOCK = threading.Lock()
+
+
+class Histogram(object):
+    """
+    Keeps the last HISTORY_SIZE samples of a timer, and the total count and
+    time since it was created.
+
+    The samples are added from several threads, so they are only read
+    through a snapshot taken under the lock.
+    """
+    def __init__(self, size=HISTORY_SIZE):
+        self.samples = collections.deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple(list, int, float): the samples, count and total
+        """
+        with self.lock:
+            return list(self.samples), self.count, self.total
+
+    @staticmethod
+    def percentile(samples, percent):
+        return samples[min(
+            int(len(samples) * percent / 100.0),
+            len(samples) - 1,
+        )]
+
+    def to_dict(self):
+        samples, count, total = self.snapshot()
+        samples.sort()
+        if not samples:
+            return {'count': count, 'total': total}
+
+        return {
+            'count': count,
+            'total': total,
+            'window': len(samples),
+            'min': samples[0],
+            'max': samples[-1],
+            'mean': sum(samples) / len(samples),
+            'p50': self.percentile(samples, 50),
+            'p90': self.percentile(samples, 90),
+            'p99': self.percentile(samples, 99),
+        }
+
+
+class Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.time() - self.start)
+
+
+class NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def record(name, seconds):
+    try:
+        histogram = TIMERS[name]
+    except KeyError:
+        with TIMERS_LOCK:
+            histogram = TIMERS.setdefault(name, Histogram())
+
+    histogram.add(seconds)
+
+
+def timed(name):
+    """
+    Context manager that records the time spent inside it under the given
+    timer name, does nothing if the timings are disabled.
+    """
+    if ENABLED:
+        return Timer(name)
+
+    return NULL_TIMER
+
+
+def timed_func(name):
+    """
+    Decorator to record the time spent on each call to the function.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.time() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def get_timings():
+    with TIMERS_LOCK:
+        histograms = TIMERS.items()
+
+    return dict(
+        (name, histogram.to_dict())
+        for name, histogram in histograms
+    )
+
+
+def reset():
+    with TIMERS_LOCK:
+        TIMERS.clear()
+
+
+def setup(config):
+    global ENABLED
+
+    ENABLED = config.getboolean('general', 'timings')
+    LOGGER.info('Timings %s', ENABLED and 'enabled' or 'disabled')
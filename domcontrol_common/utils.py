@@ -14,47 +14,464 @@
 # along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
 #
 import logging
+import os
 import socket
 import hashlib
+import pickle
+import struct
+import threading
+import time
+import Queue
+
+from . import timing
 
 
 LOGGER = logging.getLogger(__name__)
+#: Default prefix for all the metrics sent to graphite
+GRAPHITE_PREFIX = 'lab.rp1'
+
+
+def graphite_datapoints(measure, prefix='', base_prefix=GRAPHITE_PREFIX):
+    """
+    Returns:
+        list(tuple): (path, (timestamp, value)) for each of the metrics of the
+            measure, as carbon expects them
+    """
+    path = '.'.join(part for part in (base_prefix, prefix) if part)
+    return [
+        ('%s.%s' % (path, metric), (timestamp, value))
+        for metric, value, timestamp in measure.to_graphite()
+    ]
+
+
+def format_plaintext(datapoints):
+    return ''.join(
+        '%s %s %s\n' % (path, value, timestamp)
+        for path, (timestamp, value) in datapoints
+    )
+
+
+def parse_plaintext(message):
+    datapoints = []
+    for line in message.splitlines():
+        if not line:
+            continue
+
+        try:
+            path, value, timestamp = line.split()
+            datapoints.append((path, (int(timestamp), float(value))))
+        except ValueError:
+            # a truncated write to the spool, for example
+            LOGGER.warning('Skipping corrupt graphite line %r', line)
+
+    return datapoints
+
+
+def format_pickle(datapoints):
+    payload = pickle.dumps(datapoints, protocol=2)
+    return struct.pack('!L', len(payload)) + payload
+
+
+GRAPHITE_FORMATTERS = {
+    'plaintext': format_plaintext,
+    'pickle': format_pickle,
+}
+GRAPHITE_DEFAULT_PORTS = {
+    'plaintext': 2003,
+    'pickle': 2004,
+}
+
+
+def format_graphite(measure, prefix='', base_prefix=GRAPHITE_PREFIX):
+    return format_plaintext(
+        graphite_datapoints(measure, prefix, base_prefix),
+    )
+
+
+class GraphiteSender(object):
+    """
+    Ships measures to graphite from a background thread, so a slow or down
+    graphite never blocks the caller.
 
+    The measures added since the last flush are queued as a single batch,
+    that the shipper thread formats with the chosen protocol (plaintext or
+    pickle) and sends through a connection that is kept open.
+    If the queue is full, or the batch could not be sent, it is appended to
+    the spool file (if any) instead, as plaintext, and the spool is sent once
+    graphite is back. After a failure, the shipper waits before connecting
+    again, doubling the time on every failure up to MAX_BACKOFF.
+    """
+    MIN_BACKOFF = 1
+    MAX_BACKOFF = 300
+    #: Bytes of the spool to send on each write when draining it
+    SPOOL_CHUNK = 64 * 1024
 
-def format_graphite(measure, prefix=''):
-    stats = []
-    prefix = prefix and '.' + prefix
-    for metric, value, timestamp in measure.to_graphite():
-        stats.append(
-            'lab.rp1%s.%s %s %s'
-            % (prefix, metric, value, timestamp)
+    def __init__(
+        self,
+        graphite_url,
+        timeout=5,
+        queue_size=100,
+        spool_path=None,
+        protocol='plaintext',
+        prefix=GRAPHITE_PREFIX,
+    ):
+        if protocol not in GRAPHITE_FORMATTERS:
+            raise TypeError(
+                'Unknown graphite protocol %s, available: %s'
+                % (protocol, GRAPHITE_FORMATTERS.keys())
+            )
+
+        self.server = graphite_url.split(':', 1)[0]
+        self.port = (
+            ':' in graphite_url
+            and int(graphite_url.split(':', 1)[-1])
+            or GRAPHITE_DEFAULT_PORTS[protocol]
         )
-        LOGGER.info(
-            'lab.rp1%s.%s %s %s'
-            % (prefix, metric, value, timestamp)
+        #: options it was created with, see get_graphite_sender
+        self.options = {
+            'timeout': timeout,
+            'queue_size': queue_size,
+            'spool_path': spool_path,
+            'protocol': protocol,
+            'prefix': prefix,
+        }
+        self.timeout = timeout
+        self.spool_path = spool_path
+        self.format = GRAPHITE_FORMATTERS[protocol]
+        self.prefix = prefix
+        self.sock = None
+        self.datapoints = []
+        self.backoff = self.MIN_BACKOFF
+        self.datapoints_lock = threading.Lock()
+        self.spool_lock = threading.Lock()
+        self.batches = Queue.Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.shipper = threading.Thread(
+            target=self.ship,
+            name='graphite.%s:%s' % (self.server, self.port),
         )
+        self.shipper.daemon = True
+        self.shipper.start()
 
-    return '\n'.join(stats) + '\n'
+    def add(self, measure, prefix=''):
+        datapoints = graphite_datapoints(measure, prefix, self.prefix)
+        with self.datapoints_lock:
+            self.datapoints.extend(datapoints)
 
+    def flush(self):
+        with self.datapoints_lock:
+            batch = self.datapoints
+            self.datapoints = []
 
-def send_to_graphite(measure, graphite_url, prefix=''):
-    server = graphite_url.split(':', 1)[0]
-    port = ':' in graphite_url and int(graphite_url.split(':', 1)[-1]) or 2003
-    message = format_graphite(measure, prefix)
+        if not batch:
+            return
 
-    LOGGER.debug('Sending graphite message:\n%s' % message)
-    sock = socket.socket()
-    try:
-        sock.connect((server, port))
-        sock.sendall(message)
-    except Exception as err:
-        LOGGER.error(
-            'Got exception %s when trying to send to graphite, continuing...'
-            % err
+        try:
+            self.batches.put_nowait(batch)
+        except Queue.Full:
+            LOGGER.warning('Graphite queue full, spooling measures')
+            self.spool(batch)
+
+    def spool(self, batch):
+        if not self.spool_path:
+            LOGGER.error('No graphite spool file configured, dropping measures')
+            return
+
+        try:
+            with self.spool_lock:
+                with open(self.spool_path, 'a') as spool_fd:
+                    spool_fd.write(format_plaintext(batch))
+        except (IOError, OSError) as err:
+            LOGGER.error(
+                'Failed to spool graphite measures to %s, dropping them: %s',
+                self.spool_path,
+                err,
+            )
+
+    def stop(self):
+        """
+        Stops the shipper thread once it has shipped the batches already
+        queued, without waiting for it.
+        """
+        self.stopped.set()
+        try:
+            self.batches.put_nowait(None)
+        except Queue.Full:
+            # it will see it's stopped once the queue is empty
+            pass
+
+    def ship(self):
+        while True:
+            batch = self.batches.get()
+            if batch is not None:
+                try:
+                    self.ship_batch(batch)
+                except Exception as err:
+                    # never let the shipper thread die
+                    LOGGER.exception(
+                        'Unexpected error shipping measures to graphite: %s',
+                        err,
+                    )
+
+            if self.stopped.is_set() and self.batches.empty():
+                self.close()
+                return
+
+    def ship_batch(self, batch):
+        LOGGER.debug('Sending %d datapoints to graphite', len(batch))
+        try:
+            with timing.timed('utils.graphite_send'):
+                self._send(self.format(batch))
+        except (socket.error, socket.timeout, IOError) as err:
+            LOGGER.error(
+                'Got exception %s when trying to send to graphite, '
+                'retrying in %ss...'
+                % (err, self.backoff)
+            )
+            self.spool(batch)
+            self.wait_backoff()
+            return
+
+        self.backoff = self.MIN_BACKOFF
+        # the batch is already sent, a failure here must not spool it again
+        try:
+            self.drain_spool()
+        except (socket.error, socket.timeout, IOError, OSError) as err:
+            LOGGER.error(
+                'Got exception %s when trying to send the spooled measures '
+                'to graphite, retrying in %ss...'
+                % (err, self.backoff)
+            )
+            self.wait_backoff()
+
+    def wait_backoff(self):
+        time.sleep(self.backoff)
+        self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+
+    def drain_spool(self):
+        if not self.spool_path:
+            return
+
+        draining = self.spool_path + '.draining'
+        with self.spool_lock:
+            if not os.path.exists(draining):
+                if (
+                    not os.path.exists(self.spool_path)
+                    or not os.path.getsize(self.spool_path)
+                ):
+                    return
+
+                os.rename(self.spool_path, draining)
+
+        LOGGER.info('Sending spooled graphite measures')
+        with open(draining) as spool_fd:
+            while True:
+                # send only whole lines
+                chunk = spool_fd.read(self.SPOOL_CHUNK)
+                chunk += spool_fd.readline()
+                if not chunk:
+                    break
+
+                try:
+                    self._send(self.format(parse_plaintext(chunk)))
+                except:
+                    # keep what is left for the next time
+                    with open(draining + '.tmp', 'w') as left_fd:
+                        left_fd.write(chunk)
+                        left_fd.write(spool_fd.read())
+
+                    os.rename(draining + '.tmp', draining)
+                    raise
+
+        os.remove(draining)
+
+    def _send(self, message):
+        if self.sock is not None:
+            try:
+                self.sock.sendall(message)
+                return
+            except (socket.error, socket.timeout):
+                # the server might have dropped an idle connection, try
+                # again with a new one
+                self.close()
+
+        self.sock = socket.create_connection(
+            (self.server, self.port),
+            timeout=self.timeout,
         )
+        try:
+            self.sock.sendall(message)
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+#: Graphite url -> sender, to share the connections
+GRAPHITE_SENDERS = {}
+GRAPHITE_SENDERS_LOCK = threading.Lock()
+
+
+def get_graphite_sender(graphite_url, **kwargs):
+    """
+    Returns the sender for the given url, creating it with the given kwargs
+    (see GraphiteSender) if there's none yet.
+
+    If kwargs are passed and any of them differs from the options of the
+    existing sender (the config was reloaded), that one is stopped and
+    replaced with a new one, callers that pass no kwargs always get the
+    existing sender.
+    """
+    with GRAPHITE_SENDERS_LOCK:
+        sender = GRAPHITE_SENDERS.get(graphite_url)
+        if (
+            sender is not None
+            and dict(sender.options, **kwargs) != sender.options
+        ):
+            LOGGER.info(
+                'Graphite options for %s changed, restarting its sender',
+                graphite_url,
+            )
+            sender.stop()
+            sender = None
+
+        if sender is None:
+            sender = GRAPHITE_SENDERS[graphite_url] = GraphiteSender(
+                graphite_url,
+                **kwargs
+            )
+
+        return sender
+
+
+def send_to_graphite(measure, graphite_url, prefix=''):
+    sender = get_graphite_sender(graphite_url)
+    sender.add(measure, prefix)
+    sender.flush()
+
+
+def parallel_map(func, items, max_workers, timeout=None, in_flight=None):
+    """
+    Runs func on each of the items using a bounded pool of worker threads.
+
+    Each call gets its own deadline, counted from the moment a worker starts
+    it, any call that does not finish before it is abandoned (the thread is a
+    daemon so it will not block the exit) and left out of the results, same
+    for the calls that raise.
+
+    The abandoned calls can't be cancelled, so to avoid piling up a stuck
+    thread per call, pass the same in_flight set on every call, the items
+    are kept in it until their call returns, and skipped while they are.
+
+    Args:
+        func (callable): function to run, gets the item as only parameter
+        items (list): items to pass to func, must be hashable
+        max_workers (int): maximum number of threads to use
+        timeout (float): seconds that each call is given before abandoning
+            it, None to wait forever
+        in_flight (set): items with a call still running from a previous
+            parallel_map, only one thread should use the same set
+
+    Returns:
+        dict: item -> result of the calls that finished in time
+    """
+    items = list(items)
+    if in_flight is not None:
+        busy = [item for item in items if item in in_flight]
+        if busy:
+            LOGGER.warning(
+                'Previous %s still running on %s, skipping', func, busy,
+            )
+            items = [item for item in items if item not in in_flight]
+
+        in_flight.update(items)
+
+    results = {}
+    if not items:
+        return results
+
+    pending = Queue.Queue()
+    done = Queue.Queue()
+    started = {}
+    for item in items:
+        pending.put(item)
+
+    def _worker():
+        while True:
+            try:
+                item = pending.get_nowait()
+            except Queue.Empty:
+                return
+
+            started[item] = time.time()
+            try:
+                done.put((item, True, func(item)))
+            except Exception as err:
+                done.put((item, False, err))
+            finally:
+                if in_flight is not None:
+                    in_flight.discard(item)
+
+    workers = min(max_workers, len(items))
+    for _ in range(workers):
+        thread = threading.Thread(target=_worker)
+        thread.daemon = True
+        thread.start()
+
+    remaining = set(items)
+    abandoned = 0
+    while remaining:
+        now = time.time()
+        for item in list(remaining):
+            if (
+                timeout is not None
+                and item in started
+                and now - started[item] >= timeout
+            ):
+                LOGGER.error('Timed out running %s on %s', func, item)
+                remaining.discard(item)
+                abandoned += 1
+
+        if abandoned >= workers and remaining:
+            # all the workers are stuck, nobody will pick up the rest
+            LOGGER.error('No workers left, skipping %s', list(remaining))
+            break
+
+        if not remaining:
+            break
+
+        wait = None
+        deadlines = [
+            started[item] + timeout - now
+            for item in remaining
+            if timeout is not None and item in started
+        ]
+        if deadlines:
+            wait = max(min(deadlines), 0.01)
+        elif timeout is not None:
+            wait = timeout
+
+        try:
+            item, success, result = done.get(timeout=wait)
+        except Queue.Empty:
+            continue
+
+        if item not in remaining:
+            continue
+
+        remaining.discard(item)
+        if success:
+            results[item] = result
+        else:
+            LOGGER.error(
+                'Got exception %s when running %s on %s', result, func, item,
+            )
 
-    finally:
-        sock.close()
+    return results
 
 
 def getfloat(conf, section, option, default=None):
@@ -0,0 +1,310 @@
+# This file is part of domcontrol.
+#
+# domcontrol is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# domcontrol is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with domcontrol.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Compact formats to send measures and zone status between the agent and the
+master.
+
+In the compact formats the measures are not dictionaries, but lists with
+the values in the order given by the 'metrics' key of the document (the
+METRIC_NAMES of the sender), with an extra True at the end if the measure
+is stale. The document has a 'version' key too, so the receiver can
+reject the ones it does not understand.
+
+The document can then be sent as compact json, or as msgpack (only the
+types needed here are supported: None, bools, ints, floats, strings,
+lists and dicts).
+"""
+import json
+import struct
+
+from . import metrics as mod_metrics
+
+
+VERSION = 1
+JSON = 'application/json'
+COMPACT_JSON = 'application/vnd.domcontrol.v%d+json' % VERSION
+MSGPACK = 'application/vnd.domcontrol.v%d+msgpack' % VERSION
+#: Content types that can be served, plain json first as the default
+CONTENT_TYPES = [JSON, COMPACT_JSON, MSGPACK]
+#: Accept header for the clients, preferring the most compact one
+ACCEPT = '%s, %s;q=0.9, %s;q=0.5' % (MSGPACK, COMPACT_JSON, JSON)
+
+
+def pack_measure(measure):
+    """
+    Args:
+        measure(dict): as returned by Measure.to_dict
+    """
+    if measure is None:
+        return None
+
+    values = [measure.get(metric) for metric in mod_metrics.METRIC_NAMES]
+    if measure.get('stale'):
+        values.append(True)
+
+    return values
+
+
+def unpack_measure(data, metrics=None):
+    """
+    Builds a measure from either a dictionary (plain json) or a list of
+    values in the given metrics order (compact formats, METRIC_NAMES by
+    default), the later skips the validation as the values come from
+    another measure.
+    """
+    if data is None:
+        return None
+
+    if isinstance(data, dict):
+        return mod_metrics.Measure(**data)
+
+    metrics = metrics or mod_metrics.METRIC_NAMES
+    stale = len(data) > len(metrics) and bool(data[len(metrics)])
+    if metrics == mod_metrics.METRIC_NAMES:
+        return mod_metrics.Measure.from_values(
+            list(data[:len(metrics)]),
+            stale=stale,
+        )
+
+    values = [None] * len(mod_metrics.METRIC_NAMES)
+    for metric, value in zip(metrics, data):
+        if metric in mod_metrics.METRIC_INDEX:
+            values[mod_metrics.METRIC_INDEX[metric]] = value
+
+    return mod_metrics.Measure.from_values(values, stale=stale)
+
+
+def pack_status(status):
+    """
+    Converts the agent status (config and zone dictionaries) to the compact
+    layout, in place.
+    """
+    for zone in status['zones']:
+        zone['last_measure'] = pack_measure(zone['last_measure'])
+        for sensor in zone['sensors']:
+            sensor['last_measure'] = pack_measure(sensor['last_measure'])
+
+    status['version'] = VERSION
+    status['metrics'] = mod_metrics.METRIC_NAMES
+    return status
+
+
+def pack_measures(measures):
+    """
+    Args:
+        measures(dict): name -> Measure dictionary
+    """
+    return {
+        'version': VERSION,
+        'metrics': mod_metrics.METRIC_NAMES,
+        'measures': dict(
+            (name, pack_measure(measure))
+            for name, measure in measures.items()
+        ),
+    }
+
+
+def check_version(document):
+    version = document.get('version', VERSION)
+    if version != VERSION:
+        raise ValueError(
+            'Unsupported wire format version %s, expected %s'
+            % (version, VERSION)
+        )
+
+
+def encode_msgpack(obj, chunks=None):
+    top = chunks is None
+    if top:
+        chunks = []
+
+    if obj is None:
+        chunks.append('\xc0')
+    elif obj is True:
+        chunks.append('\xc3')
+    elif obj is False:
+        chunks.append('\xc2')
+    elif isinstance(obj, (int, long)):
+        if 0 <= obj < 0x80 or -0x20 <= obj < 0:
+            chunks.append(struct.pack('>b', obj) if obj < 0 else chr(obj))
+        elif 0 <= obj < 2 ** 32:
+            chunks.append(struct.pack('>BI', 0xce, obj))
+        elif -2 ** 31 <= obj < 0:
+            chunks.append(struct.pack('>Bi', 0xd2, obj))
+        elif obj > 0:
+            chunks.append(struct.pack('>BQ', 0xcf, obj))
+        else:
+            chunks.append(struct.pack('>Bq', 0xd3, obj))
+    elif isinstance(obj, float):
+        chunks.append(struct.pack('>Bd', 0xcb, obj))
+    elif isinstance(obj, basestring):
+        if isinstance(obj, unicode):
+            obj = obj.encode('utf-8')
+
+        if len(obj) < 32:
+            chunks.append(chr(0xa0 | len(obj)))
+        elif len(obj) < 2 ** 8:
+            chunks.append(struct.pack('>BB', 0xd9, len(obj)))
+        elif len(obj) < 2 ** 16:
+            chunks.append(struct.pack('>BH', 0xda, len(obj)))
+        else:
+            chunks.append(struct.pack('>BI', 0xdb, len(obj)))
+
+        chunks.append(obj)
+    elif isinstance(obj, (list, tuple)):
+        if len(obj) < 16:
+            chunks.append(chr(0x90 | len(obj)))
+        elif len(obj) < 2 ** 16:
+            chunks.append(struct.pack('>BH', 0xdc, len(obj)))
+        else:
+            chunks.append(struct.pack('>BI', 0xdd, len(obj)))
+
+        for elem in obj:
+            encode_msgpack(elem, chunks)
+    elif isinstance(obj, dict):
+        if len(obj) < 16:
+            chunks.append(chr(0x80 | len(obj)))
+        elif len(obj) < 2 ** 16:
+            chunks.append(struct.pack('>BH', 0xde, len(obj)))
+        else:
+            chunks.append(struct.pack('>BI', 0xdf, len(obj)))
+
+        for key, value in obj.items():
+            encode_msgpack(key, chunks)
+            encode_msgpack(value, chunks)
+    else:
+        raise TypeError('Can\'t encode %r as msgpack' % (obj, ))
+
+    if top:
+        return ''.join(chunks)
+
+
+#: msgpack type byte -> (struct format, kind) for the fixed size headers
+MSGPACK_TYPES = {
+    0xc0: (None, 'nil'),
+    0xc2: (None, 'false'),
+    0xc3: (None, 'true'),
+    0xca: ('>f', 'value'),
+    0xcb: ('>d', 'value'),
+    0xcc: ('>B', 'value'),
+    0xcd: ('>H', 'value'),
+    0xce: ('>I', 'value'),
+    0xcf: ('>Q', 'value'),
+    0xd0: ('>b', 'value'),
+    0xd1: ('>h', 'value'),
+    0xd2: ('>i', 'value'),
+    0xd3: ('>q', 'value'),
+    0xd9: ('>B', 'str'),
+    0xda: ('>H', 'str'),
+    0xdb: ('>I', 'str'),
+    0xdc: ('>H', 'array'),
+    0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'),
+    0xdf: ('>I', 'map'),
+}
+
+
+def _decode_msgpack(data, offset):
+    type_byte = ord(data[offset])
+    offset += 1
+    if type_byte < 0x80:
+        return type_byte, offset
+    elif type_byte >= 0xe0:
+        return type_byte - 0x100, offset
+    elif type_byte < 0x90:
+        kind, size = 'map', type_byte & 0x0f
+    elif type_byte < 0xa0:
+        kind, size = 'array', type_byte & 0x0f
+    elif type_byte < 0xc0:
+        kind, size = 'str', type_byte & 0x1f
+    else:
+        try:
+            fmt, kind = MSGPACK_TYPES[type_byte]
+        except KeyError:
+            raise ValueError('Unsupported msgpack type 0x%x' % type_byte)
+
+        if kind == 'nil':
+            return None, offset
+        elif kind in ('true', 'false'):
+            return kind == 'true', offset
+
+        size = struct.unpack_from(fmt, data, offset)[0]
+        offset += struct.calcsize(fmt)
+        if kind == 'value':
+            return size, offset
+
+    if kind == 'str':
+        return data[offset:offset + size].decode('utf-8'), offset + size
+    elif kind == 'array':
+        elems = []
+        for _ in xrange(size):
+            elem, offset = _decode_msgpack(data, offset)
+            elems.append(elem)
+
+        return elems, offset
+
+    elems = {}
+    for _ in xrange(size):
+        key, offset = _decode_msgpack(data, offset)
+        elems[key], offset = _decode_msgpack(data, offset)
+
+    return elems, offset
+
+
+def decode_msgpack(data):
+    return _decode_msgpack(data, 0)[0]
+
+
+def negotiate(accept_mimetypes):
+    """
+    Args:
+        accept_mimetypes(werkzeug.datastructures.MIMEAccept): accepted
+            types of the request
+
+    Returns:
+        str: the content type to respond with
+    """
+    return accept_mimetypes.best_match(CONTENT_TYPES, default=JSON) or JSON
+
+
+def dumps(document, content_type):
+    """
+    Serializes the already packed document (see pack_status), plain json
+    gets the unpacked document, pretty printed as it always was.
+    """
+    if content_type == MSGPACK:
+        return encode_msgpack(document)
+    elif content_type == COMPACT_JSON:
+        return json.dumps(document, separators=(',', ':'))
+
+    return json.dumps(document, sort_keys=True, indent=4)
+
+
+def loads(data, content_type):
+    """
+    Raises:
+        ValueError: if the document version is not supported
+    """
+    content_type = (content_type or JSON).split(';')[0].strip()
+    if content_type == MSGPACK:
+        document = decode_msgpack(data)
+    else:
+        document = json.loads(data)
+
+    if isinstance(document, dict):
+        check_version(document)
+
+    return document
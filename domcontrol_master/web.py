@@ -29,7 +29,7 @@ from flask import (
 from flask_bootstrap import Bootstrap
 from domcontrol_common import (
     conf,
-    metrics as mod_metrics,
+    wire,
 )
 
 
@@ -51,9 +51,19 @@ class Agent(object):
         self.url = url
         self.name = name
 
-        self.load_json(requests.get(url).json())
+        response = requests.get(url, headers={'Accept': wire.ACCEPT})
+        response.raise_for_status()
+        self.load_json(wire.loads(
+            response.content,
+            response.headers.get('Content-Type'),
+        ))
 
     def load_json(self, agent_data):
+        """
+        Loads the agent status, either plain json or any of the compact
+        formats (see wire).
+        """
+        metrics = agent_data.get('metrics', None)
         self.zones = agent_data['zones']
 
         zone_confs = [
@@ -69,14 +79,15 @@ class Agent(object):
                     'graph_url'
                 )
 
-            if zone['last_measure']:
-                zone['last_measure'] = \
-                    mod_metrics.Measure(**zone['last_measure'])
-
+            zone['last_measure'] = wire.unpack_measure(
+                zone['last_measure'],
+                metrics,
+            )
             for sensor in zone['sensors']:
-                if sensor['last_measure']:
-                    sensor['last_measure'] = \
-                        mod_metrics.Measure(**sensor['last_measure'])
+                sensor['last_measure'] = wire.unpack_measure(
+                    sensor['last_measure'],
+                    metrics,
+                )
 
         self.config = agent_data['config']
 
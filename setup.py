@@ -35,6 +35,11 @@ if os.path.exists('domcontrol_common'):
         description='Domotic sensor and actor control tools, common libs',
         install_requires=get_requires('domcontrol_common'),
         packages=['domcontrol_common'],
+        entry_points={
+            'console_scripts': [
+                'domcontrol_simulate=domcontrol_common.simulation:main',
+            ],
+        },
         **common_opts
     )
 else:
@@ -0,0 +1,146 @@
+import time
+import unittest
+
+from domcontrol_common import aggregation, metrics, schedule
+
+
+def aggregator(policy, **kwargs):
+    return aggregation.AGGREGATORS[policy](**kwargs)
+
+
+class WindowTimeTest(unittest.TestCase):
+    """
+    Every policy drops the samples older than window_time.
+    """
+    def assertExpires(self, policy, in_window):
+        agg = aggregator(policy, window_time=10, alpha=0.5)
+        agg.add(1, 100)
+        agg.add(3, 105)
+
+        self.assertEqual(agg.value(106), in_window)
+        self.assertIsNone(agg.value(116))
+
+    def test_mean(self):
+        self.assertExpires('mean', 2.0)
+
+    def test_max(self):
+        self.assertExpires('max', 3)
+
+    def test_last(self):
+        self.assertExpires('last', 3)
+
+    def test_ewma(self):
+        self.assertExpires('ewma', 2.0)
+
+    def test_mean_drops_only_the_old_samples(self):
+        agg = aggregator('mean', window_time=10)
+        agg.add(1, 100)
+        agg.add(3, 105)
+
+        self.assertEqual(agg.value(114), 3.0)
+
+    def test_max_drops_only_the_old_samples(self):
+        agg = aggregator('max', window_time=10)
+        agg.add(5, 100)
+        agg.add(3, 105)
+
+        self.assertEqual(agg.value(106), 5)
+        self.assertEqual(agg.value(114), 3)
+
+    def test_last_keeps_the_newest(self):
+        agg = aggregator('last', window_time=10)
+        agg.add(3, 105)
+        agg.add(1, 100)
+
+        self.assertEqual(agg.value(106), 3)
+
+    def test_ewma_starts_over_after_a_gap(self):
+        agg = aggregator('ewma', window_time=10, alpha=0.5)
+        agg.add(1, 100)
+        agg.add(9, 120)
+
+        self.assertEqual(agg.value(121), 9.0)
+
+    def test_no_window(self):
+        for policy in aggregation.AGGREGATORS:
+            agg = aggregator(policy, alpha=0.5)
+            agg.add(1, 100)
+
+            self.assertEqual(agg.value(10 ** 9), 1, policy)
+
+
+class WindowSizeTest(unittest.TestCase):
+    def test_mean(self):
+        agg = aggregator('mean', window_size=2)
+        for timestamp, value in enumerate([10, 1, 3]):
+            agg.add(value, timestamp)
+
+        self.assertEqual(agg.value(3), 2.0)
+
+    def test_max(self):
+        agg = aggregator('max', window_size=2)
+        for timestamp, value in enumerate([10, 1, 3]):
+            agg.add(value, timestamp)
+
+        self.assertEqual(agg.value(3), 3)
+
+
+class MeasureAggregatorTest(unittest.TestCase):
+    def test_expired_metrics_are_missing(self):
+        now = int(time.time())
+        agg = aggregation.MeasureAggregator(
+            window_time=60,
+            policies={'humidity': 'last'},
+        )
+        agg.add(metrics.Measure(timestamp=now - 600, humidity=90))
+        agg.add(metrics.Measure(timestamp=now, temperature=20))
+
+        measure = agg.current()
+
+        self.assertEqual(measure.get('temperature'), 20)
+        self.assertIsNone(measure.get('humidity'))
+        self.assertEqual(agg.added, 2)
+
+    def test_all_expired(self):
+        agg = aggregation.MeasureAggregator(window_time=60)
+        agg.add(metrics.Measure(
+            timestamp=int(time.time()) - 600,
+            temperature=20,
+        ))
+
+        self.assertIsNone(agg.current())
+
+    def test_unknown_policy(self):
+        self.assertRaises(
+            TypeError,
+            aggregation.MeasureAggregator,
+            policies={'humidity': 'median'},
+        )
+
+    def test_should_trigger_skips_expired_metrics(self):
+        now = int(time.time())
+        agg = aggregation.MeasureAggregator(
+            window_time=60,
+            policies={'humidity': 'last'},
+        )
+        agg.add(metrics.Measure(timestamp=now - 600, humidity=90))
+        agg.add(metrics.Measure(timestamp=now, temperature=20))
+        always = schedule.WeekSchedule(
+            name='always',
+            **dict(
+                (day, schedule.DaySchedule.from_str('00:00-24:00'))
+                for day in schedule.WEEKDAYS
+            )
+        )
+
+        self.assertIsNone(always.should_trigger(
+            measure=agg.current(),
+            metrics=['humidity'],
+            action='lower',
+            active_limit=50,
+            inactive_limit=50,
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+import math
+import shutil
+import struct
+import tempfile
+import unittest
+
+from domcontrol_common import compression
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def float32(value):
+    return struct.unpack('<f', struct.pack('<f', value))[0]
+
+
+def timestamps_from_dods(dods, start=1700000000, delta=10):
+    timestamps = [start, start + delta]
+    for dod in dods:
+        delta += dod
+        timestamps.append(timestamps[-1] + delta)
+
+    return timestamps
+
+
+class TimestampsTest(unittest.TestCase):
+    def assertRoundTrip(self, timestamps):
+        data = compression.encode_timestamps(timestamps)
+        self.assertEqual(
+            list(compression.decode_timestamps(data, len(timestamps))),
+            timestamps,
+        )
+
+    def test_empty(self):
+        self.assertRoundTrip([])
+
+    def test_single(self):
+        self.assertRoundTrip([1700000000])
+
+    def test_fixed_cadence(self):
+        timestamps = range(1700000000, 1700010000, 10)
+        self.assertRoundTrip(timestamps)
+        # one bit per sample after the first two
+        self.assertLess(
+            len(compression.encode_timestamps(timestamps)),
+            len(timestamps) // 8 + 20,
+        )
+
+    def test_bucket_edges(self):
+        for _, _, bits in compression.DOD_BUCKETS[:-1]:
+            lowest = -(1 << (bits - 1))
+            highest = (1 << (bits - 1)) - 1
+            for dod in (lowest - 1, lowest, lowest + 1, highest - 1, highest,
+                        highest + 1):
+                # back to the same delta after it, so it stays increasing
+                timestamps = timestamps_from_dods(
+                    [dod, -dod, 0], delta=5000,
+                )
+                self.assertRoundTrip(timestamps)
+
+    def test_sealed_segment_deltas(self):
+        # dod of exactly 64, it was decoded as -64
+        self.assertRoundTrip([
+            1700000000,
+            1700000010,
+            1700000020,
+            1700000094,
+            1700000104,
+        ])
+
+    def test_big_jumps(self):
+        self.assertRoundTrip([0, 1700000000, 1700000001, 4000000000, 5])
+
+
+class ValuesTest(unittest.TestCase):
+    def assertRoundTrip(self, values):
+        data = compression.encode_values(values)
+        decoded = list(compression.decode_values(data, len(values)))
+        self.assertEqual(len(decoded), len(values))
+        for value, result in zip(values, decoded):
+            if math.isnan(value):
+                self.assertTrue(math.isnan(result))
+            else:
+                self.assertEqual(result, float32(value))
+
+    def test_empty(self):
+        self.assertRoundTrip([])
+
+    def test_single(self):
+        self.assertRoundTrip([21.5])
+
+    def test_constant(self):
+        values = [21.5] * 1000
+        self.assertRoundTrip(values)
+        self.assertLess(len(compression.encode_values(values)), 4 + 130)
+
+    def test_slow_changes(self):
+        self.assertRoundTrip([20 + index * 0.1 for index in range(500)])
+
+    def test_missing_values(self):
+        nan = float('nan')
+        self.assertRoundTrip([nan, 21.5, nan, nan, 22.0, 0.0, nan])
+
+    def test_xor_windows(self):
+        # changes in all the bits, the lowest ones only, and the sign
+        self.assertRoundTrip([
+            0.0, -0.0, 1.0, 1.0000001, -1e38, 1e38, 1e-38, 3.0, 3.0,
+            float('inf'), -float('inf'), 1.0, 2.0, 4.0, 1.5,
+        ])
+
+
+class SealedStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_query_sealed_segment(self):
+        from domcontrol_common import metrics, store
+
+        timestamps = [
+            1700000000,
+            1700000010,
+            1700000020,
+            1700000094,
+            1700000104,
+            1700000114,
+        ]
+        zone_store = store.Store(self.path, segment_size=5)
+        for index, timestamp in enumerate(timestamps):
+            zone_store.append(
+                metrics.Measure(timestamp=timestamp, temperature=20 + index)
+            )
+
+        sealed = store.CompressedSegment.seal(zone_store.segments[0])
+        zone_store.segments[0] = sealed
+
+        self.assertEqual(
+            [record[0] for record in sealed.records()],
+            timestamps[:5],
+        )
+        self.assertEqual(
+            [
+                (record['timestamp'], record['temperature'])
+                for record in zone_store.query(
+                    start=1700000090,
+                    end=1700000120,
+                )
+            ],
+            [(1700000094, 23.0), (1700000104, 24.0), (1700000114, 25.0)],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+
+from domcontrol_common import filters
+
+
+def apply_all(pipeline, values, step=60):
+    return [
+        pipeline.apply(value, index * step)
+        for index, value in enumerate(values)
+    ]
+
+
+class FromSpecTest(unittest.TestCase):
+    def test_filters_and_args(self):
+        pipeline = filters.FilterPipeline.from_spec(
+            'hampel:7:2, median:5,rate:0.5',
+        )
+
+        hampel, median, rate = pipeline.filters
+        self.assertIsInstance(hampel, filters.HampelFilter)
+        self.assertEqual(hampel.window.maxlen, 7)
+        self.assertEqual(hampel.threshold, 2.0)
+        self.assertIsInstance(median, filters.MedianFilter)
+        self.assertEqual(median.window.maxlen, 5)
+        self.assertIsInstance(rate, filters.RateFilter)
+        self.assertEqual(rate.max_rate, 0.5)
+
+    def test_defaults(self):
+        hampel, median, rate = filters.FilterPipeline.from_spec(
+            'hampel,median,rate',
+        ).filters
+
+        self.assertEqual(hampel.window.maxlen, 5)
+        self.assertEqual(hampel.threshold, 3.0)
+        self.assertEqual(median.window.maxlen, 3)
+        self.assertEqual(rate.max_rate, 1.0)
+
+    def test_empty(self):
+        pipeline = filters.FilterPipeline.from_spec('')
+
+        self.assertEqual(pipeline.filters, [])
+        self.assertEqual(pipeline.apply(21.5, 0), 21.5)
+
+    def test_unknown_filter(self):
+        self.assertRaises(
+            TypeError,
+            filters.FilterPipeline.from_spec,
+            'median:3,kalman',
+        )
+
+    def test_applied_in_order(self):
+        pipeline = filters.FilterPipeline.from_spec('median:3,rate:1')
+
+        # the medians are 20, 20, 20, 30, 30, then limited to 1 a minute
+        self.assertEqual(
+            apply_all(pipeline, [20, 20, 30, 30, 30]),
+            [20, 20, 20, 21, 22],
+        )
+
+
+class MedianFilterTest(unittest.TestCase):
+    def test_spike_is_removed(self):
+        pipeline = filters.FilterPipeline.from_spec('median:3')
+
+        self.assertEqual(
+            apply_all(pipeline, [20, 20, 80, 21, 22]),
+            [20, 20, 20, 21, 22],
+        )
+
+    def test_even_window(self):
+        pipeline = filters.FilterPipeline.from_spec('median:2')
+
+        self.assertEqual(apply_all(pipeline, [20, 21]), [20, 20.5])
+
+
+class HampelFilterTest(unittest.TestCase):
+    def test_outlier_is_replaced_with_the_median(self):
+        pipeline = filters.FilterPipeline.from_spec('hampel:5:3')
+
+        self.assertEqual(
+            apply_all(pipeline, [20, 20.5, 21, 60, 21.5]),
+            [20, 20.5, 21, 20.75, 21.5],
+        )
+
+    def test_needs_a_few_reads(self):
+        pipeline = filters.FilterPipeline.from_spec('hampel:5:3')
+
+        self.assertEqual(apply_all(pipeline, [20, 60]), [20, 60])
+
+    def test_steady_change_is_kept(self):
+        pipeline = filters.FilterPipeline.from_spec('hampel:5:3')
+        values = [20, 20, 20, 20.5, 21, 21.5, 22]
+
+        self.assertEqual(apply_all(pipeline, values), values)
+
+
+class RateFilterTest(unittest.TestCase):
+    def test_limits_the_change_per_minute(self):
+        pipeline = filters.FilterPipeline.from_spec('rate:2')
+
+        self.assertEqual(
+            apply_all(pipeline, [20, 30, 10], step=30),
+            [20, 21, 20],
+        )
+
+    def test_small_changes_pass(self):
+        pipeline = filters.FilterPipeline.from_spec('rate:2')
+
+        self.assertEqual(
+            apply_all(pipeline, [20, 21, 20.5], step=60),
+            [20, 21, 20.5],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+import os
+import pickle
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+
+from domcontrol_common import utils
+
+
+class FakeSocket(object):
+    """
+    Stand-in for the carbon connection, keeps what is sent to it.
+    """
+    def __init__(self, address, fail=False):
+        self.address = address
+        self.fail = fail
+        self.sent = []
+        self.closed = False
+
+    def sendall(self, message):
+        if self.fail:
+            raise socket.error('Connection reset by peer')
+
+        self.sent.append(message)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeMeasure(object):
+    def __init__(self, datapoints):
+        self.datapoints = datapoints
+
+    def to_graphite(self):
+        return self.datapoints
+
+
+def unpack_pickle_frames(data):
+    frames = []
+    while data:
+        size = struct.unpack('!L', data[:4])[0]
+        frames.append(pickle.loads(data[4:4 + size]))
+        data = data[4 + size:]
+
+    return frames
+
+
+class GraphiteSenderTest(unittest.TestCase):
+    def setUp(self):
+        self.sockets = []
+        self.fail = False
+        self.create_connection = socket.create_connection
+        socket.create_connection = self.fake_connection
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool_path = os.path.join(self.tmpdir, 'graphite.spool')
+        self.senders = []
+
+    def tearDown(self):
+        socket.create_connection = self.create_connection
+        for sender in self.senders:
+            sender.stop()
+
+        shutil.rmtree(self.tmpdir)
+        utils.GRAPHITE_SENDERS.clear()
+
+    def fake_connection(self, address, timeout=None):
+        sock = FakeSocket(address, fail=self.fail)
+        self.sockets.append(sock)
+        return sock
+
+    def new_sender(self, url='carbon', **kwargs):
+        sender = utils.GraphiteSender(url, **kwargs)
+        self.senders.append(sender)
+        return sender
+
+    def sent(self):
+        return ''.join(
+            message for sock in self.sockets for message in sock.sent
+        )
+
+    def test_default_protocol_is_plaintext(self):
+        sender = self.new_sender()
+        self.assertEqual(sender.port, 2003)
+
+        sender.ship_batch([('lab.rp1.temperature', (100, 21.5))])
+
+        self.assertEqual(self.sockets[0].address, ('carbon', 2003))
+        self.assertEqual(self.sent(), 'lab.rp1.temperature 21.5 100\n')
+
+    def test_pickle_framing(self):
+        sender = self.new_sender(protocol='pickle', prefix='home')
+        self.assertEqual(sender.port, 2004)
+        measure = FakeMeasure([
+            ('temperature', 21.5, 100),
+            ('humidity', 40.0, 100),
+        ])
+
+        sender.add(measure, prefix='kitchen')
+        sender.ship_batch(sender.datapoints)
+
+        self.assertEqual(self.sockets[0].address, ('carbon', 2004))
+        self.assertEqual(
+            unpack_pickle_frames(self.sent()),
+            [[
+                ('home.kitchen.temperature', (100, 21.5)),
+                ('home.kitchen.humidity', (100, 40.0)),
+            ]],
+        )
+
+    def test_explicit_port(self):
+        sender = self.new_sender(url='carbon:12004', protocol='pickle')
+        self.assertEqual(sender.port, 12004)
+
+    def test_unknown_protocol(self):
+        self.assertRaises(
+            TypeError,
+            utils.GraphiteSender,
+            'carbon',
+            protocol='protobuf',
+        )
+
+    def test_failed_send_is_spooled_as_plaintext(self):
+        sender = self.new_sender(protocol='pickle', spool_path=self.spool_path)
+        sender.wait_backoff = lambda: None
+        batch = [('lab.rp1.temperature', (100, 21.5))]
+
+        self.fail = True
+        sender.ship_batch(batch)
+
+        with open(self.spool_path) as spool_fd:
+            self.assertEqual(spool_fd.read(), utils.format_plaintext(batch))
+
+        self.fail = False
+        sender.ship_batch([('lab.rp1.temperature', (110, 22.0))])
+
+        self.assertFalse(os.path.exists(self.spool_path))
+        self.assertEqual(
+            unpack_pickle_frames(self.sent()),
+            [
+                [('lab.rp1.temperature', (110, 22.0))],
+                [('lab.rp1.temperature', (100, 21.5))],
+            ],
+        )
+
+    def test_corrupt_spool_lines_are_skipped(self):
+        with open(self.spool_path, 'w') as spool_fd:
+            spool_fd.write('lab.rp1.temperature 21.5 100\nlab.rp1.hum')
+
+        sender = self.new_sender(spool_path=self.spool_path)
+        sender.ship_batch([('lab.rp1.temperature', (110, 22.0))])
+
+        self.assertEqual(
+            self.sent(),
+            'lab.rp1.temperature 22.0 110\nlab.rp1.temperature 21.5 100\n',
+        )
+
+    def test_spool_errors_are_not_raised(self):
+        sender = self.new_sender(
+            spool_path=os.path.join(self.tmpdir, 'missing', 'spool'),
+        )
+        sender.spool([('lab.rp1.temperature', (100, 21.5))])
+
+
+class GetGraphiteSenderTest(unittest.TestCase):
+    def tearDown(self):
+        for sender in utils.GRAPHITE_SENDERS.values():
+            sender.stop()
+
+        utils.GRAPHITE_SENDERS.clear()
+
+    def test_shared_sender(self):
+        sender = utils.get_graphite_sender('carbon', protocol='pickle')
+        self.assertIs(utils.get_graphite_sender('carbon'), sender)
+        self.assertIs(
+            utils.get_graphite_sender('carbon', protocol='pickle'),
+            sender,
+        )
+
+    def test_changed_options_replace_sender(self):
+        sender = utils.get_graphite_sender('carbon', prefix='old')
+        new_sender = utils.get_graphite_sender('carbon', prefix='new')
+
+        self.assertIsNot(new_sender, sender)
+        self.assertEqual(new_sender.prefix, 'new')
+        self.assertIs(utils.get_graphite_sender('carbon'), new_sender)
+        sender.shipper.join(5)
+        self.assertFalse(sender.shipper.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
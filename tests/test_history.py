@@ -0,0 +1,158 @@
+import unittest
+
+from domcontrol_common import history, metrics
+
+
+class RingBufferTest(unittest.TestCase):
+    def test_wraps_around(self):
+        buf = history.RingBuffer(3)
+        for timestamp in range(5):
+            buf.append(timestamp, timestamp * 1.5)
+
+        self.assertEqual(len(buf), 3)
+        self.assertEqual(buf.range(), [(2, 3.0), (3, 4.5), (4, 6.0)])
+        self.assertEqual(buf.range(3), [(3, 4.5), (4, 6.0)])
+        self.assertEqual(buf.range(end=2), [(2, 3.0)])
+
+    def test_columns_match_range(self):
+        buf = history.RingBuffer(4)
+        for timestamp in range(6):
+            buf.append(timestamp, timestamp)
+
+        for start, end in [(None, None), (3, None), (None, 4), (2, 5)]:
+            timestamps, values = buf.columns(start, end)
+            self.assertEqual(
+                zip(timestamps, values),
+                buf.range(start, end),
+                (start, end),
+            )
+
+    def test_older_timestamps_keep_the_order(self):
+        buf = history.RingBuffer(3)
+        buf.append(10, 1)
+        buf.append(5, 2)
+
+        self.assertEqual(buf.range(), [(10, 1.0), (10, 2.0)])
+
+    def test_query_step(self):
+        buf = history.RingBuffer(10)
+        for timestamp, value in [(0, 1), (5, 3), (10, 5), (25, 7)]:
+            buf.append(timestamp, value)
+
+        self.assertEqual(
+            buf.query(step=10),
+            [(0, 2.0), (10, 5.0), (20, 7.0)],
+        )
+
+
+class RollupBufferTest(unittest.TestCase):
+    def test_buckets(self):
+        buf = history.RollupBuffer(resolution=60, capacity=10)
+        for timestamp, value in [(0, 1), (30, 3), (60, 5), (130, 7), (150, 9)]:
+            buf.add(timestamp, value)
+
+        self.assertEqual(
+            buf.stats(),
+            [
+                (0, 1.0, 3.0, 2.0, 2),
+                (60, 5.0, 5.0, 5.0, 1),
+                # the current one, not stored yet
+                (120, 7.0, 9.0, 8.0, 2),
+            ],
+        )
+        self.assertEqual(len(buf), 2)
+        self.assertEqual(buf.stats(start=60, end=60), [(60, 5.0, 5.0, 5.0, 1)])
+
+    def test_capacity(self):
+        buf = history.RollupBuffer(resolution=10, capacity=2)
+        for timestamp in range(0, 50, 10):
+            buf.add(timestamp, timestamp)
+
+        self.assertEqual(
+            [bucket[0] for bucket in buf.stats()],
+            [20, 30, 40],
+        )
+
+
+class MergeStatsTest(unittest.TestCase):
+    def test_merge(self):
+        self.assertEqual(
+            history.merge_stats(
+                [
+                    (0, 1.0, 3.0, 2.0, 2),
+                    (60, 5.0, 5.0, 5.0, 1),
+                    (120, 7.0, 9.0, 8.0, 2),
+                ],
+                120,
+            ),
+            [(0, 1.0, 5.0, 3.0, 3), (120, 7.0, 9.0, 8.0, 2)],
+        )
+
+
+class MeasureHistoryTest(unittest.TestCase):
+    def history(self, rollups):
+        measure_history = history.MeasureHistory(100, rollups=rollups)
+        for index in range(60):
+            measure_history.add(metrics.Measure(
+                timestamp=1000 * 3600 + index * 30,
+                temperature=index % 10,
+            ))
+
+        return measure_history
+
+    def test_same_measure_is_added_once(self):
+        measure_history = history.MeasureHistory(10)
+        measure = metrics.Measure(timestamp=1000, temperature=20)
+        measure_history.add(measure)
+        measure_history.add(measure)
+
+        self.assertEqual(
+            measure_history.query('temperature'),
+            [(1000, 20.0)],
+        )
+
+    def test_unknown_metric(self):
+        self.assertRaises(KeyError, self.history(True).query, 'humidity')
+        self.assertRaises(KeyError, self.history(True).stats, 'humidity')
+
+    def assertBucketsAlmostEqual(self, buckets, expected):
+        self.assertEqual(len(buckets), len(expected))
+        for bucket, expected_bucket in zip(buckets, expected):
+            self.assertEqual(len(bucket), len(expected_bucket))
+            for value, expected_value in zip(bucket, expected_bucket):
+                self.assertAlmostEqual(value, expected_value)
+
+    def test_rollups_match_the_raw_samples(self):
+        raw = self.history(rollups=False)
+        rolled = self.history(rollups=True)
+
+        for step in (60, 600, 3600):
+            self.assertBucketsAlmostEqual(
+                rolled.query('temperature', step=step),
+                raw.query('temperature', step=step),
+            )
+            self.assertBucketsAlmostEqual(
+                rolled.stats('temperature', step=step),
+                raw.stats('temperature', step=step),
+            )
+
+    def test_rollups_outlive_the_raw_samples(self):
+        measure_history = history.MeasureHistory(10, rollups=True)
+        for index in range(120):
+            measure_history.add(metrics.Measure(
+                timestamp=1000 * 3600 + index * 60,
+                temperature=20,
+            ))
+
+        self.assertEqual(len(measure_history.query('temperature')), 10)
+        self.assertEqual(
+            measure_history.stats('temperature', step=3600),
+            [
+                (1000 * 3600, 20.0, 20.0, 20.0, 60),
+                (1001 * 3600, 20.0, 20.0, 20.0, 60),
+            ],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
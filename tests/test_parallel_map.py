@@ -0,0 +1,86 @@
+import threading
+import time
+import unittest
+
+from domcontrol_common import utils
+
+
+class ParallelMapTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        # let the abandoned calls finish
+        self.release.set()
+
+    def test_results(self):
+        self.assertEqual(
+            utils.parallel_map(lambda item: item * 2, [1, 2, 3], 2),
+            {1: 2, 2: 4, 3: 6},
+        )
+
+    def test_runs_concurrently(self):
+        started = time.time()
+        utils.parallel_map(lambda item: time.sleep(0.2), range(4), 4)
+        self.assertLess(time.time() - started, 0.6)
+
+    def test_failed_calls_are_left_out(self):
+        def func(item):
+            if item == 2:
+                raise ValueError('bad item')
+
+            return item
+
+        self.assertEqual(utils.parallel_map(func, [1, 2, 3], 3), {1: 1, 3: 3})
+
+    def test_timeout_abandons_the_call(self):
+        def func(item):
+            if item == 'stuck':
+                self.release.wait(5)
+
+            return item
+
+        started = time.time()
+        results = utils.parallel_map(func, ['ok', 'stuck'], 2, timeout=0.1)
+
+        self.assertEqual(results, {'ok': 'ok'})
+        self.assertLess(time.time() - started, 1)
+
+    def test_in_flight_items_are_skipped(self):
+        in_flight = set()
+
+        def func(item):
+            if item == 'stuck':
+                self.release.wait(5)
+
+            return item
+
+        utils.parallel_map(
+            func,
+            ['ok', 'stuck'],
+            2,
+            timeout=0.1,
+            in_flight=in_flight,
+        )
+        self.assertEqual(in_flight, set(['stuck']))
+
+        calls = []
+        results = utils.parallel_map(
+            lambda item: calls.append(item) or item,
+            ['ok', 'stuck'],
+            2,
+            in_flight=in_flight,
+        )
+        self.assertEqual(results, {'ok': 'ok'})
+        self.assertEqual(calls, ['ok'])
+
+        self.release.set()
+        deadline = time.time() + 5
+        while in_flight and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(in_flight, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,294 @@
+import datetime
+import time
+import unittest
+
+from domcontrol_common import schedule
+
+# a monday
+MONDAY = datetime.datetime(2024, 1, 1)
+
+
+def at(day, hour, minute=0):
+    return MONDAY + datetime.timedelta(days=day, hours=hour, minutes=minute)
+
+
+def week_schedule(**days):
+    return schedule.WeekSchedule(
+        name='test',
+        **dict(
+            (day, schedule.DaySchedule.from_str(sched_str))
+            for day, sched_str in days.items()
+        )
+    )
+
+
+class BitmapTest(unittest.TestCase):
+    def assertMatchesDays(self, week_sched):
+        for day_index, day in enumerate(schedule.WEEKDAYS):
+            day_sched = getattr(week_sched, day)
+            for minute in xrange(schedule.DAY_MINUTES):
+                self.assertEqual(
+                    bool(week_sched.bitmap[
+                        day_index * schedule.DAY_MINUTES + minute
+                    ]),
+                    minute in day_sched,
+                    '%s %s' % (day, schedule.DayRange.int_to_str(minute)),
+                )
+
+    def test_empty(self):
+        week_sched = week_schedule()
+        self.assertMatchesDays(week_sched)
+        self.assertEqual(week_sched.transitions, [])
+        self.assertFalse(week_sched.is_active(at(0, 12)))
+        self.assertIsNone(week_sched.next_transition(at(0, 12)))
+
+    def test_always(self):
+        week_sched = week_schedule(**dict(
+            (day, '00:00-24:00') for day in schedule.WEEKDAYS
+        ))
+        self.assertMatchesDays(week_sched)
+        self.assertEqual(week_sched.transitions, [])
+        self.assertTrue(week_sched.is_active(at(6, 23, 59)))
+        self.assertIsNone(week_sched.next_transition(at(3, 3)))
+
+    def test_range_edges(self):
+        week_sched = week_schedule(monday='08:00-13:00')
+        self.assertMatchesDays(week_sched)
+        self.assertEqual(week_sched.transitions, [8 * 60, 13 * 60])
+        self.assertFalse(week_sched.is_active(at(0, 7, 59)))
+        self.assertTrue(week_sched.is_active(at(0, 8)))
+        self.assertTrue(week_sched.is_active(at(0, 12, 59)))
+        self.assertFalse(week_sched.is_active(at(0, 13)))
+
+    def test_several_days(self):
+        week_sched = week_schedule(
+            monday='06:30-08:00, 18:00-23:15',
+            wednesday='00:00-01:00, 12:00-24:00',
+            thursday='00:00-02:00',
+            sunday='21:00-24:00',
+        )
+        self.assertMatchesDays(week_sched)
+        self.assertEqual(
+            week_sched.transitions,
+            [
+                # sunday ends active
+                0,
+                6 * 60 + 30,
+                8 * 60,
+                18 * 60,
+                23 * 60 + 15,
+                2 * schedule.DAY_MINUTES,
+                2 * schedule.DAY_MINUTES + 60,
+                2 * schedule.DAY_MINUTES + 12 * 60,
+                3 * schedule.DAY_MINUTES + 2 * 60,
+                6 * schedule.DAY_MINUTES + 21 * 60,
+            ],
+        )
+
+    def test_next_transition(self):
+        week_sched = week_schedule(monday='08:00-13:00')
+        self.assertEqual(week_sched.next_transition(at(0, 7, 30)), at(0, 8))
+        self.assertEqual(week_sched.next_transition(at(0, 8)), at(0, 13))
+        self.assertEqual(
+            week_sched.next_transition(at(0, 12, 59).replace(second=30)),
+            at(0, 13),
+        )
+        # wraps around the end of the week
+        self.assertEqual(week_sched.next_transition(at(0, 13)), at(7, 8))
+        self.assertEqual(week_sched.next_transition(at(4, 0)), at(7, 8))
+
+    def test_wrap_around_week(self):
+        week_sched = week_schedule(sunday='22:00-24:00', monday='00:00-06:00')
+        self.assertNotIn(0, week_sched.transitions)
+        self.assertTrue(week_sched.is_active(at(6, 23, 59)))
+        self.assertTrue(week_sched.is_active(at(0, 0)))
+        self.assertEqual(week_sched.next_transition(at(6, 23)), at(7, 6))
+        self.assertEqual(week_sched.next_transition(at(0, 6)), at(6, 22))
+
+    def test_timestamps(self):
+        week_sched = week_schedule(tuesday='10:00-10:30')
+        start = time.mktime(at(1, 9, 59).timetuple())
+        self.assertFalse(week_sched.is_active(start))
+        self.assertTrue(week_sched.is_active(start + 60))
+        self.assertTrue(week_sched.is_active(start + 30 * 60 + 59))
+        self.assertFalse(week_sched.is_active(start + 31 * 60))
+        self.assertEqual(week_sched.next_transition(start + 15), start + 60)
+        self.assertEqual(
+            week_sched.next_transition(start + 60),
+            start + 31 * 60,
+        )
+
+    def test_recompile(self):
+        week_sched = week_schedule()
+        week_sched.friday.add_range(schedule.DayRange('20:00', '21:00'))
+        self.assertFalse(week_sched.is_active(at(4, 20, 30)))
+
+        week_sched.compile()
+        self.assertMatchesDays(week_sched)
+        self.assertTrue(week_sched.is_active(at(4, 20, 30)))
+
+
+def minutes(day_sched):
+    return set(
+        minute
+        for day_range in day_sched
+        for minute in xrange(day_range.start, day_range.end)
+    )
+
+
+#: pairs of DaySchedule strings, with touching, overlapping, containing,
+#: identical and empty ranges
+SET_CASES = [
+    ('08:00-13:00', '13:00-15:00'),
+    ('08:00-13:00', '12:00-15:00'),
+    ('08:00-13:00', '09:00-10:00'),
+    ('08:00-13:00', '08:00-13:00'),
+    ('08:00-13:00', ''),
+    ('', ''),
+    ('00:00-24:00', '06:00-07:00, 23:00-24:00'),
+    ('01:00-02:00, 03:00-04:00, 05:00-06:00', '01:30-05:30'),
+    ('01:00-02:00, 02:00-03:00', '00:00-01:00, 03:00-04:00'),
+    ('10:00-11:00, 12:00-13:00', '10:30-12:30, 12:45-14:00'),
+]
+
+
+class DayScheduleTest(unittest.TestCase):
+    def assertNormalized(self, day_sched):
+        for day_range in day_sched:
+            self.assertLess(day_range.start, day_range.end)
+
+        for prev_range, day_range in zip(day_sched, day_sched[1:]):
+            # sorted, and touching ranges merged
+            self.assertLess(prev_range.end, day_range.start)
+
+        self.assertEqual(
+            day_sched.starts,
+            [day_range.start for day_range in day_sched],
+        )
+
+    def test_normalized(self):
+        day_sched = schedule.DaySchedule.from_str(
+            '10:00-12:00, 08:00-10:00, 11:00-13:00, 15:00-15:00, '
+            '16:00-17:00'
+        )
+        self.assertNormalized(day_sched)
+        self.assertEqual(
+            day_sched,
+            [
+                schedule.DayRange('08:00', '13:00'),
+                schedule.DayRange('16:00', '17:00'),
+            ],
+        )
+
+    def test_add_range(self):
+        day_sched = schedule.DaySchedule.from_str('08:00-09:00, 10:00-11:00')
+        day_sched.add_range(schedule.DayRange('09:00', '10:00'))
+        self.assertEqual(day_sched, [schedule.DayRange('08:00', '11:00')])
+        self.assertNormalized(day_sched)
+
+    def test_contains(self):
+        day_sched = schedule.DaySchedule.from_str('08:00-13:00, 20:00-24:00')
+        self.assertIn('08:00', day_sched)
+        self.assertIn('12:59', day_sched)
+        self.assertNotIn('13:00', day_sched)
+        self.assertNotIn('07:59', day_sched)
+        self.assertIn('23:59', day_sched)
+        self.assertIn(schedule.DayRange('09:00', '10:00'), day_sched)
+        self.assertNotIn(schedule.DayRange('12:00', '14:00'), day_sched)
+
+    def test_set_operations(self):
+        for first_str, second_str in SET_CASES:
+            for first_str, second_str in (
+                (first_str, second_str),
+                (second_str, first_str),
+            ):
+                first = schedule.DaySchedule.from_str(first_str)
+                second = schedule.DaySchedule.from_str(second_str)
+                for result, expected in (
+                    (first | second, minutes(first) | minutes(second)),
+                    (first & second, minutes(first) & minutes(second)),
+                    (first - second, minutes(first) - minutes(second)),
+                ):
+                    self.assertIsInstance(result, schedule.DaySchedule)
+                    self.assertNormalized(result)
+                    self.assertEqual(
+                        minutes(result),
+                        expected,
+                        '%r, %r: %r' % (first_str, second_str, result),
+                    )
+
+                self.assertEqual(first.union(second), first | second)
+                self.assertEqual(first.intersection(second), first & second)
+                self.assertEqual(first.difference(second), first - second)
+
+    def test_operands_unchanged(self):
+        first = schedule.DaySchedule.from_str('08:00-13:00')
+        second = schedule.DaySchedule.from_str('09:00-10:00')
+        first | second
+        first & second
+        first - second
+        self.assertEqual(first, [schedule.DayRange('08:00', '13:00')])
+        self.assertEqual(second, [schedule.DayRange('09:00', '10:00')])
+
+
+class DayRangeTest(unittest.TestCase):
+    def test_sub(self):
+        day_range = schedule.DayRange('08:00', '13:00')
+        for other, expected in (
+            (('13:00', '14:00'), [('08:00', '13:00')]),
+            (('07:00', '08:00'), [('08:00', '13:00')]),
+            (('07:00', '14:00'), []),
+            (('08:00', '13:00'), []),
+            (('09:00', '10:00'), [('08:00', '09:00'), ('10:00', '13:00')]),
+            (('08:00', '10:00'), [('10:00', '13:00')]),
+            (('12:00', '13:00'), [('08:00', '12:00')]),
+        ):
+            self.assertEqual(
+                day_range - schedule.DayRange(*other),
+                [schedule.DayRange(*range_) for range_ in expected],
+                other,
+            )
+
+    def test_equality(self):
+        self.assertEqual(
+            schedule.DayRange('08:00', '13:00'),
+            schedule.DayRange(8 * 60, 13 * 60),
+        )
+        self.assertNotEqual(
+            schedule.DayRange('08:00', '13:00'),
+            schedule.DayRange('08:00', '13:01'),
+        )
+
+    def test_invalid(self):
+        self.assertRaises(TypeError, schedule.DayRange, '13:00', '08:00')
+
+
+class WeekScheduleSetTest(unittest.TestCase):
+    def test_per_day(self):
+        office = week_schedule(monday='08:00-17:00', tuesday='08:00-17:00')
+        lunch = week_schedule(monday='13:00-14:00', sunday='13:00-14:00')
+
+        result = office - lunch
+        self.assertEqual(result.name, 'test-test')
+        self.assertEqual(
+            result.monday,
+            schedule.DaySchedule.from_str('08:00-13:00, 14:00-17:00'),
+        )
+        self.assertEqual(result.tuesday, office.tuesday)
+        self.assertEqual(result.sunday, schedule.DaySchedule())
+        self.assertTrue(result.is_active(at(0, 12)))
+        self.assertFalse(result.is_active(at(0, 13, 30)))
+
+        self.assertEqual(
+            (office | lunch).sunday,
+            schedule.DaySchedule.from_str('13:00-14:00'),
+        )
+        self.assertEqual(
+            (office & lunch).monday,
+            schedule.DaySchedule.from_str('13:00-14:00'),
+        )
+        self.assertEqual(office.union(lunch, name='both').name, 'both')
+
+
+if __name__ == '__main__':
+    unittest.main()
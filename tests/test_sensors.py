@@ -0,0 +1,119 @@
+import ConfigParser
+import os
+import time
+import unittest
+
+# use the fake GPIO and DHT libraries
+os.environ['DEBUG_MODE'] = 'true'
+
+from domcontrol_common import conf, sensors
+
+
+class FakeDHT(object):
+    """
+    Returns the queued (humidity, temperature) reads, failing once they run
+    out, like the library does when it gets no answer.
+    """
+    DHT22 = 22
+
+    def __init__(self):
+        self.reads = []
+        self.calls = 0
+
+    def read(self, dht_type, pin):
+        self.calls += 1
+        if not self.reads:
+            return None, None
+
+        return self.reads.pop(0)
+
+
+class DHTSensorTest(unittest.TestCase):
+    def setUp(self):
+        self.dht = FakeDHT()
+        self.adafruit_dht = sensors.Adafruit_DHT
+        sensors.Adafruit_DHT = self.dht
+        config = ConfigParser.SafeConfigParser(conf.CONF_DEFAULTS)
+        config.add_section('general')
+        config.add_section('sensor.dht')
+        config.set('sensor.dht', 'type', 'DHTSensor')
+        config.set('sensor.dht', 'pin', '4')
+        config.set('sensor.dht', 'dht_type', '22')
+        config.set('sensor.dht', 'filters', '')
+        config.set('sensor.dht', 'dht_read_timeout', '0')
+        self.sensor = list(sensors.get_sensors(config))[0]
+
+    def tearDown(self):
+        sensors.Adafruit_DHT = self.adafruit_dht
+
+    def read(self):
+        # as if the minimum interval between reads had passed
+        if self.sensor.last_read is not None:
+            self.sensor.last_read -= self.sensor.min_read_interval
+
+        return self.sensor.read()
+
+    def test_read(self):
+        self.dht.reads.append((40.0, 21.5))
+
+        measure = self.read()
+
+        self.assertEqual(measure.get('humidity'), 40.0)
+        self.assertEqual(measure.get('temperature'), 21.5)
+        self.assertFalse(measure.stale)
+
+    def test_timeout_returns_the_cached_measure_as_stale(self):
+        self.dht.reads.append((40.0, 21.5))
+        good = self.read()
+
+        stale = self.read()
+
+        self.assertTrue(stale.stale)
+        self.assertEqual(stale.values, good.values)
+        self.assertFalse(good.stale)
+        self.assertIs(self.sensor.last_measure, good)
+
+    def test_timeout_without_previous_read(self):
+        self.assertIsNone(self.read())
+
+    def test_recovers_after_a_timeout(self):
+        self.dht.reads.append((40.0, 21.5))
+        self.read()
+        self.read()
+        self.dht.reads.append((41.0, 22.0))
+
+        measure = self.read()
+
+        self.assertFalse(measure.stale)
+        self.assertEqual(measure.get('temperature'), 22.0)
+
+    def test_read_too_soon_returns_the_cached_measure(self):
+        self.dht.reads.append((40.0, 21.5))
+        good = self.read()
+        self.sensor.last_read = time.time()
+
+        self.assertIs(self.sensor.read(), good)
+        self.assertEqual(self.dht.calls, 1)
+
+    def test_read_too_soon_after_a_timeout_is_stale(self):
+        self.dht.reads.append((40.0, 21.5))
+        self.read()
+        self.read()
+        self.sensor.last_read = time.time()
+
+        self.assertTrue(self.sensor.read().stale)
+        self.assertEqual(self.dht.calls, 2)
+
+    def test_retries_until_the_timeout(self):
+        self.sensor.read_timeout = 0.2
+        self.sensor.min_read_interval = 0.05
+        self.dht.reads.extend([(None, None), (None, None), (40.0, 21.5)])
+
+        measure = self.read()
+
+        self.assertEqual(measure.get('temperature'), 21.5)
+        self.assertEqual(self.dht.calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
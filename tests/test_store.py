@@ -0,0 +1,174 @@
+import glob
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from domcontrol_common import metrics, store
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def measures(count, start=1000, step=10):
+    return [
+        metrics.Measure(
+            timestamp=start + index * step,
+            temperature=20 + index % 5,
+            humidity=40 + index % 7,
+        )
+        for index in range(count)
+    ]
+
+
+class StoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'zone')
+        self.stores = []
+
+    def tearDown(self):
+        for open_store in list(self.stores):
+            self.close(open_store)
+
+        shutil.rmtree(self.tmpdir)
+
+    def open_store(self, **kwargs):
+        kwargs.setdefault('segment_size', 4)
+        new_store = store.Store(self.path, **kwargs)
+        self.stores.append(new_store)
+        return new_store
+
+    def close(self, zone_store):
+        if zone_store in self.stores:
+            self.stores.remove(zone_store)
+            zone_store.close()
+
+    def files(self, extension):
+        return sorted(
+            os.path.basename(path)
+            for path in glob.glob(os.path.join(self.path, '*.' + extension))
+        )
+
+    def records(self, zone_store, start=None, end=None):
+        # nan != nan, the missing values are compared as None
+        return [
+            tuple(None if value != value else value for value in record)
+            for segment in zone_store.segments
+            for record in segment.records(start, end)
+        ]
+
+    def test_rotation(self):
+        zone_store = self.open_store()
+        for measure in measures(10):
+            zone_store.append(measure)
+
+        self.assertEqual(
+            self.files('seg'),
+            ['0000001000.seg', '0000001040.seg', '0000001080.seg'],
+        )
+        self.assertEqual(
+            [record[0] for record in self.records(zone_store)],
+            range(1000, 1100, 10),
+        )
+
+    def test_rotation_within_the_same_timestamp(self):
+        zone_store = self.open_store(segment_size=2)
+        for _ in range(5):
+            zone_store.append(metrics.Measure(timestamp=1000, temperature=20))
+
+        self.assertEqual(len(self.files('seg')), 3)
+        self.assertEqual(len(self.records(zone_store)), 5)
+
+    def test_retention(self):
+        zone_store = self.open_store(max_segments=2)
+        for measure in measures(10):
+            zone_store.append(measure)
+
+        self.assertEqual(
+            self.files('seg'),
+            ['0000001040.seg', '0000001080.seg'],
+        )
+
+    def test_records_range(self):
+        zone_store = self.open_store()
+        for measure in measures(10):
+            zone_store.append(measure)
+
+        self.assertEqual(
+            [record[0] for record in self.records(zone_store, 1025, 1060)],
+            [1030, 1040, 1050, 1060],
+        )
+
+    def test_missing_metrics_are_nan(self):
+        zone_store = self.open_store()
+        zone_store.append(metrics.Measure(timestamp=1000, temperature=20))
+
+        segment = zone_store.segments[0]
+        record = list(segment.records())[0]
+        humidity = record[1 + zone_store.metrics.index('humidity')]
+        self.assertTrue(math.isnan(humidity))
+
+    def test_seal_and_reopen(self):
+        zone_store = self.open_store()
+        for measure in measures(10):
+            zone_store.append(measure)
+
+        written = self.records(zone_store)
+        self.close(zone_store)
+
+        # seals all the full segments on load
+        sealed_store = self.open_store(compress=True)
+        self.assertEqual(
+            self.files('gor'),
+            ['0000001000.gor', '0000001040.gor'],
+        )
+        self.assertEqual(self.files('seg'), ['0000001080.seg'])
+        self.assertEqual(self.records(sealed_store), written)
+        self.close(sealed_store)
+
+        read_only = self.open_store(read_only=True)
+        self.assertEqual(self.records(read_only), written)
+        self.assertRaises(IOError, read_only.append, measures(1)[0])
+
+    def test_read_only_needs_the_directory(self):
+        self.assertRaises(IOError, self.open_store, read_only=True)
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_query_after_seal_and_reopen(self):
+        zone_store = self.open_store()
+        for measure in measures(10):
+            zone_store.append(measure)
+
+        expected = zone_store.query()
+        self.close(zone_store)
+        self.close(self.open_store(compress=True))
+
+        read_only = self.open_store(read_only=True)
+
+        self.assertEqual(len(expected), 10)
+        self.assertEqual(read_only.query(), expected)
+        self.assertEqual(
+            read_only.query(start=1030, end=1060),
+            expected[3:7],
+        )
+        self.assertEqual(read_only.query(limit=5), expected[-5:])
+        self.assertEqual(read_only.query(end=1060, limit=2), expected[5:7])
+        self.assertEqual(read_only.query(limit=0), [])
+
+    @unittest.skipIf(numpy is None, 'numpy not installed')
+    def test_query_values(self):
+        zone_store = self.open_store()
+        zone_store.append(metrics.Measure(timestamp=1000, temperature=20))
+
+        record = zone_store.query()[0]
+        self.assertEqual(record['timestamp'], 1000)
+        self.assertEqual(record['temperature'], 20)
+        self.assertIsNone(record['humidity'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import threading
+import time
+import unittest
+
+from domcontrol_common import timers
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timers.Scheduler()
+        self.runs = []
+        self.runner = None
+
+    def tearDown(self):
+        self.scheduler.stop()
+        if self.runner is not None:
+            self.runner.join(5)
+
+    def record(self, name):
+        return lambda: self.runs.append(name)
+
+    def start(self):
+        self.runner = threading.Thread(target=self.scheduler.run)
+        self.runner.daemon = True
+        self.runner.start()
+
+    def run_until(self, delay):
+        self.scheduler.add(name='stop', func=self.scheduler.stop, delay=delay)
+        self.scheduler.run()
+
+    def test_runs_in_due_order(self):
+        self.scheduler.add(name='c', func=self.record('c'), delay=0.2)
+        self.scheduler.add(name='a', func=self.record('a'))
+        self.scheduler.add(name='b', func=self.record('b'), delay=0.1)
+
+        self.run_until(0.3)
+
+        self.assertEqual(self.runs, ['a', 'b', 'c'])
+
+    def test_same_due_time_keeps_insertion_order(self):
+        for name in 'abcd':
+            self.scheduler.add(name=name, func=self.record(name))
+
+        self.run_until(0.1)
+
+        self.assertEqual(self.runs, list('abcd'))
+
+    def test_cancelled_task_does_not_run(self):
+        task = self.scheduler.add(name='a', func=self.record('a'), delay=0.1)
+        self.scheduler.add(name='b', func=self.record('b'), delay=0.1)
+        self.scheduler.cancel(task)
+
+        self.run_until(0.2)
+
+        self.assertEqual(self.runs, ['b'])
+
+    def test_interval_until_cancelled(self):
+        task = self.scheduler.add(
+            name='tick',
+            func=self.record('tick'),
+            interval=0.05,
+        )
+        self.scheduler.add(
+            name='cancel',
+            func=lambda: self.scheduler.cancel(task),
+            delay=0.22,
+        )
+
+        self.run_until(0.4)
+
+        self.assertIn(len(self.runs), (4, 5))
+
+    def test_added_while_sleeping_wakes_it_up(self):
+        self.scheduler.add(name='late', func=self.record('late'), delay=60)
+        self.start()
+        time.sleep(0.05)
+
+        self.scheduler.add(name='now', func=self.scheduler.stop)
+        self.runner.join(5)
+
+        self.assertFalse(self.runner.is_alive())
+        self.assertEqual(self.runs, [])
+
+    def test_worker_tasks_run_on_the_worker(self):
+        worker = timers.Worker(name='test.worker')
+        worker.start()
+        done = threading.Event()
+
+        def work():
+            self.runs.append(threading.current_thread().name)
+            done.set()
+
+        self.scheduler.add(name='work', func=work, worker=worker)
+        self.start()
+        done.wait(5)
+        worker.stop()
+        worker.join(5)
+
+        self.assertEqual(self.runs, ['test.worker'])
+        self.assertFalse(worker.is_alive())
+
+    def test_pending_task_is_skipped(self):
+        worker = timers.Worker(name='test.worker')
+        release = threading.Event()
+
+        def slow():
+            self.runs.append('slow')
+            release.wait(5)
+
+        self.scheduler.add(
+            name='slow',
+            func=slow,
+            interval=0.05,
+            worker=worker,
+        )
+        worker.start()
+        self.run_until(0.3)
+        release.set()
+        worker.stop()
+        worker.join(5)
+
+        self.assertEqual(self.runs, ['slow'])
+
+
+class TaskTest(unittest.TestCase):
+    def test_failure_clears_pending(self):
+        def fail():
+            raise ValueError('failed')
+
+        task = timers.Task(name='fail', func=fail)
+        task.pending = True
+        task.run()
+
+        self.assertFalse(task.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
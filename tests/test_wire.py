@@ -0,0 +1,209 @@
+# encoding:utf-8
+import unittest
+
+from domcontrol_common import metrics, wire
+
+try:
+    from werkzeug.datastructures import MIMEAccept
+except ImportError:
+    MIMEAccept = None
+
+
+def parse_accept(header):
+    accepted = []
+    for part in header.split(','):
+        fields = part.strip().split(';')
+        quality = 1
+        for field in fields[1:]:
+            if field.strip().startswith('q='):
+                quality = float(field.strip()[2:])
+
+        accepted.append((fields[0].strip(), quality))
+
+    return MIMEAccept(accepted)
+
+
+class MsgpackTest(unittest.TestCase):
+    def assertRoundTrip(self, obj, expected=None):
+        self.assertEqual(
+            wire.decode_msgpack(wire.encode_msgpack(obj)),
+            obj if expected is None else expected,
+        )
+
+    def test_constants(self):
+        for obj in (None, True, False):
+            self.assertIs(wire.decode_msgpack(wire.encode_msgpack(obj)), obj)
+
+    def test_ints(self):
+        for obj in (
+            0, 1, 127, 128, 255, 256, 65535, 65536,
+            2 ** 32 - 1, 2 ** 32, 2 ** 63 - 1, 2 ** 64 - 1,
+            -1, -32, -33, -128, -129, -2 ** 31, -2 ** 31 - 1, -2 ** 63,
+            long(5),
+        ):
+            self.assertRoundTrip(obj)
+
+    def test_int_sizes(self):
+        self.assertEqual(len(wire.encode_msgpack(127)), 1)
+        self.assertEqual(len(wire.encode_msgpack(-32)), 1)
+        self.assertEqual(len(wire.encode_msgpack(1792261167)), 5)
+
+    def test_too_large_int(self):
+        self.assertRaises(Exception, wire.encode_msgpack, 2 ** 64)
+
+    def test_floats(self):
+        for obj in (0.0, -1.5, 21.537, 1e300):
+            self.assertRoundTrip(obj)
+
+    def test_strings(self):
+        for length in (0, 1, 31, 32, 255, 256, 65535, 65536):
+            self.assertRoundTrip('x' * length, u'x' * length)
+
+    def test_unicode(self):
+        self.assertRoundTrip(u'humedad relativa (ñ, °C)')
+        self.assertRoundTrip('caf\xc3\xa9', u'café')
+
+    def test_containers(self):
+        for length in (0, 1, 15, 16, 65536):
+            self.assertRoundTrip(range(length))
+            self.assertRoundTrip(
+                dict((u'key%d' % index, index) for index in range(length))
+            )
+
+        self.assertRoundTrip((1, 2), [1, 2])
+        self.assertRoundTrip({u'a': [None, {u'b': [True, 1.5]}]})
+
+    def test_unsupported(self):
+        self.assertRaises(TypeError, wire.encode_msgpack, object())
+        self.assertRaises(ValueError, wire.decode_msgpack, '\xc1')
+
+
+class MeasureTest(unittest.TestCase):
+    def setUp(self):
+        self.measure = metrics.Measure(
+            timestamp=1792261167,
+            temperature=21.5,
+            humidity=40,
+            presence=1792261100,
+        )
+
+    def test_none(self):
+        self.assertIsNone(wire.pack_measure(None))
+        self.assertIsNone(wire.unpack_measure(None))
+
+    def test_round_trip(self):
+        packed = wire.pack_measure(self.measure.to_dict())
+        self.assertEqual(len(packed), len(metrics.METRIC_NAMES))
+
+        measure = wire.unpack_measure(packed)
+        self.assertEqual(measure.values, self.measure.values)
+        self.assertFalse(measure.stale)
+
+    def test_stale(self):
+        self.measure.stale = True
+        packed = wire.pack_measure(self.measure.to_dict())
+        self.assertEqual(packed[-1], True)
+
+        measure = wire.unpack_measure(packed)
+        self.assertEqual(measure.values, self.measure.values)
+        self.assertTrue(measure.stale)
+
+    def test_other_metrics_order(self):
+        sender_metrics = ['humidity', 'unknown', 'temperature', 'timestamp']
+        measure = wire.unpack_measure(
+            [40, 3, 21.5, 1792261167, True],
+            metrics=sender_metrics,
+        )
+        self.assertEqual(measure.get('humidity'), 40)
+        self.assertEqual(measure.get('temperature'), 21.5)
+        self.assertEqual(measure.get('timestamp'), 1792261167)
+        self.assertIsNone(measure.get('presence'))
+        self.assertTrue(measure.stale)
+
+    def test_dict(self):
+        measure = wire.unpack_measure(self.measure.to_dict())
+        self.assertEqual(measure.values, self.measure.values)
+
+
+class DocumentTest(unittest.TestCase):
+    def setUp(self):
+        self.measures = {
+            u'zone': metrics.Measure(
+                timestamp=1792261167,
+                temperature=21.5,
+                stale=True,
+            ).to_dict(),
+            u'empty': None,
+        }
+
+    def assertMeasures(self, document):
+        self.assertEqual(document['version'], wire.VERSION)
+        measures = dict(
+            (name, wire.unpack_measure(data, document['metrics']))
+            for name, data in document['measures'].items()
+        )
+        self.assertIsNone(measures['empty'])
+        self.assertEqual(measures['zone'].get('temperature'), 21.5)
+        self.assertTrue(measures['zone'].stale)
+
+    def test_msgpack(self):
+        document = wire.pack_measures(self.measures)
+        self.assertMeasures(
+            wire.loads(wire.dumps(document, wire.MSGPACK), wire.MSGPACK)
+        )
+
+    def test_compact_json(self):
+        document = wire.pack_measures(self.measures)
+        data = wire.dumps(document, wire.COMPACT_JSON)
+        self.assertNotIn(' ', data)
+        self.assertMeasures(
+            wire.loads(data, wire.COMPACT_JSON + '; charset=utf-8')
+        )
+
+    def test_plain_json(self):
+        data = wire.dumps(self.measures, wire.JSON)
+        for content_type in (wire.JSON, None):
+            document = wire.loads(data, content_type)
+            self.assertEqual(
+                wire.unpack_measure(document['zone']).get('temperature'),
+                21.5,
+            )
+
+    def test_unsupported_version(self):
+        document = wire.pack_measures(self.measures)
+        document['version'] = wire.VERSION + 1
+        for content_type in (wire.MSGPACK, wire.COMPACT_JSON):
+            self.assertRaises(
+                ValueError,
+                wire.loads,
+                wire.dumps(document, content_type),
+                content_type,
+            )
+
+
+@unittest.skipIf(MIMEAccept is None, 'werkzeug not installed')
+class NegotiateTest(unittest.TestCase):
+    def test_client_preference(self):
+        self.assertEqual(
+            wire.negotiate(parse_accept(wire.ACCEPT)),
+            wire.MSGPACK,
+        )
+
+    def test_compact_json_fallback(self):
+        self.assertEqual(
+            wire.negotiate(parse_accept(
+                '%s, %s;q=0.5' % (wire.COMPACT_JSON, wire.JSON)
+            )),
+            wire.COMPACT_JSON,
+        )
+
+    def test_plain_json_default(self):
+        for header in ('*/*', 'text/html', 'application/json'):
+            self.assertEqual(
+                wire.negotiate(parse_accept(header)),
+                wire.JSON,
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()